@@ -1,3 +1,31 @@
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from core.testing import QueryBudgetMixin
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    budget_namespaces = ('accounts',)
+    query_budgets = {
+        'accounts:signup': 0,
+        'accounts:login': 0,
+        'accounts:logout': 4,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('reader', 'reader@example.com', 'password')
+
+    def test_signup_and_login_forms(self):
+        for url_name in ('accounts:signup', 'accounts:login'):
+            with self.subTest(url_name):
+                response = self.assertQueryBudget(url_name, lambda: self.client.get(reverse(url_name)))
+                self.assertEqual(response.status_code, 200)
+
+    def test_logout(self):
+        self.client.force_login(self.user)
+        response = self.assertQueryBudget(
+            'accounts:logout', lambda: self.client.post(reverse('accounts:logout'))
+        )
+        self.assertEqual(response.status_code, 302)
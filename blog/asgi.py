@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'blog.settings')
+# 公開ページを非同期版のビューで処理する（settings.ASYNC_PUBLIC_VIEWS）
+os.environ.setdefault('BLOG_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -37,6 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.sitemaps',
     'accounts',
     'core',
     'posts',
@@ -44,11 +46,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -76,13 +80,78 @@ WSGI_APPLICATION = 'blog.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# 接続ごとに設定する SQLite の PRAGMA。
+# WAL にすると読み込みが書き込みを待たなくなり、synchronous=NORMAL は WAL では安全なまま
+# コミットごとの fsync を減らします。`manage.py bench_sqlite` で効果を確認できます。
+SQLITE_PRAGMAS = [
+    'journal_mode=WAL',
+    'synchronous=NORMAL',
+    'mmap_size=134217728',
+    'cache_size=-20000',
+    'temp_store=MEMORY',
+]
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # 接続を使い回し、PRAGMA の設定と接続のコストをリクエストごとに払わない
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # 書き込みロックの待ち時間（秒）。超えた場合は core.db.write_with_retry がやり直す
+            'timeout': 20,
+            # トランザクション開始時に書き込みロックを取り、途中での昇格失敗（即時の
+            # "database is locked"）を避ける
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': ';'.join(f'PRAGMA {pragma}' for pragma in SQLITE_PRAGMAS),
+        },
     }
 }
 
+# 公開ページの読み込みを振り分けるリードレプリカ（core.routers.PrimaryReplicaRouter）。
+# ローカルでは `manage.py snapshot_replicas` が default のコピーを定期的に作ります。
+SQLITE_REPLICA_COUNT = 0
+DATABASE_REPLICAS = []
+for index in range(1, SQLITE_REPLICA_COUNT + 1):
+    alias = f'replica{index}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME': BASE_DIR / 'var' / 'replicas' / f'{alias}.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['core.routers.PrimaryReplicaRouter']
+# レプリカがプライマリに追いつくまでの最大の遅れ（秒）。コンテンツバージョンが進んでから
+# この間は、レプリカから読んだページをキャッシュせず、ETag も付けない（core.cache）
+DATABASE_REPLICA_LAG_SECONDS = 60
+# 書き込んだクライアントの読み込みを、この秒数だけプライマリに固定する
+# （レプリカの更新間隔より長くしておく）
+DATABASE_REPLICA_PIN_SECONDS = 120
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# 複数プロセスで運用する場合は Redis や Memcached など共有のバックエンドに切り替えてください。
+
+# コンテンツバージョン（core.cache）はワーカー（runworker）と Web のプロセスで共有するので、
+# プロセスをまたいで読めるキャッシュを使う。LocMemCache は core.checks がエラーにします。
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'var' / 'cache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+# True にすると、投稿一覧・詳細・カテゴリ/タグ一覧に非同期版のビューを使います（posts.async_views）。
+# blog/asgi.py が環境変数 BLOG_ASYNC_VIEWS=1 で有効にします。
+ASYNC_PUBLIC_VIEWS = os.environ.get('BLOG_ASYNC_VIEWS') == '1'
+
+# 匿名ユーザー向けの公開ページを丸ごとキャッシュする（core.cache.CachedPageMixin）
+PAGE_CACHE_ENABLED = True
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -121,6 +190,9 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
 LOGIN_URL = 'accounts:login'
 LOGIN_REDIRECT_URL = 'posts:post_list'
 LOGOUT_REDIRECT_URL = 'posts:post_list'
@@ -129,3 +201,36 @@ LOGOUT_REDIRECT_URL = 'posts:post_list'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# core.tasks のジョブキュー。True にするとワーカーを使わずコミット後にその場で実行します。
+TASK_QUEUE_EAGER = False
+# 定期実行するタスクと間隔（秒）。`manage.py runworker` が周期ごとに 1 回だけ積みます。
+TASK_QUEUE_PERIODIC = {
+    'posts.refresh_trending': 15 * 60,
+    'comments.flush_comment_spool': 10,
+    'posts.rebuild_related_posts': 24 * 60 * 60,
+    'posts.flush_post_views': 60,
+    'posts.refresh_popular_posts': 10 * 60,
+    'posts.publish_due_posts': 60,
+}
+
+# リクエストごとのクエリ数・DB 時間・描画時間の記録先（JSON Lines）。None のときは記録しない。
+# ファイルはローテーションせずに追記し続けるので、既定では無効にしてあります。計測するときだけ
+# 環境変数 BLOG_INSTRUMENTATION_LOG に記録先のパスを指定して起動し、
+# `manage.py instrumentation_report` で集計します。
+INSTRUMENTATION_LOG = os.environ.get('BLOG_INSTRUMENTATION_LOG') or None
+# `manage.py benchmark` の結果の保存先。コミットごとの結果を `--compare` で比べられます。
+BENCHMARK_RESULTS_DIR = BASE_DIR / 'var' / 'benchmarks'
+
+# True にすると、コメントをスプールファイルに追記してワーカーがまとめて取り込みます。
+COMMENT_SPOOL_ENABLED = False
+COMMENT_SPOOL_DIR = BASE_DIR / 'var' / 'comment-spool'
+COMMENT_SPOOL_BATCH_SIZE = 500
+# スプールが有効なときの、同じ IP アドレスからのコメント投稿の上限（件数, 秒）
+COMMENT_THROTTLE_RATE = (5, 60)
+# アプリの前にあるリバースプロキシの段数。0 なら REMOTE_ADDR を、1 以上なら各段が付けた
+# X-Forwarded-For からクライアントのアドレスを取る（comments.views.client_address）
+TRUSTED_PROXY_COUNT = 0
+
+# 管理画面の投稿・コメント一覧で数える件数の上限（core.changelist）。超えた分は「〜件以上」と表示します。
+ADMIN_COUNT_LIMIT = 10000
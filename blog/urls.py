@@ -14,12 +14,33 @@
     1. include()関数をインポートします：from django.urls import include, path
     2. urlpatternsに追加します：path('blog/', include('blog.urls'))
 """
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
+from django.contrib.sitemaps import views as sitemap_views
 from django.urls import include, path
 
+from posts.feeds import syndication_cache
+from posts.sitemaps import sitemaps
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('accounts.urls')),
+    path(
+        'sitemap.xml',
+        syndication_cache(sitemap_views.index),
+        {'sitemaps': sitemaps, 'sitemap_url_name': 'sitemap_section'},
+        name='sitemap',
+    ),
+    path(
+        'sitemap-<section>.xml',
+        syndication_cache(sitemap_views.sitemap),
+        {'sitemaps': sitemaps},
+        name='sitemap_section',
+    ),
     path('', include('comments.urls')),
     path('', include('posts.urls')),
 ]
+
+if settings.DEBUG:
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,11 +1,23 @@
 from django.contrib import admin
 
+from core.changelist import ScalableAdminMixin
+
+from . import search
 from .models import Comment
 
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ('post', 'name', 'email', 'is_public', 'created_at')
+    list_select_related = ('post',)
+    # 行の表示（__str__）にはコメントの本文を使うので、投稿の大きな列だけ読まない
+    list_defer = ('post__body', 'post__excerpt', 'post__summary', 'post__image_renditions')
     list_filter = ('is_public', 'created_at')
     search_fields = ('name', 'email', 'body', 'post__title')
     autocomplete_fields = ('post',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # 本文や投稿タイトルへの LIKE を避け、全文検索の索引で絞り込む
+        if not search_term.strip() or not search.is_available(queryset.db):
+            return super().get_search_results(request, queryset, search_term)
+        return search.filter_queryset(queryset, search_term), False
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from comments import spool
+
+
+class Command(BaseCommand):
+    help = 'スプールに溜まったコメントを DB に取り込みます。--stats で滞留状況を表示します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stats', action='store_true', help='取り込まずに滞留状況だけを表示します。')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        if not options['stats']:
+            count = spool.flush(batch_size=options['batch_size'], using=options['database'])
+            self.stdout.write(self.style.SUCCESS(f'{count} 件のコメントを取り込みました。'))
+        stats = spool.stats()
+        self.stdout.write(f"滞留件数: {stats['depth']}")
+        if stats['oldest_age'] is not None:
+            self.stdout.write(f"最も古いコメントの待ち時間: {stats['oldest_age']:.1f} 秒")
+        last_flush = stats['last_flush']
+        if last_flush:
+            self.stdout.write(
+                f"直近の取り込み: {last_flush['flushed_at']:%Y-%m-%d %H:%M:%S} "
+                f"{last_flush['count']} 件 / {last_flush['duration'] * 1000:.0f} ms "
+                f"(最大遅延 {last_flush['max_latency']:.1f} 秒)"
+            )
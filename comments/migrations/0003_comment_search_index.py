@@ -0,0 +1,59 @@
+from django.db import migrations
+
+CREATE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS comments_comment_fts "
+    "USING fts5(name, email, body, content='comments_comment', content_rowid='id', tokenize='trigram')"
+)
+
+TRIGGERS_SQL = (
+    """
+    CREATE TRIGGER IF NOT EXISTS comments_comment_fts_insert AFTER INSERT ON comments_comment BEGIN
+        INSERT INTO comments_comment_fts (rowid, name, email, body)
+        VALUES (new.id, new.name, new.email, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS comments_comment_fts_delete AFTER DELETE ON comments_comment BEGIN
+        INSERT INTO comments_comment_fts (comments_comment_fts, rowid, name, email, body)
+        VALUES ('delete', old.id, old.name, old.email, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS comments_comment_fts_update
+    AFTER UPDATE OF name, email, body ON comments_comment BEGIN
+        INSERT INTO comments_comment_fts (comments_comment_fts, rowid, name, email, body)
+        VALUES ('delete', old.id, old.name, old.email, old.body);
+        INSERT INTO comments_comment_fts (rowid, name, email, body)
+        VALUES (new.id, new.name, new.email, new.body);
+    END
+    """,
+)
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_SQL)
+    for sql in TRIGGERS_SQL:
+        schema_editor.execute(sql)
+    schema_editor.execute("INSERT INTO comments_comment_fts (comments_comment_fts) VALUES ('rebuild')")
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for name in ('insert', 'delete', 'update'):
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS comments_comment_fts_{name}')
+    schema_editor.execute('DROP TABLE IF EXISTS comments_comment_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0002_comment_spool_id'),
+        ('posts', '0003_post_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:06
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0003_comment_search_index'),
+    ]
+
+    operations = [
+        # 既定値は Python 側だけの変更なので、テーブルは作り直さない
+        # （SQLite では作り直すと全文検索のトリガーが消える）
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='comment',
+                    name='created_at',
+                    field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+                ),
+            ],
+        ),
+    ]
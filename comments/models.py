@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 from core.models import TimeStampedModel
 
@@ -18,6 +19,10 @@ class Comment(TimeStampedModel):
     email = models.EmailField()
     body = models.TextField()
     is_public = models.BooleanField(default=True, db_index=True)
+    # スプールからの取り込みでは投稿された日時を入れるので、auto_now_add ではなく既定値にする
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    # スプール経由で取り込んだコメントの ID。取り込みをやり直しても重複しないようにする
+    spool_id = models.UUIDField(null=True, blank=True, unique=True, editable=False)
 
     objects = CommentQuerySet.as_manager()
 
@@ -0,0 +1,38 @@
+"""
+SQLite FTS5 を使ったコメントの全文検索（管理画面の検索用）。
+
+`comments_comment_fts` は comments_comment を外部コンテンツとする FTS5 テーブルで、
+名前・メールアドレス・本文を trigram で索引します。スプールの `bulk_create` や
+`QuerySet.update()` でも索引がずれないよう、更新はシグナルではなく DB のトリガーで行います
+（comments/migrations/0003_comment_search_index.py）。
+
+SQLite ではテーブルの作り直しを伴うマイグレーションでトリガーが消えるので、
+comments_comment を変更したときはトリガーを作り直し、`rebuild()` を呼んでください。
+"""
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from posts import search as post_search
+
+FTS_TABLE = 'comments_comment_fts'
+COLUMNS = ('name', 'email', 'body')
+
+
+def is_available(using=DEFAULT_DB_ALIAS) -> bool:
+    return connections[using].vendor == 'sqlite'
+
+
+def filter_queryset(queryset, query: str):
+    """Comment のクエリセットを、コメントの索引と投稿タイトルの索引で絞り込みます。"""
+    comments = post_search.match_rowids(query, table=FTS_TABLE, columns=COLUMNS)
+    if comments is None:
+        return queryset
+    posts = post_search.match_rowids(query, columns=('title',))
+    return queryset.filter(pk__in=comments) | queryset.filter(post__in=posts)
+
+
+def rebuild(using=DEFAULT_DB_ALIAS):
+    """索引を comments_comment から作り直します。"""
+    if not is_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.cache import bump
+from posts import counters
+from posts.models import Post
+
+from .models import Comment
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def bump_commented_post(sender, instance, using, origin=None, **kwargs):
+    if isinstance(origin, Post):
+        # 投稿ごと削除される場合は投稿側のシグナルに任せる
+        return
+    # 公開・非公開の切り替えも含めて数え直し、件数が変わったら一覧（カードの件数）も無効化する
+    namespaces = [f'post:{instance.post.slug}']
+    if counters.refresh_comment_counts([instance.post_id], using=using):
+        namespaces.append('posts')
+    bump(*namespaces, using=using)
@@ -0,0 +1,243 @@
+"""
+コメントのスプール（一時書き込み）。
+
+`COMMENT_SPOOL_ENABLED` が有効なとき、検証済みのコメントは DB に 1 件ずつ INSERT せず、
+スプールファイル（JSON Lines）に追記します。ワーカーの `comments.flush_comment_spool`
+タスクがファイルを退避してから `bulk_create` でまとめて取り込むので、コメントが集中しても
+SQLite の書き込みロックを投稿の編集と 1 件ずつ取り合うことがありません。
+
+取り込みは `Comment.spool_id` の一意制約で冪等にしてあり、途中で落ちても退避済みの
+ファイルを次回そのまま取り込み直せます。
+"""
+import fcntl
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signing import BadSignature
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.cache import bump
+from core.db import write_with_retry
+
+from .models import Comment
+
+logger = logging.getLogger(__name__)
+
+SPOOL_NAME = 'comments.jsonl'
+FLUSHING_SUFFIX = '.flushing'
+STATS_KEY = 'comment-spool:last-flush'
+PENDING_COOKIE = 'pending_comments'
+PENDING_SALT = 'comments.pending'
+PENDING_MAX_AGE = 60 * 60
+PENDING_LIMIT = 5
+
+
+def is_enabled() -> bool:
+    return getattr(settings, 'COMMENT_SPOOL_ENABLED', False)
+
+
+def spool_dir() -> Path:
+    return Path(settings.COMMENT_SPOOL_DIR)
+
+
+@contextmanager
+def _locked_spool():
+    """
+    現在のスプールファイルをロックして開きます。
+
+    ロックを待つ間に退避（リネーム）された場合は、開いたファイルとパスの inode が
+    食い違うので、新しいファイルを開き直します。
+    """
+    path = spool_dir() / SPOOL_NAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    while True:
+        handle = open(path, 'a', encoding='utf-8')
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            current = os.stat(path)
+        except FileNotFoundError:
+            current = None
+        if current is not None and current.st_ino == os.fstat(handle.fileno()).st_ino:
+            break
+        handle.close()
+    try:
+        yield path, handle
+    finally:
+        handle.close()
+
+
+def append(post, cleaned_data) -> str:
+    """検証済みのコメントをスプールに追記し、スプール ID を返します。"""
+    spool_id = uuid.uuid4().hex
+    record = {
+        'spool_id': spool_id,
+        'post_id': post.pk,
+        'name': cleaned_data['name'],
+        'email': cleaned_data['email'],
+        'body': cleaned_data['body'],
+        'submitted_at': timezone.now().isoformat(),
+    }
+    line = json.dumps(record, ensure_ascii=False) + '\n'
+    with _locked_spool() as (path, handle):
+        handle.write(line)
+        handle.flush()
+    return spool_id
+
+
+def _rotate() -> list:
+    """現在のスプールを退避し、取り込み待ちのファイルを古い順に返します。"""
+    directory = spool_dir()
+    if (directory / SPOOL_NAME).exists():
+        with _locked_spool() as (path, handle):
+            if os.fstat(handle.fileno()).st_size:
+                path.rename(directory / f'comments.{time.time_ns()}.{os.getpid()}{FLUSHING_SUFFIX}')
+    return sorted(directory.glob(f'*{FLUSHING_SUFFIX}'))
+
+
+def _read(path) -> list:
+    records = []
+    with open(path, encoding='utf-8') as handle:
+        for number, line in enumerate(handle, 1):
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # 書き込み途中で落ちた行は捨てる
+                logger.warning('Skipping malformed line %s in %s', number, path)
+    return records
+
+
+def _import(records, batch_size, using) -> int:
+    from posts import counters
+    from posts.models import Post
+
+    slugs = dict(
+        Post.objects.using(using)
+        .filter(pk__in={record['post_id'] for record in records})
+        .values_list('pk', 'slug')
+    )
+    comments = [
+        Comment(
+            post_id=record['post_id'],
+            name=record['name'],
+            email=record['email'],
+            body=record['body'],
+            spool_id=uuid.UUID(record['spool_id']),
+            created_at=parse_datetime(record['submitted_at']),
+        )
+        for record in records
+        if record['post_id'] in slugs
+    ]
+
+    def save():
+        Comment.objects.using(using).bulk_create(
+            comments, batch_size=batch_size, ignore_conflicts=True
+        )
+        # bulk_create は保存シグナルを送らないので、件数とキャッシュはここで更新する
+        changed = counters.refresh_comment_counts(slugs, using=using)
+        bump(
+            *(f'post:{slugs[comment.post_id]}' for comment in comments),
+            'posts' if changed else None,
+            using=using,
+        )
+
+    write_with_retry(save, using=using)
+    return len(comments)
+
+
+def flush(*, batch_size=None, using=DEFAULT_DB_ALIAS) -> int:
+    """スプールのコメントを DB に取り込み、取り込んだ件数を返します。"""
+    batch_size = batch_size or getattr(settings, 'COMMENT_SPOOL_BATCH_SIZE', 500)
+    if not spool_dir().exists():
+        return 0
+    started = time.monotonic()
+    total = 0
+    oldest = None
+    for path in _rotate():
+        records = _read(path)
+        if records:
+            total += _import(records, batch_size, using)
+            submitted = min(parse_datetime(record['submitted_at']) for record in records)
+            oldest = submitted if oldest is None else min(oldest, submitted)
+        path.unlink()
+    if total:
+        cache.set(STATS_KEY, {
+            'flushed_at': timezone.now(),
+            'count': total,
+            'duration': time.monotonic() - started,
+            'max_latency': (timezone.now() - oldest).total_seconds(),
+        }, None)
+    return total
+
+
+def _spool_files() -> list:
+    directory = spool_dir()
+    return sorted(directory.glob(f'*{FLUSHING_SUFFIX}')) + [directory / SPOOL_NAME]
+
+
+def pending(spool_ids) -> list:
+    """スプールに残っている（まだ取り込まれていない）コメントを返します。"""
+    spool_ids = set(spool_ids)
+    if not spool_ids or not spool_dir().exists():
+        return []
+    found = []
+    for path in _spool_files():
+        try:
+            records = _read(path)
+        except FileNotFoundError:
+            # 読む前に取り込みが終わって削除された
+            continue
+        for record in records:
+            if record['spool_id'] in spool_ids:
+                record['created_at'] = parse_datetime(record['submitted_at'])
+                found.append(record)
+    return found
+
+
+def stats() -> dict:
+    """スプールに溜まっている件数と、直近の取り込みの記録を返します。"""
+    depth = 0
+    oldest = None
+    if spool_dir().exists():
+        for path in _spool_files():
+            try:
+                records = _read(path)
+            except FileNotFoundError:
+                continue
+            depth += len(records)
+            if records and oldest is None:
+                oldest = parse_datetime(records[0]['submitted_at'])
+    return {
+        'depth': depth,
+        'oldest_age': (timezone.now() - oldest).total_seconds() if oldest else None,
+        'last_flush': cache.get(STATS_KEY),
+    }
+
+
+def pending_ids(request) -> list:
+    try:
+        value = request.get_signed_cookie(PENDING_COOKIE, salt=PENDING_SALT, max_age=PENDING_MAX_AGE)
+    except (KeyError, BadSignature):
+        return []
+    return [spool_id for spool_id in value.split(',') if spool_id]
+
+
+def remember_pending(request, response, spool_id):
+    """投稿者自身には、取り込み前のコメントも表示できるよう ID を Cookie に残します。"""
+    ids = (pending_ids(request) + [spool_id])[-PENDING_LIMIT:]
+    response.set_signed_cookie(
+        PENDING_COOKIE,
+        ','.join(ids),
+        salt=PENDING_SALT,
+        max_age=PENDING_MAX_AGE,
+        httponly=True,
+        samesite='Lax',
+    )
@@ -0,0 +1,10 @@
+from django.db import DEFAULT_DB_ALIAS
+
+from core.tasks import task
+
+from . import spool
+
+
+@task(max_attempts=1)
+def flush_comment_spool(using=DEFAULT_DB_ALIAS):
+    spool.flush(using=using)
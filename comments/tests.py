@@ -1,3 +1,219 @@
-from django.test import TestCase
+import json
+import tempfile
+from pathlib import Path
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+
+from core.testing import LOCMEM_CACHES, QueryBudgetMixin
+from posts.models import Post
+
+from . import spool
+from .models import Comment
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    budget_namespaces = ('comments',)
+    query_budgets = {
+        'comments:comment_page': 2,
+        'comments:comment_create': 3,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        author = get_user_model().objects.create_user('author', 'author@example.com', 'password')
+        cls.post = Post.objects.create(
+            title='投稿', body='本文', author=author, status=Post.Status.PUBLISHED
+        )
+        Comment.objects.bulk_create(
+            Comment(post=cls.post, name='読者', email='reader@example.com', body=f'コメント {number}')
+            for number in range(120)
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_comment_page(self):
+        first = self.client.get(self.post.get_absolute_url()).context['comments_page']
+        url = reverse('comments:comment_page', kwargs={'post_slug': self.post.slug})
+        response = self.assertQueryBudget(
+            'comments:comment_page',
+            lambda: self.client.get(url, {'cursor': first.next_cursor}),
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_comment_create(self):
+        url = reverse('comments:comment_create', kwargs={'post_slug': self.post.slug})
+        data = {'name': '読者', 'email': 'reader@example.com', 'body': 'こんにちは'}
+        response = self.assertQueryBudget('comments:comment_create', lambda: self.client.post(url, data))
+        self.assertEqual(response.status_code, 302)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CommentCountInvalidationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = Post.objects.create(title='投稿', body='本文', status=Post.Status.PUBLISHED)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_new_comment_updates_list_count(self):
+        url = reverse('posts:post_list')
+        visitor = self.client_class()
+        first = visitor.get(url)
+        self.assertNotContains(first, 'コメント 1')
+        data = {'name': '読者', 'email': 'reader@example.com', 'body': 'こんにちは'}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('comments:comment_create', kwargs={'post_slug': self.post.slug}), data)
+        # 投稿者以外が再検証しても 304 にならず、新しい訪問者にも新しい件数が見える
+        response = visitor.get(url, headers={'If-None-Match': first['ETag']})
+        self.assertContains(response, 'コメント 1')
+        self.assertContains(self.client_class().get(url), 'コメント 1')
+
+    def test_editing_a_comment_keeps_list_version(self):
+        comment = Comment.objects.create(post=self.post, name='読者', email='reader@example.com', body='a')
+        url = reverse('posts:post_list')
+        etag = self.client.get(url)['ETag']
+        comment.body = 'b'
+        with self.captureOnCommitCallbacks(execute=True):
+            comment.save()
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CommentSpoolTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = Post.objects.create(title='投稿', body='本文', status=Post.Status.PUBLISHED)
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.spool_dir = Path(directory.name)
+        settings = override_settings(COMMENT_SPOOL_ENABLED=True, COMMENT_SPOOL_DIR=self.spool_dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def submit(self, client, body='こんにちは'):
+        data = {'name': '読者', 'email': 'reader@example.com', 'body': body}
+        return client.post(reverse('comments:comment_create', kwargs={'post_slug': self.post.slug}), data)
+
+    def spooled(self):
+        return [json.loads(line) for line in (self.spool_dir / spool.SPOOL_NAME).read_text().splitlines()]
+
+    def test_comment_is_spooled_and_shown_only_to_its_poster(self):
+        response = self.submit(self.client)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(spool.PENDING_COOKIE, response.cookies)
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual([record['body'] for record in self.spooled()], ['こんにちは'])
+
+        self.assertContains(self.client.get(self.post.get_absolute_url()), 'こんにちは')
+        self.assertNotContains(self.client_class().get(self.post.get_absolute_url()), 'こんにちは')
+
+    def test_flush_keeps_submitted_time_and_is_idempotent(self):
+        self.submit(self.client)
+        record, = self.spooled()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(spool.flush(), 1)
+        comment = Comment.objects.get()
+        self.assertEqual(comment.created_at, parse_datetime(record['submitted_at']))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+        # 取り込み後に落ちて退避ファイルが残っていても、取り込み直しで重複しない
+        (self.spool_dir / f'comments.1{spool.FLUSHING_SUFFIX}').write_text(json.dumps(record) + '\n')
+        spool.flush()
+        self.assertEqual(Comment.objects.count(), 1)
+
+    @override_settings(COMMENT_THROTTLE_RATE=(2, 60))
+    def test_spooled_comments_are_throttled_per_client(self):
+        self.assertEqual([self.submit(self.client).status_code for _ in range(3)], [302, 302, 429])
+        with self.settings(COMMENT_SPOOL_ENABLED=False):
+            # DB に直接書き込むときは上限を設けない
+            self.assertEqual(self.submit(self.client).status_code, 302)
+
+    @override_settings(COMMENT_THROTTLE_RATE=(1, 60), TRUSTED_PROXY_COUNT=1)
+    def test_clients_behind_a_proxy_are_told_apart(self):
+        def submit(forwarded_for):
+            data = {'name': '読者', 'email': 'reader@example.com', 'body': 'こんにちは'}
+            url = reverse('comments:comment_create', kwargs={'post_slug': self.post.slug})
+            return self.client.post(url, data, REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR=forwarded_for)
+
+        self.assertEqual(submit('203.0.113.1').status_code, 302)
+        self.assertEqual(submit('203.0.113.2').status_code, 302)
+        # クライアントが書き足した前半は使わず、プロキシが見たアドレスで数える
+        self.assertEqual(submit('198.51.100.9, 203.0.113.1').status_code, 429)
+
+    def test_pending_cookie_is_cleared_after_import(self):
+        self.submit(self.client)
+        spool.flush()
+        response = self.client.get(self.post.get_absolute_url())
+        self.assertContains(response, 'こんにちは', count=1)
+        self.assertEqual(response.cookies[spool.PENDING_COOKIE].value, '')
+        # 取り込み後は投稿者にも共有のキャッシュと 304 が使われる
+        etag = self.client.get(self.post.get_absolute_url())['ETag']
+        response = self.client.get(self.post.get_absolute_url(), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(ADMIN_COUNT_LIMIT=50)
+class CommentAdminTests(QueryBudgetMixin, TestCase):
+    query_budgets = {
+        'admin:comments_comment_changelist': 6,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.post = Post.objects.create(title='京都の旅行記', body='本文', status=Post.Status.PUBLISHED)
+        other = Post.objects.create(title='大阪の食べ歩き', body='本文', status=Post.Status.PUBLISHED)
+        # bulk_create でも索引（DB のトリガー）に登録される
+        Comment.objects.bulk_create(
+            Comment(post=other, name='読者', email='reader@example.com', body=f'コメント {number}')
+            for number in range(120)
+        )
+        Comment.objects.create(post=cls.post, name='旅人', email='traveler@example.com', body='紅葉がきれいでした')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.url = reverse('admin:comments_comment_changelist')
+
+    def test_keyset_pages_and_bounded_count(self):
+        response = self.assertQueryBudget(
+            'admin:comments_comment_changelist', lambda: self.client.get(self.url)
+        )
+        cl = response.context['cl']
+        self.assertEqual(cl.result_count, 50)
+        self.assertTrue(cl.count_is_bounded)
+        self.assertEqual(cl.result_list[0].name, '旅人')
+        self.assertContains(response, '50 件以上の')
+
+        response = self.assertQueryBudget(
+            'admin:comments_comment_changelist', lambda: self.client.get(self.url + cl.next_page_url())
+        )
+        next_page = response.context['cl'].result_list
+        self.assertEqual(len(next_page), 121 - cl.list_per_page)
+        self.assertLess(next_page[0].pk, cl.result_list[-1].pk)
+
+        response = self.client.get(self.url, {'cursor': 'invalid'})
+        self.assertRedirects(response, f'{self.url}?e=1')
+
+    def test_search_uses_index(self):
+        Comment.objects.filter(name='旅人').update(body='雪景色がきれいでした')
+        for query, expected in (
+            ('雪景色', ['旅人']),
+            ('紅葉がき', []),
+            ('traveler@', ['旅人']),
+            ('京都の旅行', ['旅人']),
+            ('旅人', ['旅人']),
+        ):
+            with self.subTest(query):
+                response = self.client.get(self.url, {'q': query})
+                self.assertEqual([comment.name for comment in response.context['cl'].result_list], expected)
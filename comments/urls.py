@@ -1,10 +1,11 @@
 from django.urls import path
 
-from .views import CommentCreateView
+from .views import CommentCreateView, CommentPageView
 
 app_name = 'comments'
 
 urlpatterns = [
+    path('<slug:post_slug>/comments/', CommentPageView.as_view(), name='comment_page'),
     path('<slug:post_slug>/comments/new/', CommentCreateView.as_view(), name='comment_create'),
 ]
 
@@ -1,14 +1,77 @@
+from django.conf import settings
 from django.contrib import messages
-from django.http import HttpResponseRedirect
+from django.core.cache import cache
+from django.http import Http404, HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
+from django.views.generic import TemplateView
 from django.views.generic.edit import CreateView
 
+from core.cache import CachedPageMixin
+from core.db import write_with_retry
+from core.pagination import InvalidCursor, KeysetPaginator
 from posts.models import Post
 
+from . import spool
 from .forms import CommentForm
 from .models import Comment
 
+COMMENTS_PER_PAGE = 50
+# (post, is_public, created_at) のインデックスをそのまま辿れる並び順
+COMMENT_ORDERING = ('created_at', 'id')
+
+
+def comment_page(post, cursor=None):
+    """投稿の公開コメントを古い順にキーセット方式で 1 ページ分返します。"""
+    paginator = KeysetPaginator(post.comments.public(), COMMENTS_PER_PAGE, ordering=COMMENT_ORDERING)
+    return paginator.page(cursor)
+
+
+async def acomment_page(post_slug, cursor=None):
+    """
+    `comment_page()` の非同期版。
+
+    投稿の読み込みと並行して実行できるよう、投稿のスラッグで絞り込みます。
+    """
+    comments = Comment.objects.public().filter(post__slug=post_slug)
+    paginator = KeysetPaginator(comments, COMMENTS_PER_PAGE, ordering=COMMENT_ORDERING)
+    return await paginator.apage(cursor)
+
+
+def client_address(request) -> str:
+    """
+    クライアントの IP アドレスを返します。
+
+    `TRUSTED_PROXY_COUNT` 段のリバースプロキシの後ろでは、各段が X-Forwarded-For の末尾に
+    付け足したアドレスのうち、最も外側のプロキシが見たものを使います（それより前はクライアントが
+    自由に書けるので信用しない）。
+    """
+    proxies = getattr(settings, 'TRUSTED_PROXY_COUNT', 0)
+    if proxies:
+        forwarded = [
+            address.strip() for address in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')
+            if address.strip()
+        ]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def is_throttled(request) -> bool:
+    """同じ IP アドレスからの投稿が `COMMENT_THROTTLE_RATE` を超えたかどうかを返します。"""
+    limit, period = getattr(settings, 'COMMENT_THROTTLE_RATE', (5, 60))
+    if not limit:
+        return False
+    key = f'comment-throttle:{client_address(request)}'
+    # 期限付きでカウンタを作り、以後は incr だけで数える
+    if cache.add(key, 1, period):
+        return False
+    try:
+        return cache.incr(key) > limit
+    except ValueError:
+        cache.set(key, 1, period)
+        return False
+
 
 class CommentCreateView(CreateView):
     model = Comment
@@ -16,15 +79,53 @@ class CommentCreateView(CreateView):
     template_name = 'comments/comment_form.html'
 
     def dispatch(self, request, *args, **kwargs):
-        self.post_obj = get_object_or_404(Post.objects.published(), slug=kwargs['post_slug'])
+        self.post_obj = get_object_or_404(
+            Post.objects.published().only('pk', 'slug'),
+            slug=kwargs['post_slug'],
+        )
         return super().dispatch(request, *args, **kwargs)
 
     def form_valid(self, form):
+        if spool.is_enabled():
+            # スプールへの追記は DB の書き込みより軽く、取り込みまで件数が膨らみうるので上限を設ける
+            if is_throttled(self.request):
+                form.add_error(None, 'コメントの投稿が続いています。しばらくしてからもう一度お試しください。')
+                response = self.form_invalid(form)
+                response.status_code = 429
+                return response
+            spool_id = spool.append(self.post_obj, form.cleaned_data)
+            messages.success(self.request, 'コメントを受け付けました。まもなく反映されます。')
+            response = HttpResponseRedirect(self.get_success_url())
+            spool.remember_pending(self.request, response, spool_id)
+            return response
         self.object = form.save(commit=False)
         self.object.post = self.post_obj
-        self.object.save()
+        write_with_retry(self.object.save)
         messages.success(self.request, 'コメントを投稿しました。')
         return HttpResponseRedirect(self.get_success_url())
 
     def get_success_url(self):
         return f"{reverse('posts:post_detail', kwargs={'slug': self.post_obj.slug})}#comments"
+
+
+class CommentPageView(CachedPageMixin, TemplateView):
+    """「さらに表示」で読み込むコメントの断片。"""
+
+    template_name = 'comments/includes/comment_list.html'
+    use_replica = True
+
+    def get_page_cache_namespaces(self):
+        return [f'post:{self.kwargs["post_slug"]}']
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        post = get_object_or_404(
+            Post.objects.published().only('pk', 'slug'),
+            slug=self.kwargs['post_slug'],
+        )
+        try:
+            page = comment_page(post, self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise Http404('無効なページです。')
+        context.update(post=post, comments=page.object_list, comments_page=page)
+        return context
@@ -1,3 +1,23 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.utils import timezone
 
-# Register your models here.
+from .models import Task
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'run_at', 'attempts', 'max_attempts', 'locked_by', 'updated_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'idempotency_key')
+    readonly_fields = ('created_at', 'updated_at', 'locked_by', 'locked_at', 'last_error')
+    actions = ('retry_tasks',)
+
+    @admin.action(description='選択したタスクを再実行する')
+    def retry_tasks(self, request, queryset):
+        count = queryset.exclude(status=Task.Status.RUNNING).update(
+            status=Task.Status.QUEUED,
+            run_at=timezone.now(),
+            attempts=0,
+            updated_at=timezone.now(),
+        )
+        self.message_user(request, f'{count} 件のタスクを再実行待ちにしました。', messages.SUCCESS)
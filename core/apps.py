@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from . import checks  # noqa: F401
+
+        # 各アプリの tasks.py を読み込み、@task の登録を済ませておく
+        autodiscover_modules('tasks')
@@ -0,0 +1,380 @@
+"""
+コンテンツバージョンとページキャッシュ、テンプレート断片のキャッシュ、条件付き GET。
+
+バージョンは名前空間（例: 'posts', 'taxonomy', 'post:<slug>'）ごとの値で、
+内容が変わったときに `bump()` で進めます。ワーカーのプロセスが進めたバージョンも Web の
+プロセスから見えるよう、キャッシュはプロセス間で共有されている必要があります（core.checks）。キャッシュキーにバージョンを含めることで、
+古いエントリを削除せずに無効化できます。`bump()` した時刻も名前空間ごとに記録し、
+Last-Modified の計算に使います。
+
+バージョンはプライマリへのコミット時に進むので、レプリカが追いつくまでの間にレプリカから
+読んで描画した内容は、新しいバージョンのキーで保存したり ETag を付けたりしません
+（`replica_may_be_stale()`）。
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers, quote_etag
+from django.utils.http import http_date
+
+from . import routers
+
+VERSION_KEY_PREFIX = 'content-version'
+MODIFIED_KEY_PREFIX = 'content-modified'
+PAGE_KEY_PREFIX = 'page'
+FRAGMENT_KEY_PREFIX = 'fragment'
+FRAGMENT_STATS_KEY_PREFIX = 'fragment-stats'
+FRAGMENT_STATS_NAMES_KEY = 'fragment-stats-names'
+FRAGMENT_TIMEOUT = 24 * 60 * 60
+# ヒット・ミスの件数は、この秒数ごとにまとめて共有のカウンタへ反映する
+FRAGMENT_STATS_INTERVAL = 10
+CSRF_PLACEHOLDER = '__page_cache_csrf_token__'
+
+
+def _version_key(namespace: str) -> str:
+    return f'{VERSION_KEY_PREFIX}:{namespace}'
+
+
+def _initial_version() -> int:
+    # キャッシュが消えても過去の値に戻らないよう、時刻から初期値を作る
+    return time.time_ns() // 1000
+
+
+_last_version = 0
+_version_lock = threading.Lock()
+
+
+def _new_version() -> int:
+    # 同じプロセスで続けて進めても同じ値にならないようにする
+    global _last_version
+    with _version_lock:
+        _last_version = max(_initial_version(), _last_version + 1)
+        return _last_version
+
+
+def get_versions(*namespaces) -> dict:
+    keys = {_version_key(namespace): namespace for namespace in namespaces}
+    found = cache.get_many(keys)
+    versions = {}
+    for key, namespace in keys.items():
+        version = found.get(key)
+        if version is None:
+            cache.add(key, _initial_version(), None)
+            version = cache.get(key)
+        versions[namespace] = version
+    return versions
+
+
+def _modified_key(namespace: str) -> str:
+    return f'{MODIFIED_KEY_PREFIX}:{namespace}'
+
+
+def _bump_now(namespaces):
+    # incr はプロセスをまたぐと不可分でない（FileBasedCache など）ので、時刻から新しい値を作る
+    cache.set_many({_version_key(namespace): _new_version() for namespace in namespaces}, None)
+    now = time.time()
+    cache.set_many({_modified_key(namespace): now for namespace in namespaces}, None)
+
+
+def get_last_modified(*namespaces) -> float:
+    """名前空間のいずれかが最後に `bump()` された時刻（UNIX 時刻）を返します。"""
+    keys = [_modified_key(namespace) for namespace in namespaces]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # 記録が消えていたら、取りこぼしのないよう今を変更時刻とみなす
+            cache.add(key, time.time(), None)
+            found[key] = cache.get(key)
+    return max(found.values(), default=0)
+
+
+def bump(*namespaces, using=DEFAULT_DB_ALIAS):
+    """名前空間のバージョンを進めます。トランザクション中ならコミット後に反映します。"""
+    namespaces = tuple(dict.fromkeys(namespace for namespace in namespaces if namespace))
+    if namespaces:
+        transaction.on_commit(lambda: _bump_now(namespaces), using=using)
+
+
+def replica_may_be_stale(*namespaces) -> bool:
+    """
+    レプリカから読んでいて、名前空間が `DATABASE_REPLICA_LAG_SECONDS` 以内に `bump()` されて
+    いれば True を返します。レプリカにまだ反映されていない変更があるかもしれません。
+    """
+    if not routers.reading_from_replica():
+        return False
+    modified = get_last_modified(*namespaces)
+    return time.time() - modified < getattr(settings, 'DATABASE_REPLICA_LAG_SECONDS', 60)
+
+
+def version_token(versions: dict) -> str:
+    return '.'.join(f'{namespace}={versions[namespace]}' for namespace in sorted(versions))
+
+
+def fragment_key(name, *parts) -> str:
+    raw = '|'.join(str(part) for part in parts)
+    return f'{FRAGMENT_KEY_PREFIX}:{name}:{hashlib.md5(raw.encode()).hexdigest()}'
+
+
+def get_fragments(name, parts, namespaces, render) -> dict:
+    """
+    テンプレート断片をまとめて取り出し、ないものだけ `render(ids)` で描画して保存します。
+
+    `parts` は {ID: キーの元になる値のタプル}、`render` は {ID: HTML} を返す関数です。
+    名前空間のバージョンは断片と一緒に 1 回の `get_many` で読み、保存した断片の
+    バージョンと比べて古いものは描画し直します。{ID: HTML} を返します。
+    """
+    keys = {fragment_key(name, *values): fragment_id for fragment_id, values in parts.items()}
+    version_keys = {_version_key(namespace): namespace for namespace in namespaces}
+    found = cache.get_many([*keys, *version_keys])
+    if all(key in found for key in version_keys):
+        versions = {namespace: found[key] for key, namespace in version_keys.items()}
+    else:
+        versions = get_versions(*namespaces)
+    token = version_token(versions)
+
+    fragments = {}
+    for key, fragment_id in keys.items():
+        entry = found.get(key)
+        if entry is not None and entry[0] == token:
+            fragments[fragment_id] = entry[1]
+    missing = [fragment_id for fragment_id in parts if fragment_id not in fragments]
+    if missing:
+        rendered = render(missing)
+        cache.set_many(
+            {key: (token, rendered[fragment_id]) for key, fragment_id in keys.items() if fragment_id in rendered},
+            FRAGMENT_TIMEOUT,
+        )
+        fragments.update(rendered)
+    count_fragments(name, hits=len(parts) - len(missing), misses=len(missing))
+    return fragments
+
+
+_fragment_stats = Counter()
+_fragment_stats_lock = threading.Lock()
+_fragment_stats_flushed_at = time.monotonic()
+
+
+def _fragment_stats_key(name, kind) -> str:
+    return f'{FRAGMENT_STATS_KEY_PREFIX}:{name}:{kind}'
+
+
+def count_fragments(name, *, hits=0, misses=0):
+    """断片キャッシュのヒット・ミスを数えます。共有のカウンタには一定間隔でまとめて反映します。"""
+    with _fragment_stats_lock:
+        _fragment_stats[name, 'hits'] += hits
+        _fragment_stats[name, 'misses'] += misses
+        if time.monotonic() - _fragment_stats_flushed_at < FRAGMENT_STATS_INTERVAL:
+            return
+    flush_fragment_stats()
+
+
+def flush_fragment_stats():
+    """このプロセスで数えたヒット・ミスを、キャッシュ上の共有のカウンタに加えます。"""
+    global _fragment_stats_flushed_at
+    with _fragment_stats_lock:
+        pending = {key: count for key, count in _fragment_stats.items() if count}
+        _fragment_stats.clear()
+        _fragment_stats_flushed_at = time.monotonic()
+    if not pending:
+        return
+    names = cache.get(FRAGMENT_STATS_NAMES_KEY) or set()
+    if not {name for name, _ in pending} <= names:
+        cache.set(FRAGMENT_STATS_NAMES_KEY, names | {name for name, _ in pending}, None)
+    for (name, kind), count in pending.items():
+        key = _fragment_stats_key(name, kind)
+        cache.add(key, 0, None)
+        cache.incr(key, count)
+
+
+def fragment_stats() -> dict:
+    """{断片の名前: {'hits': 件数, 'misses': 件数}} を返します。"""
+    names = cache.get(FRAGMENT_STATS_NAMES_KEY) or set()
+    keys = {
+        _fragment_stats_key(name, kind): (name, kind) for name in sorted(names) for kind in ('hits', 'misses')
+    }
+    found = cache.get_many(keys)
+    stats = {name: {'hits': 0, 'misses': 0} for name in sorted(names)}
+    for key, (name, kind) in keys.items():
+        stats[name][kind] = found.get(key, 0)
+    return stats
+
+
+def reset_fragment_stats():
+    with _fragment_stats_lock:
+        _fragment_stats.clear()
+    names = cache.get(FRAGMENT_STATS_NAMES_KEY) or set()
+    cache.delete_many([_fragment_stats_key(name, kind) for name in names for kind in ('hits', 'misses')])
+    cache.delete(FRAGMENT_STATS_NAMES_KEY)
+
+
+class CachedPageMixin:
+    """
+    匿名ユーザー向けの GET 応答を、URL とコンテンツバージョンをキーにキャッシュします。
+
+    フォームの CSRF トークンはプレースホルダとして保存し、配信時に差し替えます。
+    非同期ビュー（`async def get`）では、判定とキャッシュの読み込みをまとめてスレッドで実行します。
+    """
+
+    page_cache_timeout = 600
+
+    def get_page_cache_namespaces(self):
+        return []
+
+    def get_page_cache_timeout(self):
+        return self.page_cache_timeout
+
+    def page_cache_enabled(self, request):
+        if not getattr(settings, 'PAGE_CACHE_ENABLED', True):
+            return False
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return False
+        if getattr(request, 'static_export', False):
+            # 静的書き出し用の描画は内容が異なるので、通常の応答と共有しない
+            return False
+        # 直前の操作のメッセージを表示する必要がある応答は共有できない
+        return len(messages.get_messages(request)) == 0
+
+    def get_page_cache_key(self, request):
+        versions = get_versions(*self.get_page_cache_namespaces())
+        raw = f'{request.build_absolute_uri()}|{version_token(versions)}'
+        return f'{PAGE_KEY_PREFIX}:{hashlib.md5(raw.encode()).hexdigest()}'
+
+    def lookup_page(self, request):
+        """(キャッシュキー, キャッシュ済みの内容) を返します。共有できない応答ならキーは None です。"""
+        if not self.page_cache_enabled(request):
+            return None, None
+        key = self.get_page_cache_key(request)
+        cached = cache.get(key)
+        if cached is None and replica_may_be_stale(*self.get_page_cache_namespaces()):
+            # 古いレプリカから描画した内容を新しいバージョンのキーで保存しない
+            return None, None
+        return key, cached
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.view_is_async:
+            return self._adispatch_cached(request, *args, **kwargs)
+        self._page_cache_key, cached = self.lookup_page(request)
+        if cached is not None:
+            return self._cached_response(request, cached)
+        return self._prepare_store(super().dispatch(request, *args, **kwargs))
+
+    async def _adispatch_cached(self, request, *args, **kwargs):
+        # 判定はセッション（ユーザー・メッセージ）を読むので、キャッシュの読み込みとまとめて
+        # 1 回の同期処理として実行する
+        self._page_cache_key, cached = await sync_to_async(self.lookup_page)(request)
+        if cached is not None:
+            return self._cached_response(request, cached)
+        return self._prepare_store(await super().dispatch(request, *args, **kwargs))
+
+    def _cached_response(self, request, cached):
+        content, content_type = cached
+        return HttpResponse(
+            content.replace(CSRF_PLACEHOLDER.encode(), get_token(request).encode()),
+            content_type=content_type,
+        )
+
+    def _prepare_store(self, response):
+        if (
+            self._page_cache_key is not None
+            and response.status_code == 200
+            and hasattr(response, 'add_post_render_callback')
+        ):
+            response.add_post_render_callback(self._store_page)
+        return response
+
+    def _store_page(self, response):
+        timeout = self.get_page_cache_timeout()
+        if timeout and timeout > 0:
+            cache.set(
+                self._page_cache_key,
+                (response.content, response.get('Content-Type')),
+                timeout,
+            )
+        response.content = response.content.replace(
+            CSRF_PLACEHOLDER.encode(), get_token(self.request).encode()
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if self._page_cache_key is not None:
+            context['csrf_token'] = CSRF_PLACEHOLDER
+        return context
+
+
+class ConditionalGetMixin:
+    """
+    コンテンツバージョンから ETag と Last-Modified を作り、変わっていなければ
+    クエリの実行やテンプレートの描画の前に 304 を返します。
+
+    `get_content_timestamp()` はバージョンに現れない変化（公開予約の時刻到来など）を
+    表す時刻を返します。None を返した場合は検証せずに通常どおり処理します。
+    """
+
+    def get_validator_namespaces(self):
+        return self.get_page_cache_namespaces()
+
+    def get_content_timestamp(self):
+        return 0
+
+    def conditional_get_enabled(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        return len(messages.get_messages(request)) == 0
+
+    def get_validators(self, request):
+        """(ETag, Last-Modified) を返します。検証しない場合は None を返します。"""
+        if not self.conditional_get_enabled(request):
+            return None
+        content_timestamp = self.get_content_timestamp()
+        if content_timestamp is None:
+            return None
+        namespaces = self.get_validator_namespaces()
+        if replica_may_be_stale(*namespaces):
+            return None
+        versions = get_versions(*namespaces)
+        last_modified = int(max(get_last_modified(*namespaces), content_timestamp))
+        # ナビゲーションなどがユーザーによって変わるので、ユーザーも ETag に含める
+        raw = f'{request.get_full_path()}|{version_token(versions)}|{last_modified}|{request.user.pk}'
+        return quote_etag(hashlib.md5(raw.encode()).hexdigest()), last_modified
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.view_is_async:
+            return self._adispatch_conditional(request, *args, **kwargs)
+        validators = self.get_validators(request)
+        response = self._not_modified(request, validators)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+        return self._add_validators(response, validators)
+
+    async def _adispatch_conditional(self, request, *args, **kwargs):
+        # セッション・キャッシュ・DB を読むので、1 回の同期処理としてまとめて実行する
+        validators = await sync_to_async(self.get_validators)(request)
+        response = self._not_modified(request, validators)
+        if response is None:
+            response = await super().dispatch(request, *args, **kwargs)
+        return self._add_validators(response, validators)
+
+    def _not_modified(self, request, validators):
+        if validators is None:
+            return None
+        etag, last_modified = validators
+        return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    def _add_validators(self, response, validators):
+        if validators is not None and response.status_code in (200, 304):
+            etag, last_modified = validators
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ('Cookie',))
+            # ブラウザには毎回検証させる（内容が変わっていなければ 304 で済む）
+            patch_cache_control(response, no_cache=True)
+        return response
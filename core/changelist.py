@@ -0,0 +1,138 @@
+"""
+行数の多いモデル向けの管理画面の一覧（changelist）。
+
+`ScalableAdminMixin` を ModelAdmin に混ぜると、一覧の表示で次のようになります。
+
+- 件数は `ADMIN_COUNT_LIMIT` 件までしか数えず、全件の COUNT(*) を発行しない
+- 既定の並び順では OFFSET の代わりにキーセット方式（core.pagination）でページを送る
+  （列見出しで並び替えたときだけ、件数の上限までの通常のページ送りになる）
+- 絞り込みのファセット件数を数えない。関連先の絞り込みには `TopRelatedListFilter` を使う
+"""
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+
+from .pagination import InvalidCursor, KeysetPaginator
+
+CURSOR_VAR = 'cursor'
+
+
+class BoundedCountPaginator(Paginator):
+    """件数を `ADMIN_COUNT_LIMIT` 件までしか数えないページネーター。"""
+
+    count_is_bounded = False
+
+    @cached_property
+    def count_limit(self):
+        return getattr(settings, 'ADMIN_COUNT_LIMIT', 10000)
+
+    @cached_property
+    def count(self):
+        # 上限より 1 行だけ多く数え、超えたかどうかを count_is_bounded で知らせる
+        count = self.object_list.order_by().values('pk')[:self.count_limit + 1].count()
+        self.count_is_bounded = count > self.count_limit
+        return min(count, self.count_limit)
+
+
+class KeysetChangeList(ChangeList):
+    """既定の並び順のときに、キーセット方式でページを送る ChangeList。"""
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = request.GET.get(CURSOR_VAR)
+        self.keyset_page = None
+        self.count_is_bounded = False
+        super().__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # 絞り込み・並び替え・検索のリンクでは先頭のページに戻す
+        return super().get_query_string(new_params, [*(remove or ()), CURSOR_VAR])
+
+    def get_queryset(self, request, exclude_parameters=None):
+        queryset = super().get_queryset(request, exclude_parameters)
+        list_defer = getattr(self.model_admin, 'list_defer', ())
+        return queryset.defer(*list_defer) if list_defer else queryset
+
+    def uses_keyset(self):
+        return not (ORDER_VAR in self.params or self.show_all or self.list_editable)
+
+    def get_results(self, request):
+        if not self.uses_keyset():
+            super().get_results(request)
+            self.count_is_bounded = getattr(self.paginator, 'count_is_bounded', False)
+            if self.count_is_bounded:
+                # 件数が上限で切れているときに、全件を 1 ページにまとめて読まない
+                self.can_show_all = False
+                if self.show_all or not self.multi_page:
+                    self.result_list = self.queryset[:self.list_per_page]
+            return
+        paginator = KeysetPaginator(
+            self.queryset, self.list_per_page, ordering=self.model_admin.keyset_ordering
+        )
+        try:
+            page = paginator.page(self.cursor)
+        except InvalidCursor:
+            raise IncorrectLookupParameters
+        counter = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = counter.count
+        self.count_is_bounded = getattr(counter, 'count_is_bounded', False)
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = page.object_list
+        self.can_show_all = False
+        # Django の番号付きのページ送りは使わず、pagination.html でカーソルのリンクを出す
+        self.multi_page = False
+        self.paginator = paginator
+        self.keyset_page = page
+
+    def next_page_url(self):
+        return self.get_query_string({CURSOR_VAR: self.keyset_page.next_cursor})
+
+    def previous_page_url(self):
+        return self.get_query_string({CURSOR_VAR: self.keyset_page.previous_cursor})
+
+
+class TopRelatedListFilter(admin.RelatedFieldListFilter):
+    """
+    関連先を `post_count` の多い順に `limit` 件だけ並べる絞り込み（選択中のものは常に表示する）。
+
+    それ以外の関連先では、関連先の一覧（TagAdmin などの「投稿」列）のリンクから絞り込みます。
+    """
+
+    limit = 15
+    ordering = ('-post_count', 'pk')
+
+    def field_choices(self, field, request, model_admin):
+        manager = field.related_model._default_manager
+        choices = list(manager.order_by(*self.ordering)[:self.limit])
+        selected = [value for value in self.lookup_val or () if value.isdigit()]
+        if selected:
+            shown = {str(obj.pk) for obj in choices}
+            choices += manager.filter(pk__in=[value for value in selected if value not in shown])
+        return [(obj.pk, str(obj)) for obj in choices]
+
+
+class ScalableAdminMixin:
+    """行数の多いモデルの ModelAdmin に混ぜるミックスイン（モジュールの説明を参照）。"""
+
+    # キーセットのページ送りに使う並び順。一意に並ぶ必要がある
+    keyset_ordering = ('-id',)
+    # 一覧では表示しない大きな列
+    list_defer = ()
+    paginator = BoundedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+
+    def get_ordering(self, request):
+        return self.keyset_ordering
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
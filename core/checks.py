@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+# プロセスごとに別の内容を持つ（またはなにも保存しない）キャッシュ
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """ワーカーを使う構成で、既定のキャッシュがプロセス間で共有されているかを確かめます。"""
+    if getattr(settings, 'TASK_QUEUE_EAGER', False):
+        return []
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [
+        Error(
+            f'{backend} はプロセスごとのキャッシュなので、ワーカーが進めたコンテンツバージョンが'
+            'Web のプロセスに届きません。',
+            hint='CACHES の既定を FileBasedCache や Redis など共有のキャッシュにするか、'
+                 'TASK_QUEUE_EAGER = True にしてください。',
+            id='core.E001',
+        )
+    ]
@@ -0,0 +1,47 @@
+"""
+SQLite の書き込みロック競合への対策。
+
+接続ごとの PRAGMA（WAL など）は `settings.DATABASES` の `init_command` で設定します。
+ここでは、ビジー待ちの上限を超えて "database is locked" になった書き込みトランザクションを、
+上限付きの指数バックオフでやり直す `write_with_retry()` を提供します。
+"""
+import logging
+import random
+import time
+
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 4
+BASE_DELAY = 0.05
+MAX_DELAY = 1.0
+
+LOCKED_MESSAGES = ('database is locked', 'database table is locked', 'database is busy')
+
+
+def is_locked_error(exc) -> bool:
+    return isinstance(exc, OperationalError) and any(
+        message in str(exc).lower() for message in LOCKED_MESSAGES
+    )
+
+
+def write_with_retry(func, *args, using=DEFAULT_DB_ALIAS, attempts=MAX_ATTEMPTS, **kwargs):
+    """
+    `func` を 1 つのトランザクションで実行し、ロック競合で失敗したらやり直します。
+
+    外側のトランザクションの中で呼ばれた場合は、やり直すと外側の整合性が崩れるので
+    そのまま 1 回だけ実行します。
+    """
+    if connections[using].in_atomic_block:
+        return func(*args, **kwargs)
+    for attempt in range(1, attempts + 1):
+        try:
+            with transaction.atomic(using=using):
+                return func(*args, **kwargs)
+        except OperationalError as exc:
+            if not is_locked_error(exc) or attempt == attempts:
+                raise
+            delay = min(BASE_DELAY * 2 ** (attempt - 1), MAX_DELAY) * random.uniform(0.5, 1.5)
+            logger.warning('Database locked, retrying in %.2fs (attempt %s/%s)', delay, attempt, attempts)
+            time.sleep(delay)
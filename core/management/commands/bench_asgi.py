@@ -0,0 +1,205 @@
+import asyncio
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from .benchmark import build_targets
+
+PUBLIC_VIEWS = ('posts:post_list', 'posts:category', 'posts:tag', 'posts:post_detail')
+MODES = ('wsgi', 'asgi')
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _wsgi_client(application, host):
+    def request(url):
+        parts = urlsplit(url)
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': parts.path,
+            'QUERY_STRING': parts.query,
+            'HTTP_HOST': host,
+            'wsgi.input': io.BytesIO(),
+        }
+        setup_testing_defaults(environ)
+        status = []
+        started = time.perf_counter()
+        body = application(environ, lambda code, headers, exc_info=None: status.append(code))
+        try:
+            b''.join(body)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        return time.perf_counter() - started, int(status[0].split()[0])
+
+    return request
+
+
+def _asgi_client(application, host):
+    async def request(url):
+        parts = urlsplit(url)
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': parts.path,
+            'raw_path': parts.path.encode(),
+            'query_string': parts.query.encode(),
+            'root_path': '',
+            'headers': [(b'host', host.encode())],
+            'client': ('127.0.0.1', 50000),
+            'server': (host, 80),
+        }
+        done = asyncio.Event()
+        status = []
+        sent_body = False
+
+        async def receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # 応答を送り終えるまで切断しない
+            await done.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+            elif message['type'] == 'http.response.body' and not message.get('more_body'):
+                done.set()
+
+        started = time.perf_counter()
+        await application(scope, receive, send)
+        return time.perf_counter() - started, status[0]
+
+    return request
+
+
+def _run_wsgi(urls, concurrency, host):
+    from django.core.handlers.wsgi import WSGIHandler
+
+    request = _wsgi_client(WSGIHandler(), host)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(request, urls))
+    return samples, time.perf_counter() - started
+
+
+def _run_asgi(urls, concurrency, host):
+    from django.core.handlers.asgi import ASGIHandler
+
+    request = _asgi_client(ASGIHandler(), host)
+
+    async def main():
+        queue = list(reversed(urls))
+        samples = []
+
+        async def worker():
+            while queue:
+                samples.append(await request(queue.pop()))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return samples, time.perf_counter() - started
+
+    return asyncio.run(main())
+
+
+class Command(BaseCommand):
+    help = (
+        '投稿一覧・詳細・カテゴリ/タグ一覧について、WSGI（同期ビュー・スレッド）と ASGI（非同期ビュー）の'
+        '同時接続数ごとのスループットを比較します。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', default='1,8,32', help='同時接続数（カンマ区切りで複数指定できます）'
+        )
+        parser.add_argument('--requests', type=int, default=400, help='同時接続数ごとのリクエスト数')
+        parser.add_argument('--samples', type=int, default=50, help='使う投稿・タグなどの数')
+        parser.add_argument('--page-cache', action='store_true', help='ページキャッシュを有効にしたまま計測します。')
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--mode', choices=MODES, default=None, help='内部用: 指定した方式だけを計測して JSON を出力します。'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError('--concurrency には整数をカンマ区切りで指定してください。')
+        if options['mode']:
+            self.run_mode(options, levels)
+            return
+
+        results = {mode: self.spawn(mode, options) for mode in MODES}
+        self.stdout.write(
+            f"{'同時接続':>8} {'方式':<5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'エラー':>6}"
+        )
+        for level in levels:
+            for mode in MODES:
+                result = results[mode][str(level)]
+                self.stdout.write(
+                    f"{level:>8} {mode:<5} {result['rps']:>8.1f} {result['p50']:>8.1f} {result['p95']:>8.1f} "
+                    f"{result['p99']:>8.1f} {result['errors']:>6}"
+                )
+
+    def spawn(self, mode, options):
+        """ビューの種類は URLconf の読み込み時に決まるので、方式ごとに別のプロセスで計測する。"""
+        command = [
+            sys.executable, str(settings.BASE_DIR / 'manage.py'), 'bench_asgi', '--mode', mode,
+            '--concurrency', options['concurrency'], '--requests', str(options['requests']),
+            '--samples', str(options['samples']), '--host', options['host'], '--seed', str(options['seed']),
+        ]
+        if options['page_cache']:
+            command.append('--page-cache')
+        env = dict(os.environ, BLOG_ASYNC_VIEWS='1' if mode == 'asgi' else '0')
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise CommandError(f'{mode} の計測に失敗しました。\n{completed.stderr}')
+        return json.loads(completed.stdout)
+
+    def run_mode(self, options, levels):
+        # 計測の邪魔になるリクエストごとの記録は止め、ハンドラを作る前に設定を変える
+        settings.INSTRUMENTATION_LOG = None
+        settings.PAGE_CACHE_ENABLED = options['page_cache']
+        rng = random.Random(options['seed'])
+        targets = build_targets(rng, options['samples'], None)
+        paths = [path for (name, _), urls in targets.items() if name in PUBLIC_VIEWS for path in urls]
+        if not paths:
+            raise CommandError('計測する公開ページがありません。先に seed_bench でデータを作ってください。')
+
+        run = _run_asgi if options['mode'] == 'asgi' else _run_wsgi
+        # 接続の確立やテンプレートの読み込みを計測に含めないよう、先に一通り処理しておく
+        run(paths, 1, options['host'])
+        results = {}
+        for level in levels:
+            urls = [rng.choice(paths) for _ in range(options['requests'])]
+            samples, elapsed = run(urls, level, options['host'])
+            durations = [duration * 1000 for duration, _ in samples]
+            results[level] = {
+                'rps': len(samples) / elapsed,
+                'p50': statistics.median(durations),
+                'p95': _percentile(durations, 0.95),
+                'p99': _percentile(durations, 0.99),
+                'errors': sum(1 for _, status in samples if status >= 400),
+            }
+        self.stdout.write(json.dumps(results))
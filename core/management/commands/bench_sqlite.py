@@ -0,0 +1,138 @@
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+def _profiles():
+    options = settings.DATABASES['default'].get('OPTIONS', {})
+    return {
+        # Django の既定値（ロールバックジャーナル、DEFERRED トランザクション）
+        'baseline': {'pragmas': [], 'timeout': 5, 'begin': 'BEGIN'},
+        # settings.py の接続設定
+        'tuned': {
+            'pragmas': getattr(settings, 'SQLITE_PRAGMAS', []),
+            'timeout': options.get('timeout', 5),
+            'begin': f"BEGIN {options.get('transaction_mode', 'DEFERRED')}",
+        },
+    }
+
+
+def _connect(path, profile):
+    conn = sqlite3.connect(path, timeout=profile['timeout'], isolation_level=None)
+    for pragma in profile['pragmas']:
+        conn.execute(f'PRAGMA {pragma}')
+    return conn
+
+
+def _seed(path, profile, rows):
+    conn = _connect(path, profile)
+    conn.executescript("""
+        CREATE TABLE post (id INTEGER PRIMARY KEY, title TEXT, body TEXT, comment_count INTEGER DEFAULT 0);
+        CREATE TABLE comment (id INTEGER PRIMARY KEY, post_id INTEGER, body TEXT, created_at REAL);
+        CREATE INDEX comment_post ON comment (post_id, created_at);
+    """)
+    conn.execute('BEGIN')
+    conn.executemany(
+        'INSERT INTO post (title, body) VALUES (?, ?)',
+        ((f'post {i}', 'x' * 2000) for i in range(rows)),
+    )
+    conn.execute('COMMIT')
+    conn.close()
+
+
+class Command(BaseCommand):
+    help = 'SQLite の既定設定と settings.py の接続設定で、同時読み書きのスループットを比較します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--duration', type=float, default=5.0, help='1 プロファイルあたりの秒数')
+        parser.add_argument('--rows', type=int, default=2000, help='あらかじめ作る投稿数')
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"readers={options['readers']} writers={options['writers']} "
+            f"duration={options['duration']}s rows={options['rows']}"
+        )
+        for name, profile in _profiles().items():
+            with tempfile.TemporaryDirectory() as directory:
+                result = self._run(Path(directory) / 'bench.sqlite3', profile, options)
+            self.stdout.write(
+                f"{name:<9} reads/s={result['reads'] / options['duration']:>9.1f} "
+                f"writes/s={result['writes'] / options['duration']:>8.1f} "
+                f"write p50={result['p50'] * 1000:>6.2f}ms p95={result['p95'] * 1000:>6.2f}ms "
+                f"locked={result['errors']}"
+            )
+
+    def _run(self, path, profile, options):
+        _seed(path, profile, options['rows'])
+        rows = options['rows']
+        stop = threading.Event()
+        lock = threading.Lock()
+        result = {'reads': 0, 'writes': 0, 'errors': 0, 'latencies': []}
+
+        def reader():
+            conn = _connect(path, profile)
+            count = 0
+            while not stop.is_set():
+                post_id = random.randint(1, rows)
+                try:
+                    conn.execute('SELECT id, title, comment_count FROM post ORDER BY id DESC LIMIT 20').fetchall()
+                    conn.execute(
+                        'SELECT body FROM comment WHERE post_id = ? ORDER BY created_at LIMIT 50', (post_id,)
+                    ).fetchall()
+                    count += 1
+                except sqlite3.OperationalError:
+                    with lock:
+                        result['errors'] += 1
+            conn.close()
+            with lock:
+                result['reads'] += count
+
+        def writer():
+            conn = _connect(path, profile)
+            count = 0
+            latencies = []
+            while not stop.is_set():
+                post_id = random.randint(1, rows)
+                started = time.perf_counter()
+                try:
+                    conn.execute(profile['begin'])
+                    conn.execute(
+                        'INSERT INTO comment (post_id, body, created_at) VALUES (?, ?, ?)',
+                        (post_id, 'y' * 200, time.time()),
+                    )
+                    conn.execute('UPDATE post SET comment_count = comment_count + 1 WHERE id = ?', (post_id,))
+                    conn.execute('COMMIT')
+                    count += 1
+                    latencies.append(time.perf_counter() - started)
+                except sqlite3.OperationalError:
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                    with lock:
+                        result['errors'] += 1
+            conn.close()
+            with lock:
+                result['writes'] += count
+                result['latencies'].extend(latencies)
+
+        threads = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        threads += [threading.Thread(target=writer) for _ in range(options['writers'])]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['duration'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        latencies = sorted(result['latencies']) or [0.0]
+        result['p50'] = statistics.median(latencies)
+        result['p95'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return result
@@ -0,0 +1,286 @@
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from comments.models import Comment
+from core.middleware import _QueryRecorder
+from posts.models import Category, Post, Tag
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _git_revision():
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return revision, dirty
+
+
+def _sample(rng, queryset, count):
+    """主キーの一覧から無作為に選びます（ORDER BY RANDOM() は大きな表では遅いので使わない）。"""
+    pks = list(queryset.order_by().values_list('pk', flat=True))
+    return list(queryset.model.objects.filter(pk__in=rng.sample(pks, min(count, len(pks)))))
+
+
+def build_targets(rng, samples, author):
+    """URL 名ごとに、計測に使うパスのリストを返します。キーは (URL 名, ログインが必要か)。"""
+    posts = _sample(rng, Post.objects.published(), samples)
+    categories = _sample(rng, Category.objects.filter(post_count__gt=0), samples)
+    tags = _sample(rng, Tag.objects.filter(post_count__gt=0), samples)
+    own_posts = _sample(rng, Post.objects.filter(author=author), samples) if author else []
+    terms = sorted({post.title[:3] for post in posts}) or ['ブログ']
+
+    public = {
+        'posts:post_list': [reverse('posts:post_list')],
+        'posts:search': [f"{reverse('posts:search')}?q={urllib.parse.quote(term)}" for term in terms],
+        'posts:feed': [reverse('posts:feed')],
+        'posts:atom_feed': [reverse('posts:atom_feed')],
+        'posts:category': [category.get_absolute_url() for category in categories],
+        'posts:category_feed': [reverse('posts:category_feed', kwargs={'slug': c.slug}) for c in categories],
+        'posts:tag': [tag.get_absolute_url() for tag in tags],
+        'posts:tag_feed': [reverse('posts:tag_feed', kwargs={'slug': tag.slug}) for tag in tags],
+        'posts:post_detail': [post.get_absolute_url() for post in posts],
+        'comments:comment_page': [
+            reverse('comments:comment_page', kwargs={'post_slug': post.slug}) for post in posts
+        ],
+        'sitemap': [reverse('sitemap')],
+        'sitemap_section': [reverse('sitemap_section', kwargs={'section': 'posts'})],
+        'accounts:login': [reverse('accounts:login')],
+        'accounts:signup': [reverse('accounts:signup')],
+    }
+    authoring = {}
+    if author:
+        authoring = {
+            'posts:manage_post_list': [reverse('posts:manage_post_list')],
+            'posts:post_create': [reverse('posts:post_create')],
+            'posts:post_update': [reverse('posts:post_update', kwargs={'slug': p.slug}) for p in own_posts],
+            'posts:post_delete': [reverse('posts:post_delete', kwargs={'slug': p.slug}) for p in own_posts],
+        }
+    targets = {(name, False): paths for name, paths in public.items() if paths}
+    targets.update({(name, True): paths for name, paths in authoring.items() if paths})
+    return targets
+
+
+class Command(BaseCommand):
+    help = (
+        '公開ページと投稿管理ページに GET を繰り返し、レイテンシ（p50/p95/p99）・クエリ数・'
+        'スループットを計測して BENCHMARK_RESULTS_DIR に保存します。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='URL 名ごとの計測回数')
+        parser.add_argument('--warmup', type=int, default=5, help='URL 名ごとに計測前に捨てるリクエスト数')
+        parser.add_argument('--samples', type=int, default=20, help='URL 名ごとに使う投稿・タグなどの数')
+        parser.add_argument('--user', default=None, help='投稿管理ページを計測するユーザー（既定は投稿の多い著者）')
+        parser.add_argument('--cold', action='store_true', help='リクエストごとにキャッシュを消してから計測します。')
+        parser.add_argument(
+            '--base-url', default=None,
+            help='指定すると、起動済みのサーバー（例: http://127.0.0.1:8000）に HTTP で送ります。',
+        )
+        parser.add_argument('--concurrency', type=int, default=1, help='--base-url のときの同時接続数')
+        parser.add_argument('--host', default='localhost', help='テストクライアントで使う Host ヘッダ')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--label', default='', help='結果ファイルに記録する説明')
+        parser.add_argument('--compare', default=None, help='比較する以前の結果ファイル（latest で直前の結果）')
+        parser.add_argument('--no-save', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['cold'] and options['base_url']:
+            raise CommandError('--cold はテストクライアントでの計測でのみ使えます。')
+        baseline = self.load_baseline(options['compare']) if options['compare'] else None
+        rng = random.Random(options['seed'])
+        author = self.get_author(options['user'])
+        targets = build_targets(rng, options['samples'], author)
+
+        client = Client(HTTP_HOST=options['host'])
+        if author:
+            client.force_login(author)
+        if options['base_url']:
+            measure = self.http_measure(options['base_url'], client.cookies.get(settings.SESSION_COOKIE_NAME))
+        else:
+            measure = self.client_measure(client, options['cold'])
+
+        results = {}
+        sent = 0
+        started = time.perf_counter()
+        for (name, login_required), paths in targets.items():
+            plan = [paths[i % len(paths)] for i in range(options['warmup'] + options['requests'])]
+            samples = self.run(measure, plan[:options['warmup']], login_required, options['concurrency'])
+            url_started = time.perf_counter()
+            samples = self.run(measure, plan[options['warmup']:], login_required, options['concurrency'])
+            results[name] = self.summarize(samples, time.perf_counter() - url_started)
+            sent += len(plan)
+        elapsed = time.perf_counter() - started
+
+        revision, dirty = _git_revision()
+        record = {
+            'ts': timezone.now().isoformat(),
+            'label': options['label'],
+            'revision': revision,
+            'dirty': dirty,
+            'mode': 'http' if options['base_url'] else 'client',
+            'options': {
+                key: options[key]
+                for key in ('requests', 'warmup', 'samples', 'cold', 'concurrency', 'seed', 'base_url')
+            },
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connections['default'].vendor,
+            },
+            'dataset': {
+                'posts': Post.objects.count(),
+                'comments': Comment.objects.count(),
+                'tags': Tag.objects.count(),
+            },
+            'throughput': round(sent / elapsed, 1) if elapsed else None,
+            'results': results,
+        }
+        self.report(record, baseline)
+        if not options['no_save']:
+            path = self.save(record)
+            self.stdout.write(self.style.SUCCESS(f'{path} に保存しました。'))
+
+    def get_author(self, username):
+        User = get_user_model()
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'ユーザー {username} がいません。')
+        author_id = (
+            Post.objects.filter(author__isnull=False)
+            .values('author').order_by().annotate(count=Count('pk'))
+            .order_by('-count').values_list('author', flat=True).first()
+        )
+        return User.objects.filter(pk=author_id).first() if author_id else None
+
+    def client_measure(self, client, cold):
+        anonymous = Client(HTTP_HOST=client.defaults['HTTP_HOST'])
+
+        def measure(path, login_required):
+            if cold:
+                cache.clear()
+            recorder = _QueryRecorder()
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                started = time.perf_counter()
+                response = (client if login_required else anonymous).get(path)
+                duration = time.perf_counter() - started
+            return duration, response.status_code, recorder.count
+
+        return measure
+
+    def http_measure(self, base_url, session_cookie):
+        base_url = base_url.rstrip('/')
+
+        def measure(path, login_required):
+            request = urllib.request.Request(base_url + path)
+            if login_required and session_cookie:
+                request.add_header('Cookie', f'{session_cookie.key}={session_cookie.value}')
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as error:
+                status = error.code
+            return time.perf_counter() - started, status, None
+
+        return measure
+
+    def run(self, measure, plan, login_required, concurrency):
+        if concurrency <= 1:
+            return [measure(path, login_required) for path in plan]
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(lambda path: measure(path, login_required), plan))
+
+    def summarize(self, samples, elapsed):
+        durations = [duration * 1000 for duration, _, _ in samples]
+        queries = [count for _, _, count in samples if count is not None]
+        return {
+            'requests': len(samples),
+            'errors': sum(1 for _, status, _ in samples if status >= 400),
+            'p50': round(statistics.median(durations), 2),
+            'p95': round(_percentile(durations, 0.95), 2),
+            'p99': round(_percentile(durations, 0.99), 2),
+            'mean': round(statistics.mean(durations), 2),
+            'queries': round(statistics.mean(queries), 2) if queries else None,
+            'max_queries': max(queries) if queries else None,
+            'rps': round(len(samples) / elapsed, 1) if elapsed else None,
+        }
+
+    def report(self, record, baseline):
+        previous = baseline['results'] if baseline else {}
+        self.stdout.write(
+            f"{'URL 名':<28} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'クエリ':>7} {'req/s':>8} {'エラー':>6}"
+            + (f" {'p95 差':>8}" if baseline else '')
+        )
+        for name, result in record['results'].items():
+            queries = f"{result['queries']:>7.1f}" if result['queries'] is not None else f"{'-':>7}"
+            line = (
+                f"{name:<28} {result['p50']:>8.1f} {result['p95']:>8.1f} {result['p99']:>8.1f} "
+                f"{queries} {result['rps'] or 0:>8.1f} {result['errors']:>6}"
+            )
+            if name in previous and previous[name]['p95']:
+                change = (result['p95'] - previous[name]['p95']) / previous[name]['p95'] * 100
+                line += f' {change:>+7.1f}%'
+            self.stdout.write(line)
+        self.stdout.write(f"全体: {record['throughput']} req/s（{record['mode']}、データ: {record['dataset']}）")
+        if baseline:
+            self.stdout.write(f"比較対象: {baseline.get('revision') or '-'} {baseline.get('label') or ''}")
+
+    def results_dir(self) -> Path:
+        return Path(getattr(settings, 'BENCHMARK_RESULTS_DIR', settings.BASE_DIR / 'var' / 'benchmarks'))
+
+    def save(self, record) -> Path:
+        directory = self.results_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        stamp = timezone.now().strftime('%Y%m%d-%H%M%S')
+        path = directory / f"{stamp}-{(record['revision'] or 'unknown')[:10]}.json"
+        path.write_text(json.dumps(record, ensure_ascii=False, indent=1))
+        return path
+
+    def load_baseline(self, name):
+        if name == 'latest':
+            runs = sorted(self.results_dir().glob('*.json'))
+            if not runs:
+                raise CommandError('比較できる以前の結果がありません。')
+            path = runs[-1]
+        else:
+            path = Path(name)
+        try:
+            return json.loads(path.read_text())
+        except (FileNotFoundError, ValueError) as error:
+            raise CommandError(f'{path} を読み込めません: {error}')
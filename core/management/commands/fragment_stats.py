@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from core.cache import flush_fragment_stats, fragment_stats, reset_fragment_stats
+
+
+class Command(BaseCommand):
+    help = 'テンプレート断片キャッシュのヒット・ミスの件数を、断片の名前ごとに表示します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='表示したあと件数を 0 に戻します。')
+
+    def handle(self, *args, **options):
+        flush_fragment_stats()
+        stats = fragment_stats()
+        if not stats:
+            self.stdout.write('記録がありません。')
+        else:
+            self.stdout.write(f"{'断片':<20} {'ヒット':>10} {'ミス':>10} {'ヒット率':>8}")
+            for name, counts in stats.items():
+                total = counts['hits'] + counts['misses']
+                ratio = f"{counts['hits'] / total:>8.1%}" if total else f"{'-':>8}"
+                self.stdout.write(f"{name:<20} {counts['hits']:>10} {counts['misses']:>10} {ratio}")
+        if options['reset']:
+            reset_fragment_stats()
+            self.stdout.write(self.style.SUCCESS('件数を 0 に戻しました。'))
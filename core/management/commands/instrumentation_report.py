@@ -0,0 +1,78 @@
+import json
+import statistics
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = 'InstrumentationMiddleware の記録を URL 名ごとに集計します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=None, help='集計する JSON Lines（既定は INSTRUMENTATION_LOG）')
+        parser.add_argument('--since', type=float, default=None, help='直近の指定した時間（時間単位）だけを集計します。')
+        parser.add_argument('--sort', choices=('requests', 'p95', 'queries', 'db'), default='p95')
+
+    def handle(self, *args, **options):
+        path = options['file'] or getattr(settings, 'INSTRUMENTATION_LOG', None)
+        if not path:
+            raise CommandError('INSTRUMENTATION_LOG が設定されていません（BLOG_INSTRUMENTATION_LOG で有効にするか、--file を指定してください）。')
+        since = None
+        if options['since'] is not None:
+            since = timezone.now() - timedelta(hours=options['since'])
+
+        groups = defaultdict(list)
+        try:
+            with open(path, encoding='utf-8') as handle:
+                for line in handle:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if since is not None and parse_datetime(record['ts']) < since:
+                        continue
+                    groups[record.get('url_name') or record['path']].append(record)
+        except FileNotFoundError:
+            raise CommandError(f'{path} がありません。')
+
+        rows = []
+        for name, records in groups.items():
+            durations = [record['duration_ms'] for record in records]
+            queries = [record['queries'] for record in records]
+            duplicates = Counter()
+            for record in records:
+                for duplicate in record['duplicates']:
+                    duplicates[(duplicate['fingerprint'], duplicate['sql'])] += duplicate['count']
+            rows.append({
+                'name': name,
+                'requests': len(records),
+                'p50': statistics.median(durations),
+                'p95': _percentile(durations, 0.95),
+                'queries': statistics.mean(queries),
+                'max_queries': max(queries),
+                'db': statistics.mean(record['db_ms'] for record in records),
+                'template': statistics.mean(record['template_ms'] for record in records),
+                'duplicates': duplicates.most_common(3),
+            })
+        rows.sort(key=lambda row: row[options['sort']], reverse=True)
+
+        self.stdout.write(
+            f"{'URL 名':<32} {'件数':>6} {'p50 ms':>8} {'p95 ms':>8} {'クエリ':>7} {'最大':>5} "
+            f"{'DB ms':>7} {'描画 ms':>8}"
+        )
+        for row in rows:
+            self.stdout.write(
+                f"{row['name']:<32} {row['requests']:>6} {row['p50']:>8.1f} {row['p95']:>8.1f} "
+                f"{row['queries']:>7.1f} {row['max_queries']:>5} {row['db']:>7.1f} {row['template']:>8.1f}"
+            )
+            for (fingerprint, sql), count in row['duplicates']:
+                self.stdout.write(f'    重複 {fingerprint} ×{count}: {sql[:100]}')
@@ -0,0 +1,84 @@
+import multiprocessing
+import os
+import signal
+import socket
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+
+from core import tasks
+
+
+def _work(worker_id, options, stop_event):
+    """1 プロセス分のワーカーループ。"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    using = options['database']
+    processed = 0
+    while not stop_event.is_set():
+        close_old_connections()
+        task_obj = tasks.claim(worker_id, using=using)
+        if task_obj is None:
+            if options['burst']:
+                break
+            stop_event.wait(options['sleep'])
+            continue
+        tasks.run(task_obj, using=using)
+        processed += 1
+        if options['max_tasks'] and processed >= options['max_tasks']:
+            break
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'core.tasks のジョブキューを処理するワーカーを起動します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2, help='ワーカープロセス数')
+        parser.add_argument('--sleep', type=float, default=1.0, help='キューが空のときの待ち秒数')
+        parser.add_argument('--burst', action='store_true', help='キューが空になったら終了します。')
+        parser.add_argument('--max-tasks', type=int, default=0, help='1 プロセスが処理する最大件数（0 は無制限）')
+        parser.add_argument('--stale-after', type=int, default=600, help='実行中のまま放置されたタスクを戻すまでの秒数')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        using = options['database']
+        stale_after = timedelta(seconds=options['stale_after'])
+        stop_event = multiprocessing.Event()
+        hostname = socket.gethostname()
+
+        def shutdown(signum, frame):
+            stop_event.set()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
+        # fork 前に接続を閉じ、子プロセスがそれぞれ自分の接続を開くようにする
+        connections.close_all()
+        workers = []
+        for index in range(max(options['processes'], 1)):
+            worker_id = f'{hostname}:{os.getpid()}:{index}'
+            process = multiprocessing.Process(
+                target=_work, args=(worker_id, options, stop_event), daemon=True,
+            )
+            process.start()
+            workers.append(process)
+        self.stdout.write(f'{len(workers)} 個のワーカーを起動しました。')
+
+        # 親プロセスは定期タスクの投入と、取り残されたタスクの回収を担当する
+        while any(process.is_alive() for process in workers):
+            if not options['burst']:
+                close_old_connections()
+                tasks.requeue_stale(stale_after, using=using)
+                tasks.enqueue_periodic(using=using)
+                tasks.purge_finished(timedelta(days=7), using=using)
+                connections.close_all()
+            stop_event.wait(5)
+            if stop_event.is_set():
+                break
+
+        for process in workers:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+        self.stdout.write('ワーカーを停止しました。')
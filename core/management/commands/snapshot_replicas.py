@@ -0,0 +1,45 @@
+import sqlite3
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = 'ローカル検証用に、SQLite のプライマリを DATABASE_REPLICAS の各レプリカへコピーします。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help='指定した秒数ごとに繰り返します。')
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES[DEFAULT_DB_ALIAS]
+        aliases = list(getattr(settings, 'DATABASE_REPLICAS', []))
+        if not aliases:
+            raise CommandError('DATABASE_REPLICAS が設定されていません（SQLITE_REPLICA_COUNT を参照）。')
+        if any(settings.DATABASES[alias]['ENGINE'] != primary['ENGINE'] for alias in aliases) \
+                or primary['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('SQLite のプライマリとレプリカにのみ対応しています。')
+        while True:
+            started = time.monotonic()
+            for alias in aliases:
+                self.snapshot(primary['NAME'], settings.DATABASES[alias]['NAME'])
+            self.stdout.write(
+                f'{len(aliases)} 個のレプリカを更新しました（{(time.monotonic() - started) * 1000:.0f} ms）。'
+            )
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def snapshot(self, source_path, target_path):
+        # オンラインバックアップ API でコピーするので、書き込み中でも一貫したスナップショットになり、
+        # レプリカを読んでいる接続もコミットまでは古い内容を読み続けられる
+        Path(target_path).parent.mkdir(parents=True, exist_ok=True)
+        source = sqlite3.connect(source_path)
+        target = sqlite3.connect(target_path, timeout=30)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
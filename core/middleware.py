@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+
+from . import routers
+
+PIN_COOKIE = 'db_pin'
+DUPLICATE_LIMIT = 5
+
+
+class ReplicaRoutingMiddleware:
+    """
+    `use_replica = True` のビューへの GET/HEAD の読み込みをリードレプリカに向けます。
+
+    POST などの書き込みリクエストの後は Cookie を付け、そのクライアントの読み込みを
+    `DATABASE_REPLICA_PIN_SECONDS` の間プライマリに固定します（自分の変更がすぐ見えるように）。
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = routers.activate(self.should_use_replica(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.deactivate(token)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        # ルーティングの状態は contextvar なので、ORM を実行するスレッドにも引き継がれる
+        token = routers.activate(self.should_use_replica(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            routers.deactivate(token)
+        return self.process_response(request, response)
+
+    def process_response(self, request, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and routers.replicas():
+            response.set_cookie(
+                PIN_COOKIE,
+                '1',
+                max_age=getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 120),
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+    def should_use_replica(self, request) -> bool:
+        if not routers.replicas() or request.method not in ('GET', 'HEAD'):
+            return False
+        if PIN_COOKIE in request.COOKIES:
+            return False
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return False
+        view_class = getattr(match.func, 'view_class', None)
+        return bool(getattr(view_class or match.func, 'use_replica', False))
+
+
+class _QueryRecorder:
+    """`execute_wrapper` として、実行された SQL の件数・時間・種類を数えます。"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            # パラメータを除いた SQL が同じなら同じ種類のクエリとみなす（N+1 の検出用）
+            self.fingerprints[sql] += 1
+
+    def duplicates(self):
+        return [
+            {
+                'fingerprint': hashlib.sha1(sql.encode()).hexdigest()[:12],
+                'count': count,
+                'sql': sql[:200],
+            }
+            for sql, count in self.fingerprints.most_common(DUPLICATE_LIMIT)
+            if count > 1
+        ]
+
+
+class InstrumentationMiddleware:
+    """
+    リクエストごとの SQL の件数・DB 時間・テンプレート描画時間・重複クエリを、
+    `INSTRUMENTATION_LOG` に JSON Lines で記録します。集計は `manage.py instrumentation_report` で行います。
+    """
+
+    sync_capable = True
+    async_capable = True
+    _lock = threading.Lock()
+
+    def __init__(self, get_response):
+        path = getattr(settings, 'INSTRUMENTATION_LOG', None)
+        if not path:
+            raise MiddlewareNotUsed
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = self.start(request)
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        self.write(self.record(request, response, recorder, time.perf_counter() - started))
+        return response
+
+    async def __acall__(self, request):
+        recorder = self.start(request)
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            # 接続はリクエストのコンテキストに作られ、非同期 ORM が使うスレッドと共有される
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = await self.get_response(request)
+        record = self.record(request, response, recorder, time.perf_counter() - started)
+        await sync_to_async(self.write, thread_sensitive=False)(record)
+        return response
+
+    def start(self, request):
+        recorder = _QueryRecorder()
+        request._instrumentation = {'recorder': recorder, 'template': 0.0}
+        return recorder
+
+    def record(self, request, response, recorder, duration):
+        match = getattr(request, 'resolver_match', None)
+        return {
+            'ts': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'url_name': match.view_name if match else None,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'queries': recorder.count,
+            'db_ms': round(recorder.duration * 1000, 2),
+            'template_ms': round(request._instrumentation['template'] * 1000, 2),
+            'duplicates': recorder.duplicates(),
+        }
+
+    def process_template_response(self, request, response):
+        # 描画はこの直後に行われるので、描画後のコールバックまでの時間を描画時間とする
+        # （描画中に遅延評価されたクエリの時間は DB 時間に含め、ここからは除く）
+        state = request._instrumentation
+        started = time.perf_counter()
+        db_before = state['recorder'].duration
+
+        def finished(rendered):
+            elapsed = time.perf_counter() - started
+            state['template'] += elapsed - (state['recorder'].duration - db_before)
+
+        response.add_post_render_callback(finished)
+        return response
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line.encode())
+            finally:
+                os.close(fd)
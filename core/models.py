@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class TimeStampedModel(models.Model):
@@ -7,3 +8,38 @@ class TimeStampedModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+class Task(TimeStampedModel):
+    """core.tasks のジョブキューに積まれた 1 件の処理。"""
+
+    class Status(models.TextChoices):
+        QUEUED = 'queued', '待機中'
+        RUNNING = 'running', '実行中'
+        SUCCEEDED = 'succeeded', '完了'
+        FAILED = 'failed', '失敗'
+
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(
+        max_length=10,
+        choices=Status.choices,
+        default=Status.QUEUED,
+    )
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    idempotency_key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['run_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.name} ({self.get_status_display()})'
@@ -0,0 +1,217 @@
+"""
+キーセット（カーソル）方式のページネーション。
+
+OFFSET を使わず、並び順のキー（例: `(published_at, id)`）の値を不透明なトークンに
+詰めて次ページ／前ページを辿ります。深いページでも読み込むのは 1 ページ分の行だけです。
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import Http404
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class _CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder はミリ秒に丸めるため、キーの比較がずれないよう精度を保つ
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values) -> str:
+    raw = json.dumps(values, cls=_CursorEncoder, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token: str):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        return json.loads(raw)
+    except (binascii.Error, ValueError, TypeError) as exc:
+        raise InvalidCursor(token) from exc
+
+
+def _parse_ordering(ordering):
+    fields = []
+    for item in ordering:
+        descending = item.startswith('-')
+        fields.append((item.lstrip('-'), descending))
+    return fields
+
+
+def keyset_filter(ordering, values, *, forward=True) -> Q:
+    """`values` の位置より後ろ（forward=False なら前）の行に一致する条件を組み立てます。"""
+    condition = Q()
+    equal = Q()
+    for (name, descending), value in zip(_parse_ordering(ordering), values):
+        lookup = 'lt' if descending == forward else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+class KeysetPage:
+    is_keyset = True
+
+    def __init__(self, object_list, paginator, *, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<KeysetPage {len(self.object_list)} items>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    `ordering` の各フィールドで一意に並ぶクエリセットをキーセット方式で分割します。
+
+    `count_cache_key` を渡した場合のみ、総件数をキャッシュ付きで `count` として提供します。
+    """
+
+    def __init__(self, queryset, per_page, *, ordering=('-published_at', '-id'),
+                 count_cache_key=None, count_timeout=300):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.count_cache_key = count_cache_key
+        self.count_timeout = count_timeout
+        self._count = None
+
+    @property
+    def count(self):
+        if self.count_cache_key is None:
+            return None
+        if self._count is None:
+            self._count = cache.get(self.count_cache_key)
+            if self._count is None:
+                self._count = self.queryset.order_by().count()
+                cache.set(self.count_cache_key, self._count, self.count_timeout)
+        return self._count
+
+    def _key_values(self, obj):
+        return [getattr(obj, name) for name, _ in _parse_ordering(self.ordering)]
+
+    def _decode(self, token):
+        payload = decode_cursor(token)
+        if (
+            not isinstance(payload, list)
+            or len(payload) != 2
+            or payload[0] not in (NEXT, PREVIOUS)
+            or not isinstance(payload[1], list)
+            or len(payload[1]) != len(self.ordering)
+        ):
+            raise InvalidCursor(token)
+        model = self.queryset.model
+        values = []
+        for (name, _), value in zip(_parse_ordering(self.ordering), payload[1]):
+            field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+            try:
+                values.append(field.to_python(value))
+            except ValidationError as exc:
+                raise InvalidCursor(token) from exc
+        return payload[0], values
+
+    def _slice(self, token):
+        """カーソルの位置から 1 ページ分（次があるかを知るため 1 行多く）読むクエリセットを返します。"""
+        direction, values = self._decode(token) if token else (NEXT, None)
+        forward = direction == NEXT
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(keyset_filter(self.ordering, values, forward=forward))
+        if forward:
+            queryset = queryset.order_by(*self.ordering)
+        else:
+            queryset = queryset.order_by(*self.ordering).reverse()
+        return queryset[:self.per_page + 1], values, forward
+
+    def _build_page(self, rows, values, forward) -> KeysetPage:
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        has_next = has_more if forward else True
+        has_previous = values is not None if forward else has_more
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = encode_cursor([NEXT, self._key_values(rows[-1])])
+        if rows and has_previous:
+            previous_cursor = encode_cursor([PREVIOUS, self._key_values(rows[0])])
+        return KeysetPage(rows, self, next_cursor=next_cursor, previous_cursor=previous_cursor)
+
+    def page(self, token=None) -> KeysetPage:
+        queryset, values, forward = self._slice(token)
+        return self._build_page(list(queryset), values, forward)
+
+    async def apage(self, token=None) -> KeysetPage:
+        queryset, values, forward = self._slice(token)
+        return self._build_page([row async for row in queryset], values, forward)
+
+    async def acount(self):
+        """`count` の非同期版。先に呼んでおくと、描画中の `count` は DB を読みません。"""
+        if self.count_cache_key is None:
+            return None
+        if self._count is None:
+            self._count = await cache.aget(self.count_cache_key)
+            if self._count is None:
+                self._count = await self.queryset.order_by().acount()
+                await cache.aset(self.count_cache_key, self._count, self.count_timeout)
+        return self._count
+
+
+class KeysetPaginationMixin:
+    """ListView の OFFSET ページネーションをキーセット方式に置き換えるミックスイン。"""
+
+    keyset_ordering = ('-published_at', '-id')
+    cursor_kwarg = 'cursor'
+    # None にすると総件数を数えない
+    count_timeout = 300
+
+    def get_count_cache_key(self):
+        if self.count_timeout is None:
+            return None
+        return f'keyset-count:{self.request.path}'
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(
+            queryset,
+            page_size,
+            ordering=self.keyset_ordering,
+            count_cache_key=self.get_count_cache_key(),
+            count_timeout=self.count_timeout,
+        )
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404('無効なページです。')
+        return paginator, page, page.object_list, page.has_other_pages()
@@ -0,0 +1,74 @@
+"""
+プライマリ／リードレプリカのデータベースルーター。
+
+`ReplicaRoutingMiddleware` が `use_replica = True` の公開ビューへの GET にだけ
+レプリカの利用を許可し、その間の読み込みを `DATABASE_REPLICAS` に振り分けます。
+書き込みは常にプライマリ（default）に送り、同じリクエストで書き込んだ後の読み込みと、
+書き込んだクライアントの一定時間内の読み込みもプライマリに固定します。
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# セッションやジョブキューは書き込み直後の値を読む必要があるので、常にプライマリを使う
+PRIMARY_ONLY_APPS = {'sessions', 'core'}
+
+
+class RoutingState:
+    def __init__(self, use_replica=False):
+        self.use_replica = use_replica
+        self.wrote = False
+
+
+_state = ContextVar('db_routing_state', default=None)
+
+
+def activate(use_replica):
+    """現在のコンテキストでのレプリカ利用を設定し、`deactivate()` に渡すトークンを返します。"""
+    return _state.set(RoutingState(use_replica))
+
+
+def deactivate(token):
+    _state.reset(token)
+
+
+def replicas() -> list:
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+def reading_from_replica() -> bool:
+    """現在のコンテキストの読み込みがレプリカに振り分けられるなら True を返します。"""
+    state = _state.get()
+    return bool(state is not None and state.use_replica and not state.wrote and replicas())
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.use_replica or state.wrote:
+            return None
+        if model._meta.app_label in PRIMARY_ONLY_APPS:
+            return None
+        aliases = replicas()
+        return random.choice(aliases) if aliases else None
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            # 以降の読み込みは自分の書き込みが見えるプライマリから行う
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # レプリカはプライマリのコピーなので直接マイグレーションしない
+        if db in replicas():
+            return False
+        return None
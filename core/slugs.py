@@ -0,0 +1,111 @@
+"""
+重複しないスラッグの割り当て。
+
+`base`, `base-2`, `base-3`… について、`base` が使用中かどうかと使用中の番号の最大値を、
+ユニークインデックス上の範囲検索（`base` と `base-` 〜 `base.` の間）に絞った集計クエリ 1 回で
+データベース側で求め、次の番号を決めます。同じ `base` のスラッグがいくら増えても、
+Python に読み込むのは `base` ごとの 2 つの値だけです。
+同時書き込みで先を越された場合は `IntegrityError` を受けて割り当てからやり直します。
+`reserved` に渡したスラッグ（URL の区切りに使っている名前など）は使用中として扱います。
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import Count, IntegerField, Max, Q
+from django.db.models.functions import Cast, Substr
+from django.utils.text import slugify
+
+MAX_ATTEMPTS = 5
+# `-<番号>` を付ける余地として確保する文字数
+SUFFIX_RESERVE = 6
+
+
+def slug_base(value, max_length, fallback='item') -> str:
+    base = slugify(value or '')[:max_length - SUFFIX_RESERVE].strip('-')
+    return base or fallback
+
+
+def _range_filter(field, base) -> Q:
+    # '-' の次の文字は '.' なので、`base-` で始まるスラッグはこの範囲に収まる
+    return Q(**{field: base}) | Q(**{f'{field}__gt': f'{base}-', f'{field}__lt': f'{base}.'})
+
+
+def _suffix_pattern(base) -> str:
+    return rf'^{re.escape(base)}-[0-9]+$'
+
+
+def _reserved_suffix(base, reserved) -> int:
+    pattern = re.compile(_suffix_pattern(base))
+    return max((int(slug[len(base) + 1:]) for slug in reserved if pattern.match(slug)), default=0)
+
+
+def allocate_slugs(model, bases, *, field='slug', exclude_pk=None, reserved=(),
+                   using=DEFAULT_DB_ALIAS) -> list:
+    """`bases` のそれぞれに空いているスラッグを 1 クエリで割り当てます。"""
+    bases = list(bases)
+    if not bases:
+        return []
+    distinct = list(dict.fromkeys(bases))
+    condition = Q()
+    aggregates = {}
+    for i, base in enumerate(distinct):
+        condition |= _range_filter(field, base)
+        aggregates[f'exists_{i}'] = Count('pk', filter=Q(**{field: base}))
+        aggregates[f'max_{i}'] = Max(
+            Cast(Substr(field, len(base) + 2), IntegerField()),
+            filter=Q(**{f'{field}__regex': _suffix_pattern(base)}),
+        )
+    queryset = model._default_manager.using(using).filter(condition)
+    if exclude_pk is not None:
+        queryset = queryset.exclude(pk=exclude_pk)
+    row = queryset.aggregate(**aggregates)
+    # base ごとに、base 自体が使用中かどうかと、使用中の番号の最大値
+    used = {
+        base: (
+            bool(row[f'exists_{i}']) or base in reserved,
+            max(row[f'max_{i}'] or 0, _reserved_suffix(base, reserved)),
+        )
+        for i, base in enumerate(distinct)
+    }
+    slugs = []
+    for base in bases:
+        taken, number = used[base]
+        if taken:
+            number = max(number, 1) + 1
+            slugs.append(f'{base}-{number}')
+        else:
+            slugs.append(base)
+        used[base] = (True, number)
+    return slugs
+
+
+def allocate_slug(model, base, *, field='slug', exclude_pk=None, reserved=(), using=DEFAULT_DB_ALIAS) -> str:
+    return allocate_slugs(
+        model, [base], field=field, exclude_pk=exclude_pk, reserved=reserved, using=using
+    )[0]
+
+
+def save_with_unique_slug(instance, base, save, *, field='slug', reserved=(), using=DEFAULT_DB_ALIAS):
+    """
+    `instance` に空きスラッグを割り当てて `save()` を呼びます。
+
+    スラッグの衝突で `IntegrityError` になった場合は、割り当てからやり直します。
+    """
+    model = type(instance)
+    for attempt in range(MAX_ATTEMPTS):
+        slug = allocate_slug(
+            model, base, field=field, exclude_pk=instance.pk, reserved=reserved, using=using
+        )
+        setattr(instance, field, slug)
+        try:
+            with transaction.atomic(using=using):
+                return save()
+        except IntegrityError:
+            collided = (
+                model._default_manager.using(using)
+                .filter(**{field: slug})
+                .exclude(pk=instance.pk)
+                .exists()
+            )
+            if not collided or attempt == MAX_ATTEMPTS - 1:
+                raise
@@ -0,0 +1,193 @@
+"""
+データベースを使った小さなジョブキュー。
+
+各アプリの `tasks.py` で `@task` を付けた関数を登録し、`enqueue()` で `core.Task` に
+積みます。`manage.py runworker` のワーカーが実行し、失敗した場合は指数バックオフで
+再試行します。キューは同じデータベースにあるので、シグナルハンドラから積めば
+呼び出し元のトランザクションと一緒にコミット（またはロールバック）されます。
+"""
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF = 30
+MAX_BACKOFF = 6 * 60 * 60
+
+
+class TaskNotRegistered(KeyError):
+    pass
+
+
+class RegisteredTask:
+    def __init__(self, func, name, max_attempts, backoff):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def __repr__(self):
+        return f'<RegisteredTask {self.name}>'
+
+    def enqueue(self, *args, **kwargs):
+        return enqueue(self.name, *args, **kwargs)
+
+
+def task(name=None, *, max_attempts=DEFAULT_MAX_ATTEMPTS, backoff=DEFAULT_BACKOFF):
+    """関数をタスクとして登録するデコレータ。名前の既定値は `<app>.<関数名>` です。"""
+
+    def decorator(func):
+        task_name = name or f'{func.__module__.split(".")[0]}.{func.__name__}'
+        registered = RegisteredTask(func, task_name, max_attempts, backoff)
+        _registry[task_name] = registered
+        return registered
+
+    return decorator
+
+
+def get_task(name) -> RegisteredTask:
+    try:
+        return _registry[name]
+    except KeyError:
+        raise TaskNotRegistered(name) from None
+
+
+def enqueue(name, *args, run_at=None, delay=None, idempotency_key=None,
+            using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    タスクをキューに積み、`Task` を返します。
+
+    `idempotency_key` が同じタスクが既にあれば、新しく積まずにそれを返します。
+    `TASK_QUEUE_EAGER` が有効な場合はコミット後にその場で実行します（開発・テスト用）。
+    ただし `run_at` に未来の時刻を指定したタスク（公開予約など）は、早く実行すると結果が
+    変わるので eager でもキューに積み、ワーカーが時刻になってから実行します。
+    `delay` はまとめて実行するための猶予なので、eager ではそのまま実行します。
+    """
+    registered = get_task(name)
+    eager = getattr(settings, 'TASK_QUEUE_EAGER', False)
+    if run_at is None:
+        run_at = timezone.now() + (delay or timedelta())
+    elif run_at > timezone.now():
+        eager = False
+    if eager:
+        transaction.on_commit(lambda: registered(*args, **kwargs), using=using)
+        return None
+    values = {
+        'name': name,
+        'args': list(args),
+        'kwargs': kwargs,
+        'run_at': run_at,
+        'max_attempts': registered.max_attempts,
+    }
+    manager = Task.objects.using(using)
+    if idempotency_key is None:
+        return manager.create(**values)
+    try:
+        with transaction.atomic(using=using):
+            task_obj, _ = manager.get_or_create(idempotency_key=idempotency_key, defaults=values)
+    except IntegrityError:
+        task_obj = manager.get(idempotency_key=idempotency_key)
+    return task_obj
+
+
+def claim(worker_id, *, using=DEFAULT_DB_ALIAS, lookahead=10):
+    """実行時刻を過ぎたタスクを 1 件取り出して実行中にします。なければ None を返します。"""
+    now = timezone.now()
+    manager = Task.objects.using(using)
+    candidates = list(
+        manager.filter(status=Task.Status.QUEUED, run_at__lte=now)
+        .order_by('run_at', 'id')
+        .values_list('pk', flat=True)[:lookahead]
+    )
+    for pk in candidates:
+        # 他のワーカーと取り合いになっても、状態を条件にした UPDATE で 1 つだけが勝つ
+        claimed = manager.filter(pk=pk, status=Task.Status.QUEUED).update(
+            status=Task.Status.RUNNING,
+            locked_by=worker_id,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return manager.get(pk=pk)
+    return None
+
+
+def _retry_delay(registered, attempts) -> timedelta:
+    base = registered.backoff if registered else DEFAULT_BACKOFF
+    seconds = min(base * 2 ** max(attempts - 1, 0), MAX_BACKOFF)
+    return timedelta(seconds=seconds * random.uniform(0.8, 1.2))
+
+
+def run(task_obj, *, using=DEFAULT_DB_ALIAS) -> bool:
+    """取り出したタスクを実行し、結果を記録します。成功したら True を返します。"""
+    manager = Task.objects.using(using)
+    registered = _registry.get(task_obj.name)
+    try:
+        if registered is None:
+            raise TaskNotRegistered(task_obj.name)
+        registered(*task_obj.args, **task_obj.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception('Task %s (%s) failed', task_obj.name, task_obj.pk)
+        if registered is None or task_obj.attempts >= task_obj.max_attempts:
+            manager.filter(pk=task_obj.pk).update(
+                status=Task.Status.FAILED, last_error=error, locked_by='', locked_at=None,
+                updated_at=timezone.now(),
+            )
+        else:
+            manager.filter(pk=task_obj.pk).update(
+                status=Task.Status.QUEUED,
+                run_at=timezone.now() + _retry_delay(registered, task_obj.attempts),
+                last_error=error,
+                locked_by='',
+                locked_at=None,
+                updated_at=timezone.now(),
+            )
+        return False
+    manager.filter(pk=task_obj.pk).update(
+        status=Task.Status.SUCCEEDED, last_error='', locked_by='', locked_at=None,
+        updated_at=timezone.now(),
+    )
+    return True
+
+
+def requeue_stale(timeout, *, using=DEFAULT_DB_ALIAS) -> int:
+    """ワーカーが落ちて実行中のまま残ったタスクを待機中に戻します。"""
+    return (
+        Task.objects.using(using)
+        .filter(status=Task.Status.RUNNING, locked_at__lt=timezone.now() - timeout)
+        .update(status=Task.Status.QUEUED, locked_by='', locked_at=None)
+    )
+
+
+def enqueue_periodic(now=None, *, using=DEFAULT_DB_ALIAS):
+    """`TASK_QUEUE_PERIODIC` の各タスクを、周期ごとに 1 回だけ積みます。"""
+    now = now or timezone.now()
+    for name, interval in getattr(settings, 'TASK_QUEUE_PERIODIC', {}).items():
+        slot = int(now.timestamp()) // interval
+        enqueue(name, idempotency_key=f'periodic:{name}:{slot}', using=using)
+
+
+def purge_finished(older_than, *, using=DEFAULT_DB_ALIAS) -> int:
+    """完了してから `older_than` 以上たったタスクを削除します。"""
+    deleted, _ = (
+        Task.objects.using(using)
+        .filter(status=Task.Status.SUCCEEDED, updated_at__lt=timezone.now() - older_than)
+        .delete()
+    )
+    return deleted
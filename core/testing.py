@@ -0,0 +1,53 @@
+"""
+ビューごとのクエリ数の上限（クエリバジェット）を検査するテスト用ヘルパー。
+
+テストケースで `query_budgets` に URL 名ごとの上限を宣言し、`assertQueryBudget()` で
+リクエストを実行します。`budget_namespaces` に挙げた名前空間の URL に上限の宣言漏れがあると
+`test_query_budgets_cover_urls` が失敗するので、新しいビューを追加したときにも気付けます。
+"""
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver
+
+# キャッシュを消すテストは、共有の FileBasedCache（var/cache）ではなくこれを使う
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def namespace_url_names(namespace) -> set:
+    """名前空間に含まれる URL 名を `<名前空間>:<名前>` の形で返します。"""
+    _, resolver = get_resolver().namespace_dict[namespace]
+    names = set()
+    patterns = list(resolver.url_patterns)
+    while patterns:
+        pattern = patterns.pop()
+        if isinstance(pattern, URLResolver):
+            patterns.extend(pattern.url_patterns)
+        elif pattern.name:
+            names.add(f'{namespace}:{pattern.name}')
+    return names
+
+
+class QueryBudgetMixin:
+    query_budgets = {}
+    budget_namespaces = ()
+
+    def assertQueryBudget(self, url_name, request, *, using=DEFAULT_DB_ALIAS):
+        """`request()` を実行し、発行されたクエリが `url_name` の上限以内であることを確かめます。"""
+        if url_name not in self.query_budgets:
+            self.fail(f'{url_name} のクエリバジェットが宣言されていません。')
+        budget = self.query_budgets[url_name]
+        with CaptureQueriesContext(connections[using]) as context:
+            response = request()
+        executed = len(context.captured_queries)
+        if executed > budget:
+            queries = '\n'.join(
+                f'{number}. {query["sql"]}' for number, query in enumerate(context.captured_queries, 1)
+            )
+            self.fail(f'{url_name}: クエリが {executed} 件で、上限の {budget} 件を超えました。\n{queries}')
+        return response
+
+    def test_query_budgets_cover_urls(self):
+        declared = set(self.query_budgets)
+        for namespace in self.budget_namespaces:
+            missing = namespace_url_names(namespace) - declared
+            self.assertFalse(missing, f'クエリバジェットが宣言されていない URL: {sorted(missing)}')
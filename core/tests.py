@@ -1,3 +1,365 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.db import OperationalError, connection, router, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.signals import template_rendered
+from django.urls import reverse
+from django.utils import timezone
+
+from posts.models import Post
+
+from . import routers, tasks
+from .cache import bump, get_versions
+from .checks import check_shared_cache
+from .db import write_with_retry
+from .middleware import PIN_COOKIE, ReplicaRoutingMiddleware
+from .models import Task
+from .pagination import InvalidCursor, KeysetPaginator, encode_cursor
+from .slugs import SUFFIX_RESERVE, allocate_slug, allocate_slugs
+from .testing import LOCMEM_CACHES
+
+# TaskQueueTests の flaky タスクが失敗する残り回数
+failures_left = []
+
+
+@tasks.task('core.tests_flaky', max_attempts=3, backoff=60)
+def flaky(value):
+    if failures_left:
+        failures_left.pop()
+        raise RuntimeError(f'flaky {value}')
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    def test_shipped_cache_is_shared(self):
+        self.assertEqual(check_shared_cache(None), [])
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_process_local_cache_is_an_error(self):
+        errors = check_shared_cache(None)
+        self.assertEqual([error.id for error in errors], ['core.E001'])
+
+    @override_settings(CACHES=LOCMEM_CACHES, TASK_QUEUE_EAGER=True)
+    def test_eager_queue_allows_process_local_cache(self):
+        self.assertEqual(check_shared_cache(None), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BumpTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_bump_changes_version_after_commit(self):
+        before = get_versions('posts', 'taxonomy')
+        with self.captureOnCommitCallbacks(execute=True):
+            bump('posts')
+            self.assertEqual(get_versions('posts'), {'posts': before['posts']})
+        after = get_versions('posts', 'taxonomy')
+        self.assertNotEqual(after['posts'], before['posts'])
+        self.assertEqual(after['taxonomy'], before['taxonomy'])
+
+
+@override_settings(TASK_QUEUE_EAGER=False)
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        failures_left.clear()
+
+    def test_task_is_claimed_once(self):
+        task_obj = tasks.enqueue('core.tests_flaky', 1)
+        claimed = tasks.claim('worker-1')
+        self.assertEqual(claimed.pk, task_obj.pk)
+        self.assertEqual((claimed.status, claimed.locked_by, claimed.attempts), (Task.Status.RUNNING, 'worker-1', 1))
+        self.assertIsNone(tasks.claim('worker-2'))
+
+    def test_failure_is_retried_after_backoff(self):
+        failures_left.append(True)
+        task_obj = tasks.enqueue('core.tests_flaky', 1)
+        started = timezone.now()
+        with self.assertLogs('core.tasks', 'ERROR'):
+            self.assertFalse(tasks.run(tasks.claim('worker-1')))
+        task_obj.refresh_from_db()
+        self.assertEqual(task_obj.status, Task.Status.QUEUED)
+        self.assertIn('flaky 1', task_obj.last_error)
+        # 1 回目の失敗の待ち時間は backoff の ±20%
+        self.assertGreaterEqual(task_obj.run_at, started + timedelta(seconds=48))
+        self.assertLessEqual(task_obj.run_at, timezone.now() + timedelta(seconds=72))
+        self.assertIsNone(tasks.claim('worker-1'))
+
+        Task.objects.filter(pk=task_obj.pk).update(run_at=timezone.now())
+        claimed = tasks.claim('worker-2')
+        self.assertEqual(claimed.attempts, 2)
+        self.assertTrue(tasks.run(claimed))
+        task_obj.refresh_from_db()
+        self.assertEqual((task_obj.status, task_obj.last_error), (Task.Status.SUCCEEDED, ''))
+
+    def test_task_fails_after_max_attempts(self):
+        failures_left.extend([True] * 3)
+        task_obj = tasks.enqueue('core.tests_flaky', 1)
+        for _ in range(3):
+            Task.objects.filter(pk=task_obj.pk).update(run_at=timezone.now())
+            with self.assertLogs('core.tasks', 'ERROR'):
+                self.assertFalse(tasks.run(tasks.claim('worker-1')))
+        task_obj.refresh_from_db()
+        self.assertEqual((task_obj.status, task_obj.attempts), (Task.Status.FAILED, 3))
+        self.assertIsNone(tasks.claim('worker-1'))
+
+    def test_delayed_task_waits_for_run_at(self):
+        tasks.enqueue('core.tests_flaky', 1, delay=timedelta(minutes=5))
+        self.assertIsNone(tasks.claim('worker-1'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        # 公開日時が同じ投稿は id の降順で並ぶ（ページの境目をまたいでも抜けや重複がない）
+        for number in range(5):
+            Post.objects.create(
+                title=f'同時刻 {number}', body='本文', status=Post.Status.PUBLISHED, published_at=now
+            )
+        for number in range(7):
+            Post.objects.create(
+                title=f'過去 {number}', body='本文', status=Post.Status.PUBLISHED,
+                published_at=now - timedelta(days=number + 1),
+            )
+        cls.expected = list(Post.objects.published().order_by('-published_at', '-id'))
+
+    def setUp(self):
+        cache.clear()
+        self.paginator = KeysetPaginator(Post.objects.published(), 3)
+
+    def test_cursors_round_trip_with_ties(self):
+        pages = [self.paginator.page()]
+        while pages[-1].has_next():
+            pages.append(self.paginator.page(pages[-1].next_cursor))
+        self.assertEqual([post for page in pages for post in page], self.expected)
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 3])
+        self.assertFalse(pages[0].has_previous())
+
+        # 前のページのカーソルで戻ると、同じページが返る
+        for page, previous in zip(pages[1:], pages):
+            back = self.paginator.page(page.previous_cursor)
+            self.assertEqual(list(back), list(previous))
+        self.assertFalse(self.paginator.page(pages[1].previous_cursor).has_previous())
+
+    def test_invalid_cursors(self):
+        for token in ('invalid', encode_cursor(['x', [1, 2]]), encode_cursor(['n', [1]]),
+                      encode_cursor(['n', ['not a date', 1]])):
+            with self.subTest(token):
+                with self.assertRaises(InvalidCursor):
+                    self.paginator.page(token)
+
+    def test_list_view_pages_and_rejects_invalid_cursor(self):
+        url = reverse('posts:post_list')
+        first = self.client.get(url).context['page_obj']
+        second = self.client.get(url, {'cursor': first.next_cursor}).context['page_obj']
+        self.assertEqual(list(first) + list(second), self.expected)
+        self.assertFalse(second.has_next())
+        self.assertEqual(self.client.get(url, {'cursor': 'invalid'}).status_code, 404)
+
+
+class SlugTests(TestCase):
+    def create(self, title, **kwargs):
+        return Post.objects.create(title=title, body='本文', **kwargs)
+
+    def test_collisions_get_the_next_free_number(self):
+        slugs = [self.create('Hello World').slug for _ in range(3)]
+        self.assertEqual(slugs, ['hello-world', 'hello-world-2', 'hello-world-3'])
+        self.create('Hello', slug='hello-world-10')
+        self.create('Hello', slug='hello-worldwide')
+        self.assertEqual(self.create('Hello World').slug, 'hello-world-11')
+
+    def test_titles_without_ascii_fall_back(self):
+        self.assertEqual(self.create('日本語のタイトル').slug, 'post')
+        self.assertEqual(self.create('旅行記').slug, 'post-2')
+        self.assertEqual(self.create('Django 入門').slug, 'django')
+
+    def test_next_number_is_computed_in_one_query(self):
+        Post.objects.bulk_create(
+            [Post(title='記事', body='本文', slug='post')]
+            + [Post(title='記事', body='本文', slug=f'post-{n}') for n in range(2, 200)]
+            + [Post(title='記事', body='本文', slug='post-300-draft')]
+        )
+        with self.assertNumQueries(1):
+            self.assertEqual(allocate_slug(Post, 'post'), 'post-200')
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                allocate_slugs(Post, ['post', 'news', 'post', 'news']),
+                ['post-200', 'news', 'post-201', 'news-2'],
+            )
+
+    def test_reserved_slugs_are_skipped(self):
+        self.assertEqual(allocate_slug(Post, 'feed', reserved={'feed'}), 'feed-2')
+        self.assertEqual(allocate_slug(Post, 'feed', reserved={'feed', 'feed-2'}), 'feed-3')
+        self.assertEqual(self.create('Search').slug, 'search-2')
+
+    def test_long_titles_leave_room_for_the_suffix(self):
+        max_length = Post._meta.get_field('slug').max_length
+        first = self.create('a' * 300)
+        second = self.create('a' * 300)
+        self.assertEqual(len(first.slug), max_length - SUFFIX_RESERVE)
+        self.assertEqual(second.slug, f'{first.slug}-2')
+
+    def test_slug_is_kept_on_update(self):
+        post = self.create('Hello World')
+        post.title = 'Goodbye'
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(post.slug, 'hello-world')
+
+    def test_concurrent_insert_is_retried(self):
+        raced = []
+
+        def create_competitor(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if not raced and sql.startswith('SELECT COUNT("posts_post"."id") FILTER'):
+                raced.append(self.create('Competitor', slug='hello-world'))
+            return result
+
+        with connection.execute_wrapper(create_competitor):
+            post = self.create('Hello World')
+        self.assertEqual(len(raced), 1)
+        self.assertEqual(post.slug, 'hello-world-2')
+
+
+class WriteWithRetryTests(TransactionTestCase):
+    def failing(self, *errors):
+        """`errors` を順に送出し、その後は投稿を 1 件作る関数を返します。"""
+        errors = list(errors)
+        calls = []
+
+        def write():
+            calls.append(True)
+            Post.objects.create(title=f'試行 {len(calls)}', body='本文')
+            if errors:
+                raise errors.pop(0)
+            return len(calls)
+
+        return write, calls
+
+    def test_locked_writes_are_retried_in_a_fresh_transaction(self):
+        write, calls = self.failing(OperationalError('database is locked'), OperationalError('database is busy'))
+        with self.assertLogs('core.db', 'WARNING'):
+            self.assertEqual(write_with_retry(write), 3)
+        # 失敗した試行の書き込みはロールバックされている
+        self.assertEqual(list(Post.objects.values_list('title', flat=True)), ['試行 3'])
+
+    def test_gives_up_after_attempts(self):
+        write, calls = self.failing(*[OperationalError('database is locked')] * 3)
+        with self.assertLogs('core.db', 'WARNING'), self.assertRaises(OperationalError):
+            write_with_retry(write, attempts=2)
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(Post.objects.exists())
+
+    def test_other_operational_errors_are_not_retried(self):
+        write, calls = self.failing(OperationalError('no such table: posts_post'))
+        with self.assertRaises(OperationalError):
+            write_with_retry(write)
+        self.assertEqual(len(calls), 1)
+
+    def test_runs_once_inside_an_outer_transaction(self):
+        write, calls = self.failing(OperationalError('database is locked'))
+        with self.assertRaises(OperationalError), transaction.atomic():
+            write_with_retry(write)
+        self.assertEqual(len(calls), 1)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRoutingTests(TestCase):
+    def route(self, request, write=False):
+        """ミドルウェアを通したビューの中で、投稿の読み込み先を（書き込みの前後で）記録します。"""
+        reads = []
+
+        def view(request):
+            reads.append(router.db_for_read(Post))
+            if write:
+                router.db_for_write(Post)
+                reads.append(router.db_for_read(Post))
+            return HttpResponse()
+
+        response = ReplicaRoutingMiddleware(view)(request)
+        return reads, response
+
+    def test_replica_views_read_from_replica(self):
+        factory = RequestFactory()
+        reads, response = self.route(factory.get(reverse('posts:post_list')))
+        self.assertEqual(reads, ['replica1'])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        # use_replica のないビュー（管理ページ）はプライマリから読む
+        reads, _ = self.route(factory.get(reverse('posts:manage_post_list')))
+        self.assertEqual(reads, ['default'])
+        # リクエストの外（ワーカーなど）は常にプライマリ
+        self.assertEqual(router.db_for_read(Post), 'default')
+
+    def test_reads_after_a_write_stick_to_primary(self):
+        factory = RequestFactory()
+        reads, _ = self.route(factory.get(reverse('posts:post_list')), write=True)
+        self.assertEqual(reads, ['replica1', 'default'])
+
+        reads, response = self.route(factory.post(reverse('posts:post_list')))
+        self.assertEqual(reads, ['default'])
+        self.assertIn(PIN_COOKIE, response.cookies)
+        request = factory.get(reverse('posts:post_list'))
+        request.COOKIES[PIN_COOKIE] = '1'
+        self.assertEqual(self.route(request)[0], ['default'])
+
+    def test_primary_only_apps(self):
+        token = routers.activate(True)
+        self.addCleanup(routers.deactivate, token)
+        self.assertEqual(router.db_for_read(Post), 'replica1')
+        self.assertEqual(router.db_for_read(Session), 'default')
+        self.assertEqual(router.db_for_read(Task), 'default')
+
+    def test_client_is_pinned_after_posting(self):
+        post = Post.objects.create(title='投稿', body='本文', status=Post.Status.PUBLISHED)
+        data = {'name': '読者', 'email': 'reader@example.com', 'body': 'こんにちは'}
+        response = self.client.post(reverse('comments:comment_create', kwargs={'post_slug': post.slug}), data)
+        self.assertIn(PIN_COOKIE, response.cookies)
+        # テストに replica1 の接続はないので、レプリカから読もうとすると失敗する
+        self.assertContains(self.client.get(post.get_absolute_url()), 'こんにちは')
+
+
+# テストではプライマリを遅れのあるレプリカに見立てる（読み込み先は default のまま）
+@override_settings(DATABASE_REPLICAS=['default'], DATABASE_REPLICA_LAG_SECONDS=60, CACHES=LOCMEM_CACHES)
+class ReplicaStalenessTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rendered = []
+        template_rendered.connect(self._on_render)
+        self.addCleanup(template_rendered.disconnect, self._on_render)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post = Post.objects.create(title='投稿', body='本文', status=Post.Status.PUBLISHED)
+
+    def _on_render(self, sender, template, context, **kwargs):
+        self.rendered.append(template.name)
+
+    def get(self, url, client=None):
+        self.rendered.clear()
+        response = (client or self.client_class()).get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_recent_changes_are_not_cached_from_replica(self):
+        for url in (self.post.get_absolute_url(), reverse('posts:post_list'), reverse('posts:feed')):
+            with self.subTest(url):
+                self.assertNotIn('ETag', self.get(url))
+        url = self.post.get_absolute_url()
+        self.get(url)
+        self.assertTrue(self.rendered)
+
+        # プライマリに固定されたクライアントは最新の内容を読むので、検証もキャッシュもする
+        pinned = self.client_class()
+        pinned.cookies[PIN_COOKIE] = '1'
+        self.assertIn('ETag', self.get(url, pinned))
+        self.get(url)
+        self.assertEqual(self.rendered, [])
+
+    @override_settings(DATABASE_REPLICA_LAG_SECONDS=0)
+    def test_replica_is_cached_once_caught_up(self):
+        url = self.post.get_absolute_url()
+        self.assertIn('ETag', self.get(url))
+        self.get(url)
+        self.assertEqual(self.rendered, [])
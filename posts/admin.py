@@ -1,26 +1,79 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.urls import reverse
+from django.utils.html import format_html
 
+from core.changelist import ScalableAdminMixin, TopRelatedListFilter
+
+from . import search, taxonomy
 from .models import Category, Post, Tag
 
 
+class PostLinkMixin:
+    """投稿の一覧をこのタグ・カテゴリで絞り込むリンクの列（TopRelatedListFilter に出ないもの用）。"""
+
+    post_filter = ''
+
+    @admin.display(description='投稿', ordering='post_count')
+    def post_link(self, obj):
+        url = reverse('admin:posts_post_changelist') + f'?{self.post_filter}={obj.pk}'
+        return format_html('<a href="{}">{} 件</a>', url, obj.post_count)
+
+
 @admin.register(Category)
-class CategoryAdmin(admin.ModelAdmin):
-    list_display = ('name', 'slug', 'updated_at')
+class CategoryAdmin(PostLinkMixin, admin.ModelAdmin):
+    list_display = ('name', 'slug', 'post_link', 'updated_at')
     search_fields = ('name', 'slug')
     prepopulated_fields = {'slug': ('name',)}
+    post_filter = 'category__id__exact'
 
 
 @admin.register(Tag)
-class TagAdmin(admin.ModelAdmin):
-    list_display = ('name', 'slug', 'updated_at')
+class TagAdmin(PostLinkMixin, admin.ModelAdmin):
+    list_display = ('name', 'slug', 'post_link', 'updated_at')
     search_fields = ('name', 'slug')
     prepopulated_fields = {'slug': ('name',)}
+    post_filter = 'tags__id__exact'
+
+
+class PostActionForm(ActionForm):
+    tag_names = forms.CharField(
+        required=False,
+        label='タグ',
+        widget=forms.TextInput(attrs={'placeholder': 'カンマ区切りのタグ名'}),
+    )
 
 
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
-    list_display = ('title', 'status', 'published_at', 'updated_at')
-    list_filter = ('status', 'category', 'tags')
+class PostAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ('title', 'author', 'category', 'status', 'published_at', 'is_live', 'updated_at')
+    list_select_related = ('author', 'category')
+    list_defer = ('body', 'excerpt', 'summary', 'image_renditions')
+    list_filter = (
+        'status',
+        ('category', TopRelatedListFilter),
+        ('tags', TopRelatedListFilter),
+    )
     search_fields = ('title', 'slug', 'body')
     prepopulated_fields = {'slug': ('title',)}
     autocomplete_fields = ('category', 'tags', 'author')
+    action_form = PostActionForm
+    actions = ('add_tags',)
+
+    @admin.action(description='選択した投稿にタグを追加')
+    def add_tags(self, request, queryset):
+        names = taxonomy.parse_tag_names(request.POST.get('tag_names', ''))
+        if not names:
+            self.message_user(request, 'タグ名を入力してください。', messages.WARNING)
+            return
+        result = taxonomy.assign_taxonomy(queryset, tag_names=names)
+        self.message_user(request, f'{queryset.count()} 件の投稿にタグ「{", ".join(names)}」を追加しました。')
+        if result.created_tags:
+            self.message_user(request, f'新しいタグ「{", ".join(result.created_tags)}」を作成しました。')
+
+    def get_search_results(self, request, queryset, search_term):
+        # 本文への LIKE を避け、全文検索の索引で絞り込む
+        if not search_term.strip() or not search.is_available(queryset.db):
+            return super().get_search_results(request, queryset, search_term)
+        return search.filter_queryset(queryset, search_term), False
@@ -0,0 +1,156 @@
+"""
+公開ページの非同期版ビュー（ASGI で動かすときに使う。`ASYNC_PUBLIC_VIEWS`）。
+
+同期版のビュー（posts.views）を継承し、`get()` だけを非同期にしています。ページの内容・
+サイドバー・コメントなど互いに依存しないクエリは `gather()` でまとめて待ち、描画前に
+すべて読み込んでおきます（描画中に遅延評価のクエリを発行しないため）。
+
+Django の非同期 ORM は、現状では各クエリをリクエストのスレッドで順に実行します。
+並行に待つことでクエリ同士は速くなりませんが、キャッシュの読み込みなどとは重なり、
+待っている間にイベントループが他のリクエストを処理できます。
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.db import connections, router
+from django.http import Http404
+from django.shortcuts import aget_object_or_404
+
+from comments import spool
+from comments.views import acomment_page
+from core.pagination import InvalidCursor, KeysetPaginator
+
+from . import trending
+from .models import Category, Post, PostArchiveMonth, Tag
+from .views import PostDetailView, PostListView, archive_range, popular_posts
+
+
+async def gather(lookups: dict) -> dict:
+    """{名前: コルーチン} を並行に待ち、{名前: 結果} を返します。1 つでも失敗したら残りは取り消します。"""
+    # 接続はリクエストのコンテキストで作っておく（タスクの中で作ると、リクエストの終了時に閉じられない）
+    connections[router.db_for_read(Post)]
+    tasks = {name: asyncio.ensure_future(lookup) for name, lookup in lookups.items()}
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        raise
+    return {name: task.result() for name, task in tasks.items()}
+
+
+async def _fetch(queryset) -> list:
+    return [obj async for obj in queryset]
+
+
+class AsyncPostListView(PostListView):
+    async def apaginate(self):
+        paginator = KeysetPaginator(
+            self.get_queryset(),
+            self.paginate_by,
+            ordering=self.keyset_ordering,
+            count_cache_key=self.get_count_cache_key(),
+            count_timeout=self.count_timeout,
+        )
+        try:
+            page, _ = await asyncio.gather(
+                paginator.apage(self.request.GET.get(self.cursor_kwarg)), paginator.acount()
+            )
+        except InvalidCursor:
+            raise Http404('無効なページです。')
+        return page
+
+    def get_lookups(self):
+        """テンプレートに渡す値を、互いに独立したコルーチンの辞書で返します。"""
+        return {
+            'page_obj': self.apaginate(),
+            'categories': _fetch(Category.objects.all()),
+            'trending_tags': _fetch(trending.trending_tags()),
+            'popular_posts': _fetch(popular_posts()),
+            'archive_months': _fetch(PostArchiveMonth.objects.all()),
+        }
+
+    def paginate_queryset(self, queryset, page_size):
+        # get() で読み込み済みのページを使う
+        return self.page.paginator, self.page, self.page.object_list, self.page.has_other_pages()
+
+    async def get(self, request, *args, **kwargs):
+        context = await gather(self.get_lookups())
+        self.page = context.pop('page_obj')
+        self.object_list = self.page.object_list
+        # PostListView.get_context_data はサイドバーを遅延評価のクエリセットで追加するので通らない
+        context = super(PostListView, self).get_context_data(object_list=self.object_list, **context)
+        return self.render_to_response(context)
+
+
+class AsyncCategoryPostListView(AsyncPostListView):
+    def get_queryset(self):
+        # カテゴリの読み込みを待たずに一覧を読めるよう、スラッグで絞り込む
+        return super().get_queryset().filter(category__slug=self.kwargs['slug'])
+
+    def get_lookups(self):
+        return {
+            **super().get_lookups(),
+            'active_category': aget_object_or_404(Category, slug=self.kwargs['slug']),
+        }
+
+
+class AsyncTagPostListView(AsyncPostListView):
+    def get_queryset(self):
+        return super().get_queryset().filter(tags__slug=self.kwargs['slug'])
+
+    def get_lookups(self):
+        return {
+            **super().get_lookups(),
+            'active_tag': aget_object_or_404(Tag, slug=self.kwargs['slug']),
+        }
+
+
+class AsyncYearArchivePostListView(AsyncPostListView):
+    def get_queryset(self):
+        return super().get_queryset().filter(**archive_range(self.kwargs['year']))
+
+    def get_lookups(self):
+        return {**super().get_lookups(), 'year_months': self.ayear_months()}
+
+    async def ayear_months(self):
+        months = await _fetch(PostArchiveMonth.objects.filter(year=self.kwargs['year']))
+        if not months:
+            raise Http404('投稿がありません。')
+        return months
+
+
+class AsyncMonthArchivePostListView(AsyncPostListView):
+    def get_queryset(self):
+        return super().get_queryset().filter(**archive_range(self.kwargs['year'], self.kwargs['month']))
+
+    def get_lookups(self):
+        return {
+            **super().get_lookups(),
+            'archive_month': aget_object_or_404(
+                PostArchiveMonth, year=self.kwargs['year'], month=self.kwargs['month']
+            ),
+        }
+
+
+class AsyncPostDetailView(PostDetailView):
+    async def get(self, request, *args, **kwargs):
+        slug = self.kwargs[self.slug_url_kwarg]
+        self.pending_ids = spool.pending_ids(request)
+        try:
+            results = await gather({
+                'post': self.get_queryset().aget(slug=slug),
+                'comments_page': acomment_page(slug, request.GET.get('comments')),
+                'pending': sync_to_async(spool.pending)(self.pending_ids),
+                'related_posts': _fetch(self.get_related_posts()),
+            })
+        except Post.DoesNotExist:
+            raise Http404('投稿が見つかりません。')
+        except InvalidCursor:
+            raise Http404('無効なページです。')
+        self.object = results['post']
+        # PostDetailView.get_context_data はコメントを同期的に読むので通らない
+        context = super(PostDetailView, self).get_context_data(object=self.object)
+        context.update(self.get_comments_context(results['comments_page'], results['pending']))
+        context['related_posts'] = results['related_posts']
+        return self.clear_pending_cookie(self.render_to_response(context))
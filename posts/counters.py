@@ -0,0 +1,116 @@
+"""
+タグ・カテゴリ・年月（`PostArchiveMonth`）ごとの公開済み投稿数（`post_count`）と、
+投稿ごとの公開コメント数（`comment_count`）の維持。
+
+書き込みのたびに影響を受けた行だけを 1 本の UPDATE で数え直すので、
+一覧表示では COUNT を発行せずに件数を表示できます。
+"""
+from datetime import datetime
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+
+from comments.models import Comment
+
+from .models import Category, Post, PostArchiveMonth, Tag
+
+
+def _published_count(using, **filters):
+    counts = (
+        Post.objects.using(using)
+        .published()
+        .filter(**filters)
+        .order_by()
+        .values(*filters)
+        .annotate(count=Count('pk'))
+        .values('count')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def refresh_category_counts(category_ids, using=DEFAULT_DB_ALIAS):
+    category_ids = {pk for pk in category_ids if pk is not None}
+    if category_ids:
+        Category.objects.using(using).filter(pk__in=category_ids).update(
+            post_count=_published_count(using, category=OuterRef('pk'))
+        )
+
+
+def refresh_tag_counts(tag_ids, using=DEFAULT_DB_ALIAS):
+    tag_ids = {pk for pk in tag_ids if pk is not None}
+    if tag_ids:
+        Tag.objects.using(using).filter(pk__in=tag_ids).update(
+            post_count=_published_count(using, tags=OuterRef('pk'))
+        )
+
+
+def _public_comment_count(using):
+    counts = (
+        Comment.objects.using(using)
+        .public()
+        .filter(post=OuterRef('pk'))
+        .order_by()
+        .values('post')
+        .annotate(count=Count('pk'))
+        .values('count')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def refresh_comment_counts(post_ids, using=DEFAULT_DB_ALIAS) -> int:
+    """投稿のコメント数を数え直します。件数が変わった投稿の数を返します。"""
+    post_ids = {pk for pk in post_ids if pk is not None}
+    if not post_ids:
+        return 0
+    return (
+        Post.objects.using(using)
+        .filter(pk__in=post_ids)
+        .exclude(comment_count=_public_comment_count(using))
+        .update(comment_count=_public_comment_count(using))
+    )
+
+
+def month_range(year, month):
+    """年月の始まりと、翌月の始まりの日時（現在のタイムゾーン）を返します。"""
+    start = timezone.make_aware(datetime(year, month, 1))
+    end = timezone.make_aware(datetime(year + month // 12, month % 12 + 1, 1))
+    return start, end
+
+
+def archive_month(published_at):
+    local = timezone.localtime(published_at)
+    return local.year, local.month
+
+
+def refresh_archive_counts(published_ats, using=DEFAULT_DB_ALIAS):
+    """公開日時の属する年月の投稿数を、`published_at` の範囲で数え直します。"""
+    months = {archive_month(value) for value in published_ats if value is not None}
+    manager = PostArchiveMonth.objects.using(using)
+    for year, month in months:
+        start, end = month_range(year, month)
+        count = Post.objects.using(using).published().filter(published_at__gte=start, published_at__lt=end).count()
+        if count:
+            manager.update_or_create(year=year, month=month, defaults={'post_count': count})
+        else:
+            manager.filter(year=year, month=month).delete()
+
+
+def rebuild_counts(using=DEFAULT_DB_ALIAS):
+    """すべてのタグ・カテゴリ・年月の投稿数と、投稿のコメント数を数え直します。"""
+    Category.objects.using(using).update(post_count=_published_count(using, category=OuterRef('pk')))
+    Tag.objects.using(using).update(post_count=_published_count(using, tags=OuterRef('pk')))
+    Post.objects.using(using).update(comment_count=_public_comment_count(using))
+    months = (
+        Post.objects.using(using).published()
+        .annotate(month=TruncMonth('published_at'))
+        .order_by()
+        .values('month')
+        .annotate(count=Count('pk'))
+        .values_list('month', 'count')
+    )
+    PostArchiveMonth.objects.using(using).all().delete()
+    PostArchiveMonth.objects.using(using).bulk_create([
+        PostArchiveMonth(year=month.year, month=month.month, post_count=count) for month, count in months
+    ])
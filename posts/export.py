@@ -0,0 +1,217 @@
+"""
+公開ページの静的書き出し（`manage.py export_static`）。
+
+投稿一覧・カテゴリ・タグ・年別・月別の各一覧の 1 ページ目と、公開済みの投稿詳細を、通常の
+ビューとテンプレートで描画してディレクトリに書き出します。ページごとに表示内容の元になるデータ
+（投稿・タグ・カテゴリ・コメント・関連記事・人気記事・月別の投稿数・テンプレート）から指紋を
+計算してマニフェストに記録し、
+次回は指紋が変わったページだけを描画し直します。
+
+2 ページ目以降（`?cursor=`）やコメントの投稿・続きの読み込みは、引き続き Django が処理します。
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.contrib.auth.models import AnonymousUser
+from django.db import connections
+from django.db.models import Max
+from django.template import engines
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+
+from comments.models import Comment
+
+from . import counters, trending
+from .models import Category, PopularPost, Post, PostArchiveMonth, RelatedPost, Tag
+from .views import POPULAR_DAYS, POPULAR_LIMIT, PostListView
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = '.export-manifest.json'
+
+
+def _fingerprint(value) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _templates_fingerprint() -> str:
+    """テンプレートを書き換えたら全ページを描画し直すよう、テンプレートの内容も指紋に含める。"""
+    digest = hashlib.sha1()
+    for engine in engines.all():
+        for directory in getattr(engine, 'template_dirs', ()):
+            for path in sorted(Path(directory).rglob('*.html')):
+                digest.update(str(path).encode())
+                digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def collect_pages() -> dict:
+    """書き出すページの URL と、その内容の指紋の辞書を返します。"""
+    per_page = PostListView.paginate_by
+    posts = list(
+        Post.objects.published()
+        .order_by('-published_at', '-id')
+        .values_list(
+            'pk', 'slug', 'updated_at', 'published_at', 'comment_count', 'category_id',
+            'image_renditions', 'author_id',
+        )
+    )
+    post_ids = [row[0] for row in posts]
+    by_pk = {row[0]: row for row in posts}
+    post_tags = defaultdict(list)
+    for post_id, tag_id in Post.tags.through.objects.filter(post_id__in=post_ids).values_list(
+        'post_id', 'tag_id'
+    ):
+        post_tags[post_id].append(tag_id)
+    last_comment = dict(
+        Comment.objects.public()
+        .filter(post_id__in=post_ids)
+        .order_by()
+        .values('post')
+        .annotate(last=Max('updated_at'))
+        .values_list('post', 'last')
+    )
+    tags = {row[0]: row for row in Tag.objects.values_list('pk', 'slug', 'name', 'updated_at', 'post_count')}
+    categories = {
+        row[0]: row for row in Category.objects.values_list('pk', 'slug', 'name', 'updated_at', 'post_count')
+    }
+    trending_tags = list(
+        Tag.objects.order_by(*trending.TRENDING_ORDERING)
+        .values_list('pk', 'slug', 'name', 'post_count')[:trending.TRENDING_LIMIT]
+    )
+    # 関連記事・人気記事は公開済みのものだけが表示されるので、公開済みの投稿の行から引く
+    related = defaultdict(list)
+    for post_id, related_id in (
+        RelatedPost.objects.filter(post_id__in=post_ids).order_by('post', 'rank').values_list('post', 'related')
+    ):
+        if related_id in by_pk:
+            related[post_id].append(by_pk[related_id][:4])
+    popular = [
+        by_pk[post_id][:4]
+        for post_id in PopularPost.objects.filter(days=POPULAR_DAYS).values_list('post', flat=True)
+        if post_id in by_pk
+    ][:POPULAR_LIMIT]
+    archive_months = list(PostArchiveMonth.objects.values_list('year', 'month', 'post_count'))
+    templates = _templates_fingerprint()
+    sidebar = [sorted(categories.values()), trending_tags, popular, archive_months]
+
+    def post_version(row):
+        pk, slug, updated_at, published_at, comment_count, category_id, renditions, author_id = row
+        return [
+            pk, slug, updated_at, published_at, comment_count, renditions, author_id,
+            categories.get(category_id),
+            sorted(tags[tag_id] for tag_id in post_tags[pk]),
+        ]
+
+    def list_page(rows):
+        return _fingerprint([
+            templates,
+            sidebar,
+            [post_version(row) for row in rows[:per_page]],
+            len(rows),
+        ])
+
+    pages = {reverse('posts:post_list'): list_page(posts)}
+    for category_id, category in categories.items():
+        rows = [row for row in posts if row[5] == category_id]
+        pages[reverse('posts:category', kwargs={'slug': category[1]})] = list_page(rows)
+    for tag_id, tag in tags.items():
+        rows = [row for row in posts if tag_id in post_tags[row[0]]]
+        pages[reverse('posts:tag', kwargs={'slug': tag[1]})] = list_page(rows)
+    post_months = {row[0]: counters.archive_month(row[3]) for row in posts}
+    for year in sorted({year for year, month, count in archive_months}):
+        rows = [row for row in posts if post_months[row[0]][0] == year]
+        pages[reverse('posts:archive_year', kwargs={'year': year})] = list_page(rows)
+    for year, month, count in archive_months:
+        rows = [row for row in posts if post_months[row[0]] == (year, month)]
+        pages[reverse('posts:archive_month', kwargs={'year': year, 'month': month})] = list_page(rows)
+    for row in posts:
+        pages[reverse('posts:post_detail', kwargs={'slug': row[1]})] = _fingerprint([
+            templates,
+            post_version(row),
+            last_comment.get(row[0]),
+            related[row[0]],
+        ])
+    return pages
+
+
+def output_path(out_dir, url) -> Path:
+    return Path(out_dir) / url.strip('/') / 'index.html'
+
+
+def render_page(url, host='localhost') -> bytes:
+    """匿名ユーザーとしてビューを呼び出し、書き出し用の HTML を返します。"""
+    request = RequestFactory(HTTP_HOST=host).get(url)
+    request.user = AnonymousUser()
+    # テンプレートとページキャッシュに、静的書き出し用の描画であることを伝える
+    request.static_export = True
+    match = resolve(request.path_info)
+    response = match.func(request, *match.args, **match.kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    if response.status_code != 200:
+        raise ValueError(f'{url} returned {response.status_code}')
+    return response.content
+
+
+def _export_page(out_dir, url, host):
+    path = output_path(out_dir, url)
+    content = render_page(url, host)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    tmp.write_bytes(content)
+    os.replace(tmp, path)
+    return url
+
+
+def load_manifest(out_dir) -> dict:
+    try:
+        return json.loads((Path(out_dir) / MANIFEST_NAME).read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def export(out_dir, *, processes=None, force=False, host='localhost') -> dict:
+    """
+    変更のあったページだけを描画し直して書き出します。
+
+    公開されなくなったページのファイルは削除します。描画・削除した URL を返します。
+    """
+    out_dir = Path(out_dir)
+    previous = {} if force else load_manifest(out_dir)
+    pages = collect_pages()
+    stale = [url for url, fingerprint in pages.items() if previous.get(url) != fingerprint]
+    removed = [url for url in previous if url not in pages]
+
+    rendered = []
+    failed = []
+    if stale:
+        # fork 元の接続を子プロセスと共有しないよう、先に閉じておく
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(
+            max_workers=processes or os.cpu_count(), mp_context=context
+        ) as executor:
+            futures = {url: executor.submit(_export_page, out_dir, url, host) for url in stale}
+            for url, future in futures.items():
+                try:
+                    rendered.append(future.result())
+                except Exception:
+                    logger.exception('Failed to export %s', url)
+                    failed.append(url)
+
+    for url in removed:
+        output_path(out_dir, url).unlink(missing_ok=True)
+
+    manifest = {url: fingerprint for url, fingerprint in pages.items() if url not in failed}
+    # 失敗したページは前回の指紋のままにして、次回もう一度描画する
+    manifest.update({url: previous[url] for url in failed if url in previous})
+    out_dir.mkdir(parents=True, exist_ok=True)
+    (out_dir / MANIFEST_NAME).write_text(json.dumps(manifest, indent=1, sort_keys=True))
+    return {'rendered': rendered, 'removed': removed, 'failed': failed, 'total': len(pages)}
@@ -0,0 +1,172 @@
+"""
+RSS/Atom フィードと、フィード・サイトマップ共通の条件付き GET とキャッシュ。
+
+フィードとサイトマップの内容は公開済みの投稿とタグ・カテゴリだけで決まるので、
+コンテンツバージョンと最終更新日時から ETag を作り、変わっていなければ描画せずに
+304 を返します。描画結果は同じ ETag の間キャッシュします。
+"""
+import functools
+import hashlib
+
+from django.contrib.syndication.views import Feed
+from django.core.cache import cache
+from django.db.models import Max
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.feedgenerator import Atom1Feed
+from django.utils.http import http_date
+
+from core.cache import get_versions, replica_may_be_stale, version_token
+
+from .models import Category, Post, Tag
+
+FEED_LIMIT = 20
+CACHE_TIMEOUT = 60 * 60
+NAMESPACES = ('posts', 'taxonomy')
+
+
+def _content_state():
+    """
+    (バージョンのトークン, 最終更新日時) を返します。
+
+    公開予約の投稿も公開時に posts.publishing がバージョンを進めるので、トークンが同じ間は
+    計算し直しません。
+    """
+    token = version_token(get_versions(*NAMESPACES))
+    key = f'syndication-state:{token}'
+    state = cache.get(key)
+    if state is None:
+        latest = Post.objects.published().aggregate(
+            updated=Max('updated_at'), published=Max('published_at')
+        )
+        last_modified = max(filter(None, latest.values()), default=timezone.now())
+        state = (token, last_modified.timestamp())
+        cache.set(key, state, CACHE_TIMEOUT)
+    return state
+
+
+def syndication_cache(view):
+    """フィード・サイトマップのビューに ETag/Last-Modified と描画結果のキャッシュを付けます。"""
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if replica_may_be_stale(*NAMESPACES):
+            # レプリカが追いつくまでは、検証もキャッシュもせずにそのまま描画する
+            return view(request, *args, **kwargs)
+        token, last_modified = _content_state()
+        raw = f'{request.get_full_path()}|{token}|{last_modified}'
+        digest = hashlib.md5(raw.encode()).hexdigest()
+        etag = quote_etag(digest)
+        last_modified = int(last_modified)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            return response
+        key = f'syndication:{digest}'
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            if response.status_code != 200:
+                return response
+            cache.set(key, (response.content, response['Content-Type']), CACHE_TIMEOUT)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    # 読み込みだけなのでリードレプリカに振り分ける（core.routers）
+    wrapper.use_replica = True
+    return wrapper
+
+
+class LatestPostsFeed(Feed):
+    title = 'ブログ'
+    description = '新着の投稿'
+
+    def link(self):
+        return reverse('posts:post_list')
+
+    def get_queryset(self):
+        return (
+            Post.objects.published()
+            .select_related('author')
+            .only('title', 'slug', 'summary', 'published_at', 'updated_at', 'author__username')
+            .order_by('-published_at', '-id')
+        )
+
+    def items(self):
+        return self.get_queryset()[:FEED_LIMIT]
+
+    def item_title(self, item):
+        return item.title
+
+    def item_description(self, item):
+        return item.summary
+
+    def item_author_name(self, item):
+        return item.author.username if item.author else None
+
+    def item_pubdate(self, item):
+        return item.published_at
+
+    def item_updateddate(self, item):
+        return item.updated_at
+
+
+class LatestPostsAtomFeed(LatestPostsFeed):
+    feed_type = Atom1Feed
+    subtitle = LatestPostsFeed.description
+
+
+class CategoryFeed(LatestPostsFeed):
+    def get_object(self, request, slug):
+        return get_object_or_404(Category.objects.only('name', 'slug'), slug=slug)
+
+    def title(self, obj):
+        return f'ブログ - {obj.name}'
+
+    def description(self, obj):
+        return f'カテゴリ「{obj.name}」の新着の投稿'
+
+    def link(self, obj):
+        return obj.get_absolute_url()
+
+    def items(self, obj):
+        return self.get_queryset().filter(category=obj)[:FEED_LIMIT]
+
+
+class CategoryAtomFeed(CategoryFeed):
+    feed_type = Atom1Feed
+
+    def subtitle(self, obj):
+        return self.description(obj)
+
+
+class TagFeed(LatestPostsFeed):
+    def get_object(self, request, slug):
+        return get_object_or_404(Tag.objects.only('name', 'slug'), slug=slug)
+
+    def title(self, obj):
+        return f'ブログ - #{obj.name}'
+
+    def description(self, obj):
+        return f'タグ「{obj.name}」の新着の投稿'
+
+    def link(self, obj):
+        return obj.get_absolute_url()
+
+    def items(self, obj):
+        return self.get_queryset().filter(tags=obj)[:FEED_LIMIT]
+
+
+class TagAtomFeed(TagFeed):
+    feed_type = Atom1Feed
+
+    def subtitle(self, obj):
+        return self.description(obj)
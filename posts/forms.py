@@ -1,7 +1,6 @@
 from django import forms
-from django.utils.text import slugify
 
-from .models import Category, Post, Tag
+from .models import Category, Post
 
 
 class PostForm(forms.ModelForm):
@@ -28,12 +27,14 @@ class PostForm(forms.ModelForm):
             'body': forms.Textarea(attrs={'rows': 12}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['slug'].required = False
+
     def clean_slug(self):
-        slug = (self.cleaned_data.get('slug') or '').strip()
-        title = (self.cleaned_data.get('title') or '').strip()
-        if not slug and title:
-            slug = slugify(title)
-        return slug
+        # 空欄のままにしておくと、Post.save() が core.slugs でタイトルから重複しない
+        # スラッグを割り当てる（同時保存で衝突した場合の再試行もそこで行う）
+        return (self.cleaned_data.get('slug') or '').strip()
 
     def clean_new_category(self):
         new_category = (self.cleaned_data.get('new_category') or '').strip()
@@ -0,0 +1,115 @@
+"""
+投稿画像の派生画像（リサイズ・WebP 変換）の生成。
+
+元画像から `RENDITION_WIDTHS` の各幅の WebP と JPEG を作り、ストレージに保存して
+`Post.image_renditions` に幅・高さ・形式・ファイル名を記録します。テンプレートでは
+`post_images` タグがこれを `srcset` に展開します。
+"""
+import io
+import posixpath
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+RENDITION_WIDTHS = (320, 640, 960, 1280)
+FORMATS = {
+    'webp': {'format': 'WEBP', 'options': {'quality': 78, 'method': 6}},
+    'jpeg': {'format': 'JPEG', 'options': {'quality': 82, 'optimize': True, 'progressive': True}},
+}
+RENDITION_DIR = 'posts/renditions'
+
+
+def rendition_prefix(post) -> str:
+    return f'{RENDITION_DIR}/{post.pk}/'
+
+
+def _encode(image, fmt) -> bytes:
+    spec = FORMATS[fmt]
+    if spec['format'] == 'JPEG' and image.mode not in ('RGB', 'L'):
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.convert('RGBA').split()[-1])
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, spec['format'], **spec['options'])
+    return buffer.getvalue()
+
+
+def delete_renditions(renditions, storage=default_storage):
+    for rendition in renditions or ():
+        storage.delete(rendition['name'])
+
+
+def build_renditions(post, storage=default_storage):
+    """
+    元画像を読み込んで派生画像を保存し、(幅, 高さ, 派生画像のリスト) を返します。
+
+    元画像より大きい幅は作らず、元画像の幅そのものは必ず含めます。
+    """
+    post.image.open('rb')
+    try:
+        with Image.open(post.image) as source:
+            source = ImageOps.exif_transpose(source)
+            width, height = source.size
+            if source.mode not in ('RGB', 'RGBA', 'L'):
+                source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+            widths = sorted({w for w in RENDITION_WIDTHS if w < width} | {min(width, RENDITION_WIDTHS[-1])})
+            stem = posixpath.splitext(posixpath.basename(post.image.name))[0]
+            renditions = []
+            for target_width in widths:
+                target_height = max(1, round(height * target_width / width))
+                resized = source.resize((target_width, target_height), Image.Resampling.LANCZOS)
+                for fmt in FORMATS:
+                    name = storage.save(
+                        f'{rendition_prefix(post)}{stem}-{target_width}.{fmt}',
+                        ContentFile(_encode(resized, fmt)),
+                    )
+                    renditions.append({
+                        'format': fmt,
+                        'width': target_width,
+                        'height': target_height,
+                        'name': name,
+                    })
+    finally:
+        post.image.close()
+    return width, height, renditions
+
+
+def process_post_image(post_id, using='default') -> bool:
+    """
+    投稿の派生画像を作り直します。画像がない投稿では以前の派生画像を削除します。
+
+    保存は `update()` で行うので、投稿の保存シグナルは再度発火しません。
+    """
+    from core.cache import bump
+
+    from .models import Post
+
+    post = Post.objects.using(using).filter(pk=post_id).only(
+        'pk', 'slug', 'image', 'image_renditions'
+    ).first()
+    if post is None:
+        return False
+    previous = post.image_renditions
+    if post.image:
+        width, height, renditions = build_renditions(post)
+    else:
+        width = height = None
+        renditions = []
+    Post.objects.using(using).filter(pk=post.pk).update(
+        image_width=width,
+        image_height=height,
+        image_renditions=renditions,
+    )
+    new_names = {rendition['name'] for rendition in renditions}
+    delete_renditions([r for r in previous or () if r['name'] not in new_names])
+    bump('posts', f'post:{post.slug}', using=using)
+    return True
+
+
+def srcset(renditions, fmt) -> str:
+    return ', '.join(
+        f"{default_storage.url(r['name'])} {r['width']}w"
+        for r in renditions
+        if r['format'] == fmt
+    )
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from core.cache import bump
+from posts.models import Post
+from posts.text import backfill_text_stats
+
+
+class Command(BaseCommand):
+    help = '投稿の文字数・読了時間・要約を本文から計算し直します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        queryset = Post.objects.using(options['database']).order_by('pk')
+        count = backfill_text_stats(queryset, batch_size=options['batch_size'])
+        bump('posts', using=options['database'])
+        self.stdout.write(self.style.SUCCESS(f'{count} 件の投稿を更新しました。'))
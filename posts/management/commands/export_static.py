@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import export
+
+
+class Command(BaseCommand):
+    help = (
+        '公開ページを静的な HTML として書き出します。前回から内容が変わったページだけを描画し直します。'
+        ' クエリ文字列付きの URL とコメントの投稿は Django に転送してください。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('out_dir', help='書き出し先のディレクトリ')
+        parser.add_argument('--processes', type=int, default=None, help='描画に使うプロセス数（既定は CPU 数）')
+        parser.add_argument('--force', action='store_true', help='すべてのページを描画し直します。')
+        parser.add_argument('--host', default='localhost', help='描画時のホスト名（ALLOWED_HOSTS に含まれるもの）')
+
+    def handle(self, *args, **options):
+        result = export.export(
+            options['out_dir'],
+            processes=options['processes'],
+            force=options['force'],
+            host=options['host'],
+        )
+        self.stdout.write(
+            f"{result['total']} ページ中 {len(result['rendered'])} ページを書き出し、"
+            f"{len(result['removed'])} ページを削除しました。"
+        )
+        if result['failed']:
+            raise CommandError(f"{len(result['failed'])} ページの書き出しに失敗しました: {', '.join(result['failed'])}")
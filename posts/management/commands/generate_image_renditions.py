@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from posts.images import process_post_image
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = '投稿画像の派生画像（リサイズ・WebP）を生成します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument(
+            '--all', action='store_true',
+            help='派生画像がある投稿も含めてすべて作り直します。',
+        )
+
+    def handle(self, *args, **options):
+        using = options['database']
+        queryset = Post.objects.using(using).exclude(image='').exclude(image__isnull=True)
+        if not options['all']:
+            queryset = queryset.filter(image_renditions=[])
+        count = 0
+        for pk in queryset.order_by('pk').values_list('pk', flat=True).iterator():
+            process_post_image(pk, using=using)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'{count} 件の投稿画像を処理しました。'))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from posts import related
+
+
+class Command(BaseCommand):
+    help = 'すべての公開済み投稿の関連記事を計算し直します（ワーカーが毎日実行するのと同じ処理です）。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = related.rebuild(using=options['database'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{count} 件の投稿の関連記事を更新しました（{time.perf_counter() - started:.1f} 秒）。'
+        ))
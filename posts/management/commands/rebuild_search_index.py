@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = '投稿の全文検索インデックスを作り直します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if not search.is_available(using):
+            raise CommandError('全文検索は SQLite (FTS5) でのみ利用できます。')
+        with transaction.atomic(using=using):
+            count = search.rebuild(using=using)
+        self.stdout.write(self.style.SUCCESS(f'{count} 件の投稿をインデックスしました。'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from core.cache import bump
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'タグ・カテゴリ・年月ごとの公開済み投稿数と、投稿ごとのコメント数を数え直します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        using = options['database']
+        with transaction.atomic(using=using):
+            counters.rebuild_counts(using=using)
+            bump('posts', 'taxonomy', using=using)
+        self.stdout.write(self.style.SUCCESS('件数を更新しました。'))
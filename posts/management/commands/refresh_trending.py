@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from posts import trending
+
+
+class Command(BaseCommand):
+    help = 'トレンドトピックのスコアを計算し直します。cron などで定期的に実行してください。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        count = trending.refresh_trending(using=options['database'])
+        self.stdout.write(self.style.SUCCESS(f'{count} 件のタグのスコアを更新しました。'))
@@ -0,0 +1,268 @@
+import io
+import itertools
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+from PIL import Image, ImageDraw
+
+from comments.models import Comment
+from core.cache import bump
+from posts import counters, publishing, related, search, tasks, trending
+from posts.models import Category, Post, Tag
+from posts.text import make_summary, reading_stats
+
+WORDS = (
+    '東京', '京都', '旅行', '写真', 'カメラ', '料理', 'レシピ', 'コーヒー', '読書', '映画',
+    '音楽', 'ギター', 'ランニング', '登山', 'キャンプ', '自転車', '庭', '猫', '犬', '子育て',
+    'プログラミング', 'Python', 'Django', 'データベース', 'SQLite', '検索', 'キャッシュ', '設計',
+    'テスト', 'デプロイ', 'サーバー', 'ネットワーク', 'セキュリティ', '仕事', '会議', '勉強',
+    '英語', '日記', '週末', '季節', '春', '夏', '秋', '冬', '雨', '雪', '海', '山', '川', '街',
+    '朝ごはん', '散歩', '買い物', '掃除', '引っ越し', '健康', '睡眠', '習慣', '目標', '振り返り',
+)
+SENTENCE_ENDINGS = ('について考えた。', 'を試してみた。', 'の記録。', 'が楽しかった。', 'のメモ。', 'は難しい。')
+
+
+def _zipf_cum_weights(count, exponent):
+    """順位 r の重みを 1 / r^exponent とした累積重みを返します（random.choices 用）。"""
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+@contextmanager
+def _manual_timestamps(*models):
+    """bulk_create で作成日時・更新日時を指定できるよう、auto_now を一時的に止める。"""
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = 'ベンチマーク用に、投稿・タグ・コメント・画像の大量のダミーデータを作ります。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--posts', type=int, default=100_000)
+        parser.add_argument('--tags', type=int, default=5_000)
+        parser.add_argument('--categories', type=int, default=30)
+        parser.add_argument('--comments', type=int, default=2_000_000)
+        parser.add_argument('--authors', type=int, default=50)
+        parser.add_argument('--images', type=int, default=200, help='画像を付ける投稿の数')
+        parser.add_argument('--days', type=int, default=3 * 365, help='公開日時をばらつかせる日数')
+        parser.add_argument('--zipf', type=float, default=1.1, help='タグ・コメントの偏りの指数')
+        parser.add_argument('--batch-size', type=int, default=2_000)
+        parser.add_argument('--seed', type=int, default=0, help='乱数の種（同じ値なら同じデータになります）')
+        parser.add_argument('--prefix', default='bench', help='作成するデータのスラッグの接頭辞')
+
+    def handle(self, *args, **options):
+        self.using = options['database']
+        self.prefix = options['prefix']
+        self.batch_size = options['batch_size']
+        self.random = random.Random(options['seed'])
+        self.now = timezone.now()
+        if Post.objects.using(self.using).filter(slug__startswith=f'{self.prefix}-').exists():
+            raise CommandError(
+                f'接頭辞「{self.prefix}」のデータがすでにあります。別のデータベースか --prefix を指定してください。'
+            )
+
+        with _manual_timestamps(Post, Comment, Tag, Category):
+            authors = self.step('著者', self.create_authors, options['authors'])
+            categories = self.step('カテゴリ', self.create_categories, options['categories'])
+            tags = self.step('タグ', self.create_tags, options['tags'])
+            posts = self.step(
+                '投稿', self.create_posts, options['posts'], authors, categories, tags, options
+            )
+            self.step('コメント', self.create_comments, options['comments'], posts, options['zipf'])
+        self.step('画像', self.create_images, options['images'], posts)
+        self.step('件数・検索インデックス・トレンド・関連記事', self.finish)
+        self.stdout.write(self.style.SUCCESS('ベンチマーク用のデータを作成しました。'))
+
+    def step(self, label, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        count = len(result) if isinstance(result, (list, dict)) else result
+        suffix = f' {count} 件' if count is not None else ''
+        self.stdout.write(f'{label}:{suffix} ({time.perf_counter() - started:.1f} 秒)')
+        return result
+
+    def progress(self, done, total):
+        if self.stdout.isatty():
+            self.stdout.write(f'  {done}/{total}', ending='\r')
+
+    def bulk_create(self, model, objects):
+        with transaction.atomic(using=self.using):
+            return model.objects.using(self.using).bulk_create(objects, batch_size=self.batch_size)
+
+    def create_authors(self, count):
+        password = make_password(None)
+        User = get_user_model()
+        users = self.bulk_create(User, [
+            User(username=f'{self.prefix}-author-{number}', password=password) for number in range(count)
+        ])
+        return [user.pk for user in users]
+
+    def create_categories(self, count):
+        categories = self.bulk_create(Category, [
+            Category(
+                name=f'{WORDS[number % len(WORDS)]} {self.prefix}-{number}',
+                slug=f'{self.prefix}-category-{number}',
+                created_at=self.now,
+                updated_at=self.now,
+            )
+            for number in range(count)
+        ])
+        return [category.pk for category in categories]
+
+    def create_tags(self, count):
+        tags = self.bulk_create(Tag, [
+            Tag(
+                name=f'{WORDS[number % len(WORDS)]}{number}',
+                slug=f'{self.prefix}-tag-{number}',
+                created_at=self.now,
+                updated_at=self.now,
+            )
+            for number in range(count)
+        ])
+        return [tag.pk for tag in tags]
+
+    def make_body(self):
+        paragraphs = []
+        for _ in range(self.random.randint(2, 12)):
+            sentences = [
+                '、'.join(self.random.choices(WORDS, k=self.random.randint(1, 4)))
+                + self.random.choice(SENTENCE_ENDINGS)
+                for _ in range(self.random.randint(3, 10))
+            ]
+            paragraphs.append(''.join(sentences))
+        return '\n\n'.join(paragraphs)
+
+    def create_posts(self, count, authors, categories, tags, options):
+        """公開日時の古い順に作ります。作成した公開済み投稿の {ID: 公開日時} を返します。"""
+        rng = self.random
+        tag_weights = _zipf_cum_weights(len(tags), options['zipf'])
+        category_weights = _zipf_cum_weights(len(categories), options['zipf'])
+        span = timedelta(days=options['days'])
+        published = {}
+        through = Post.tags.through
+        for start in range(0, count, self.batch_size):
+            posts = []
+            for number in range(start, min(start + self.batch_size, count)):
+                body = self.make_body()
+                excerpt = ''
+                status = Post.Status.PUBLISHED
+                published_at = self.now - span * (1 - number / count)
+                roll = rng.random()
+                if roll < 0.05:
+                    status, published_at = Post.Status.DRAFT, None
+                elif roll < 0.07:
+                    # 公開予約
+                    published_at = self.now + timedelta(minutes=rng.randint(1, 60 * 24 * 30))
+                created_at = (published_at or self.now) - timedelta(hours=rng.randint(1, 72))
+                char_count, reading_minutes = reading_stats(body)
+                title_words = rng.choices(WORDS, k=rng.randint(2, 4))
+                posts.append(Post(
+                    title=f"{'と'.join(title_words)}{rng.choice(SENTENCE_ENDINGS).rstrip('。')}",
+                    slug=f'{self.prefix}-{number}',
+                    author_id=rng.choice(authors) if authors else None,
+                    category_id=rng.choices(categories, cum_weights=category_weights)[0] if categories else None,
+                    excerpt=excerpt,
+                    body=body,
+                    status=status,
+                    published_at=published_at,
+                    is_live=published_at is not None and published_at <= self.now,
+                    summary=make_summary(excerpt, body),
+                    char_count=char_count,
+                    reading_minutes=reading_minutes,
+                    created_at=created_at,
+                    updated_at=created_at if published_at is None else max(created_at, min(published_at, self.now)),
+                ))
+            with transaction.atomic(using=self.using):
+                Post.objects.using(self.using).bulk_create(posts)
+                links = []
+                for post in posts:
+                    picked = set(rng.choices(tags, cum_weights=tag_weights, k=rng.randint(0, 5))) if tags else ()
+                    links.extend(through(post_id=post.pk, tag_id=tag_id) for tag_id in picked)
+                through.objects.using(self.using).bulk_create(links, batch_size=self.batch_size)
+            published.update(
+                (post.pk, post.published_at) for post in posts
+                if post.published_at is not None and post.published_at <= self.now
+            )
+            self.progress(min(start + self.batch_size, count), count)
+        return published
+
+    def create_comments(self, count, posts, exponent):
+        """人気の偏りを再現するため、投稿ごとのコメント数を Zipf 分布にします。"""
+        if not posts or not count:
+            return 0
+        rng = self.random
+        post_ids = list(posts)
+        rng.shuffle(post_ids)
+        weights = _zipf_cum_weights(len(post_ids), exponent)
+        created = 0
+        while created < count:
+            size = min(self.batch_size * 5, count - created)
+            comments = []
+            for post_id in rng.choices(post_ids, cum_weights=weights, k=size):
+                age = (self.now - posts[post_id]).total_seconds()
+                created_at = posts[post_id] + timedelta(seconds=age * rng.random() ** 3)
+                comments.append(Comment(
+                    post_id=post_id,
+                    name=f'読者{rng.randint(1, 5000)}',
+                    email=f'reader{rng.randint(1, 5000)}@example.com',
+                    body=''.join(rng.choices(WORDS, k=rng.randint(3, 20))),
+                    is_public=rng.random() > 0.02,
+                    created_at=created_at,
+                    updated_at=created_at,
+                ))
+            self.bulk_create(Comment, comments)
+            created += size
+            self.progress(created, count)
+        return created
+
+    def create_images(self, count, posts):
+        """画像を作って投稿に付け、派生画像の生成をタスクキューに積みます。"""
+        post_ids = self.random.sample(list(posts), min(count, len(posts)))
+        for number, post_id in enumerate(post_ids):
+            image = Image.new('RGB', (1600, 1000), tuple(self.random.randrange(256) for _ in range(3)))
+            draw = ImageDraw.Draw(image)
+            for _ in range(12):
+                x, y = self.random.randrange(1600), self.random.randrange(1000)
+                draw.rectangle(
+                    (x, y, x + self.random.randint(50, 600), y + self.random.randint(50, 400)),
+                    fill=tuple(self.random.randrange(256) for _ in range(3)),
+                )
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=85)
+            name = default_storage.save(f'posts/{self.prefix}-{number}.jpg', ContentFile(buffer.getvalue()))
+            Post.objects.using(self.using).filter(pk=post_id).update(image=name)
+            tasks.process_post_image.enqueue(post_id, self.using, using=self.using)
+        return post_ids
+
+    def finish(self):
+        # bulk_create ではシグナルが発火しないので、件数と索引はまとめて作り直す
+        with transaction.atomic(using=self.using):
+            counters.rebuild_counts(using=self.using)
+        if search.is_available(self.using):
+            search.rebuild(using=self.using)
+        trending.refresh_trending(using=self.using)
+        related.rebuild(using=self.using)
+        next_publish = Post.objects.using(self.using).next_publish_at()
+        if next_publish is not None:
+            publishing.schedule(next_publish, using=self.using)
+        bump('posts', 'taxonomy', using=self.using)
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+CREATE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_post_fts "
+    "USING fts5(title, excerpt, body, taxonomy, tokenize='trigram')"
+)
+
+POPULATE_SQL = """
+INSERT INTO posts_post_fts (rowid, title, excerpt, body, taxonomy)
+SELECT
+    p.id,
+    p.title,
+    p.excerpt,
+    p.body,
+    trim(
+        coalesce(c.name, '') || ' ' ||
+        coalesce((
+            SELECT group_concat(t.name, ' ')
+            FROM posts_post_tags pt JOIN posts_tag t ON t.id = pt.tag_id
+            WHERE pt.post_id = p.id
+        ), '')
+    )
+FROM posts_post p LEFT JOIN posts_category c ON c.id = p.category_id
+"""
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_SQL)
+    schema_editor.execute(POPULATE_SQL)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS posts_post_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0002_post_image_alter_post_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:10
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.utils import timezone
+
+
+def populate_counts(apps, schema_editor):
+    Category = apps.get_model('posts', 'Category')
+    Tag = apps.get_model('posts', 'Tag')
+    published = Q(
+        posts__status='published',
+        posts__published_at__isnull=False,
+        posts__published_at__lte=timezone.now(),
+    )
+    for model in (Category, Tag):
+        rows = model.objects.annotate(count=Count('posts', filter=published)).values_list('pk', 'count')
+        for pk, count in rows:
+            model.objects.filter(pk=pk).update(post_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0003_post_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['-trending_score', '-post_count'], name='posts_tag_trendin_cab2f4_idx'),
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:11
+
+from django.db import migrations, models
+
+from posts.text import backfill_text_stats
+
+
+def backfill(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    backfill_text_stats(Post.objects.all())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0004_taxonomy_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='char_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='reading_minutes',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='summary',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
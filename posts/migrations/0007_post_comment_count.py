@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:19
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_comment_counts(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    rows = (
+        Post.objects.annotate(count=Count('comments', filter=Q(comments__is_public=True)))
+        .filter(count__gt=0)
+        .values_list('pk', 'count')
+    )
+    for pk, count in rows:
+        Post.objects.filter(pk=pk).update(comment_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_post_image_renditions'),
+        ('comments', '0002_comment_spool_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_comment_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_related_posts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PopularPost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('days', models.PositiveSmallIntegerField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('views', models.PositiveIntegerField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='popular_ranks', to='posts.post')),
+            ],
+            options={
+                'ordering': ['days', 'rank'],
+                'constraints': [models.UniqueConstraint(fields=('days', 'rank'), name='posts_popularpost_unique_rank')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PostDailyViews',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_views', to='posts.post')),
+            ],
+            options={
+                'ordering': ['-day', 'post'],
+                'indexes': [models.Index(fields=['day'], name='posts_postd_day_93aa7c_idx')],
+                'constraints': [models.UniqueConstraint(fields=('post', 'day'), name='posts_postdailyviews_unique_day')],
+            },
+        ),
+    ]
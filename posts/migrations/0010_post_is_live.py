@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:48
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def populate_is_live(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Post.objects.filter(
+        status='published', published_at__isnull=False, published_at__lte=timezone.now()
+    ).update(is_live=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_post_views'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='post',
+            name='posts_post_status_b32c6a_idx',
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='is_live',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(populate_is_live, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['is_live', '-published_at'], name='posts_post_is_live_afb124_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:50
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+
+
+def populate_archive_months(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    PostArchiveMonth = apps.get_model('posts', 'PostArchiveMonth')
+    months = (
+        Post.objects.filter(is_live=True)
+        .annotate(month=TruncMonth('published_at'))
+        .order_by()
+        .values('month')
+        .annotate(count=Count('pk'))
+        .values_list('month', 'count')
+    )
+    PostArchiveMonth.objects.bulk_create([
+        PostArchiveMonth(year=month.year, month=month.month, post_count=count) for month, count in months
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_post_is_live'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostArchiveMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('post_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-year', '-month'],
+                'constraints': [models.UniqueConstraint(fields=('year', 'month'), name='posts_postarchivemonth_unique_month')],
+            },
+        ),
+        migrations.RunPython(populate_archive_months, migrations.RunPython.noop),
+    ]
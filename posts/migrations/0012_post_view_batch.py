@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_post_archive_month'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostViewBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('views', models.JSONField(default=list)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -1,16 +1,26 @@
+from functools import partial
+
 from django.conf import settings
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, router
 from django.urls import reverse
 from django.utils import timezone
-from django.utils.text import slugify
 
 from core.models import TimeStampedModel
+from core.slugs import save_with_unique_slug, slug_base
+
+from .text import make_summary, reading_stats
+
+# 投稿の URL（`/<slug>/`）と同じ階層にある固定のパス。投稿のスラッグにすると詳細ページに届かない
+RESERVED_SLUGS = frozenset({'accounts', 'admin', 'archive', 'category', 'feed', 'manage', 'search', 'tag'})
 
 
 class Category(TimeStampedModel):
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(max_length=120, unique=True)
     description = models.TextField(blank=True)
+    # 公開済み投稿数（posts.counters が書き込み時に更新する）
+    post_count = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         ordering = ['name']
@@ -25,9 +35,16 @@ class Category(TimeStampedModel):
 class Tag(TimeStampedModel):
     name = models.CharField(max_length=50, unique=True)
     slug = models.SlugField(max_length=60, unique=True)
+    # 公開済み投稿数（posts.counters が書き込み時に更新する）
+    post_count = models.PositiveIntegerField(default=0, editable=False)
+    # 最近の投稿・コメントを時間減衰で重み付けした人気度（posts.trending が定期的に更新する）
+    trending_score = models.FloatField(default=0, editable=False)
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['-trending_score', '-post_count']),
+        ]
 
     def __str__(self) -> str:
         return self.name
@@ -38,11 +55,35 @@ class Tag(TimeStampedModel):
 
 class PostQuerySet(models.QuerySet):
     def published(self):
-        now = timezone.now()
+        # 公開日時との比較は posts.publishing が `is_live` に反映しておくので、クエリは現在時刻に依存しない
+        return self.filter(is_live=True)
+
+    def related_to(self, slug):
+        """投稿の関連記事（posts.related が事前に計算したもの）を関連度の高い順に返します。"""
+        return self.published().filter(related_from__post__slug=slug).order_by('related_from__rank')
+
+    def popular(self, days=7):
+        """直近 `days` 日の閲覧数のランキング（posts.popularity が事前に計算したもの）の順に返します。"""
+        return (
+            self.published()
+            .filter(popular_ranks__days=days)
+            .annotate(views=models.F('popular_ranks__views'))
+            .order_by('popular_ranks__rank')
+        )
+
+    def next_publish_at(self):
+        """公開予約されている（まだ公開状態になっていない）投稿のうち、最も早い公開日時を返します。"""
+        return (
+            self.filter(status=Post.Status.PUBLISHED, is_live=False, published_at__isnull=False)
+            .order_by('published_at')
+            .values_list('published_at', flat=True)
+            .first()
+        )
+
+    def due(self, now=None):
+        """公開日時を過ぎたのに、まだ公開状態になっていない投稿を返します。"""
         return self.filter(
-            status=Post.Status.PUBLISHED,
-            published_at__isnull=False,
-            published_at__lte=now,
+            status=Post.Status.PUBLISHED, is_live=False, published_at__lte=now or timezone.now()
         )
 
 
@@ -70,6 +111,11 @@ class Post(TimeStampedModel):
     tags = models.ManyToManyField(Tag, blank=True, related_name='posts')
     excerpt = models.TextField(blank=True)
     body = models.TextField()
+    image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    # 派生画像（posts.images が生成する）。元画像の寸法と各サイズ・形式のファイルを持つ
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_renditions = models.JSONField(default=list, blank=True, editable=False)
     status = models.CharField(
         max_length=10,
         choices=Status.choices,
@@ -77,30 +123,153 @@ class Post(TimeStampedModel):
         db_index=True,
     )
     published_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # 公開中か（公開状態で、公開日時を過ぎている）。保存時と、公開予約の時刻に posts.publishing が更新する
+    is_live = models.BooleanField(default=False, editable=False)
+    # 一覧で本文を読み込まずに済むよう、保存時に計算しておく値
+    summary = models.TextField(blank=True, editable=False)
+    char_count = models.PositiveIntegerField(default=0, editable=False)
+    reading_minutes = models.PositiveIntegerField(default=0, editable=False)
+    # 公開中のコメント数。comments のシグナルと取り込み処理が更新する
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
 
     objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ['-published_at', '-created_at']
         indexes = [
-            models.Index(fields=['status', '-published_at']),
+            models.Index(fields=['is_live', '-published_at']),
         ]
 
     def __str__(self) -> str:
         return self.title
 
+    def clean(self):
+        if self.slug in RESERVED_SLUGS:
+            raise ValidationError({'slug': 'このスラッグはサイトの URL に使われているため使用できません。'})
+
     def save(self, *args, **kwargs):
-        if not self.slug and self.title:
-            base = slugify(self.title)
-            candidate = base
-            counter = 2
-            while candidate and Post.objects.filter(slug=candidate).exclude(pk=self.pk).exists():
-                candidate = f'{base}-{counter}'
-                counter += 1
-            self.slug = candidate or self.slug
         if self.status == self.Status.PUBLISHED and self.published_at is None:
             self.published_at = timezone.now()
+        self.is_live = self.compute_is_live()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'status', 'published_at'} & set(update_fields):
+            update_fields = kwargs['update_fields'] = {*update_fields, 'is_live'}
+        if update_fields is None or {'body', 'excerpt'} & set(update_fields):
+            self.update_text_stats()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'summary', 'char_count', 'reading_minutes'}
+        if not self.slug and self.title:
+            base = slug_base(self.title, self._meta.get_field('slug').max_length, fallback='post')
+            save_with_unique_slug(
+                self,
+                base,
+                partial(super().save, *args, **kwargs),
+                reserved=RESERVED_SLUGS,
+                using=kwargs.get('using') or router.db_for_write(Post, instance=self),
+            )
+            return
         super().save(*args, **kwargs)
 
+    def compute_is_live(self, now=None) -> bool:
+        return (
+            self.status == self.Status.PUBLISHED
+            and self.published_at is not None
+            and self.published_at <= (now or timezone.now())
+        )
+
+    def update_text_stats(self):
+        self.char_count, self.reading_minutes = reading_stats(self.body)
+        self.summary = make_summary(self.excerpt, self.body)
+
     def get_absolute_url(self) -> str:
         return reverse('posts:post_detail', kwargs={'slug': self.slug})
+
+
+class RelatedPost(models.Model):
+    """投稿ごとの関連記事の上位 k 件。posts.related がバッチで計算して書き込む。"""
+
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='related_links')
+    related = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='related_from')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['post', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'rank'], name='posts_relatedpost_unique_rank'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.post_id} -> {self.related_id} ({self.rank})'
+
+
+class PostViewBatch(models.Model):
+    """Web のプロセスが書き出した、まだ PostDailyViews に加えていない閲覧数（posts.popularity）。"""
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    # [[スラッグ, 日付（ISO 形式）, 閲覧数], ...]
+    views = models.JSONField(default=list)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self) -> str:
+        return f'{self.pk} ({len(self.views)})'
+
+
+class PostDailyViews(models.Model):
+    """投稿・日ごとの閲覧数。posts.popularity がまとめて加算する。"""
+
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='daily_views')
+    day = models.DateField()
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-day', 'post']
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'day'], name='posts_postdailyviews_unique_day'),
+        ]
+        indexes = [
+            models.Index(fields=['day']),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.post_id} {self.day}: {self.views}'
+
+
+class PopularPost(models.Model):
+    """直近 `days` 日の閲覧数のランキング。posts.popularity が定期的に書き込む。"""
+
+    days = models.PositiveSmallIntegerField()
+    rank = models.PositiveSmallIntegerField()
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='popular_ranks')
+    views = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['days', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['days', 'rank'], name='posts_popularpost_unique_rank'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.days}日 {self.rank}: {self.post_id}'
+
+
+class PostArchiveMonth(TimeStampedModel):
+    """年月ごとの公開済み投稿数（日付アーカイブ用。posts.counters が書き込み時に更新する）。"""
+
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    post_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-year', '-month']
+        constraints = [
+            models.UniqueConstraint(fields=['year', 'month'], name='posts_postarchivemonth_unique_month'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.year}年{self.month}月'
+
+    def get_absolute_url(self) -> str:
+        return reverse('posts:archive_month', kwargs={'year': self.year, 'month': self.month})
@@ -0,0 +1,165 @@
+"""
+投稿の閲覧数と人気ランキング。
+
+詳細ページの表示ごとに DB へ書き込むと、読者同士が SQLite の書き込みロックを取り合うので、
+閲覧数はプロセス内で数えておき、`FLUSH_INTERVAL` 秒ごとに 1 行の `PostViewBatch` として
+書き出します（ワーカーは別のプロセスなので、キャッシュではなく DB を介して渡します）。
+定期実行の `drain()` がバッチを取り出し、投稿・日ごとの `PostDailyViews` に
+1 回の upsert で加えます。
+
+直近 1/7/30 日のランキングは `refresh_rankings()` が `PopularPost` に書き込み、
+表示するときは `Post.objects.popular()` で上位の行を読むだけにします。
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+from django.db import DEFAULT_DB_ALIAS, router
+from django.db.models import Sum
+from django.utils import timezone
+
+from core.cache import bump
+from core.db import write_with_retry
+
+from .models import PopularPost, Post, PostDailyViews, PostViewBatch
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 10
+# drain() が 1 回に取り出すバッチの数
+DRAIN_BATCH_LIMIT = 1000
+RANKING_PERIODS = (1, 7, 30)
+RANKING_SIZE = 10
+
+_views = Counter()
+_views_lock = threading.Lock()
+_views_flushed_at = time.monotonic()
+
+
+def count_view(slug, day=None) -> bool:
+    """
+    投稿の閲覧を 1 回数えます（DB もキャッシュも読みません）。
+
+    キャッシュに書き出す時間になったら True を返すので、呼び出し元で `flush()` を呼んでください。
+    """
+    day = day or timezone.localdate()
+    with _views_lock:
+        _views[slug, day.isoformat()] += 1
+        return time.monotonic() - _views_flushed_at >= FLUSH_INTERVAL
+
+
+def record_view(slug, day=None):
+    if count_view(slug, day):
+        flush()
+
+
+def flush():
+    """このプロセスで数えた閲覧数を、1 つのバッチとして DB に書き出します。"""
+    global _views_flushed_at
+    with _views_lock:
+        pending = dict(_views)
+        _views.clear()
+        _views_flushed_at = time.monotonic()
+    if not pending:
+        return
+    views = [[slug, day, count] for (slug, day), count in pending.items()]
+    using = router.db_for_write(PostViewBatch)
+    try:
+        write_with_retry(PostViewBatch.objects.using(using).create, views=views, using=using)
+    except Exception:
+        # 書き出せなかった分は、次の書き出しで一緒に送る
+        logger.exception('Failed to flush %s post view counters', len(views))
+        with _views_lock:
+            _views.update(pending)
+
+
+def _upsert(totals, using):
+    """{(投稿 ID, 日付): 閲覧数} を、既存の行に加えて保存します。"""
+    existing = Counter()
+    post_ids = {post_id for post_id, _ in totals}
+    days = {day for _, day in totals}
+    rows = (
+        PostDailyViews.objects.using(using)
+        .filter(post_id__in=post_ids, day__in=days)
+        .values_list('post_id', 'day', 'views')
+    )
+    for post_id, day, views in rows:
+        existing[post_id, day] = views
+    PostDailyViews.objects.using(using).bulk_create(
+        [
+            PostDailyViews(post_id=post_id, day=day, views=existing[post_id, day] + views)
+            for (post_id, day), views in totals.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['post', 'day'],
+        update_fields=['views'],
+        batch_size=500,
+    )
+
+
+def drain(using=DEFAULT_DB_ALIAS) -> int:
+    """書き出された閲覧数のバッチを DB に加えます。加えた閲覧数の合計を返します。"""
+    flush()
+
+    def apply():
+        batches = list(
+            PostViewBatch.objects.using(using).order_by('pk').values_list('pk', 'views')[:DRAIN_BATCH_LIMIT]
+        )
+        views_by_slug = Counter()
+        for _, views in batches:
+            for slug, day, count in views:
+                views_by_slug[slug, day] += count
+        totals = Counter()
+        if views_by_slug:
+            slugs = {slug for slug, _ in views_by_slug}
+            post_ids = dict(Post.objects.using(using).filter(slug__in=slugs).values_list('slug', 'pk'))
+            for (slug, day), count in views_by_slug.items():
+                if slug in post_ids:
+                    totals[post_ids[slug], date.fromisoformat(day)] += count
+        if totals:
+            _upsert(totals, using)
+        PostViewBatch.objects.using(using).filter(pk__in=[pk for pk, _ in batches]).delete()
+        return sum(totals.values())
+
+    return write_with_retry(apply, using=using)
+
+
+def refresh_rankings(today=None, using=DEFAULT_DB_ALIAS) -> dict:
+    """直近 1/7/30 日の閲覧数のランキングを計算し直します。{日数: 件数} を返します。"""
+    today = today or timezone.localdate()
+    rankings = {}
+    for days in RANKING_PERIODS:
+        rows = (
+            PostDailyViews.objects.using(using)
+            .filter(day__gt=today - timedelta(days=days), day__lte=today, post__in=Post.objects.published())
+            .values('post')
+            .annotate(total=Sum('views'))
+            .order_by('-total', '-post')
+            .values_list('post', 'total')[:RANKING_SIZE]
+        )
+        rankings[days] = list(rows)
+
+    def save():
+        current = {
+            days: list(
+                PopularPost.objects.using(using).filter(days=days)
+                .order_by('rank').values_list('post_id', 'views')
+            )
+            for days in RANKING_PERIODS
+        }
+        if current == rankings:
+            return False
+        PopularPost.objects.using(using).all().delete()
+        PopularPost.objects.using(using).bulk_create([
+            PopularPost(days=days, rank=rank, post_id=post_id, views=views)
+            for days, rows in rankings.items()
+            for rank, (post_id, views) in enumerate(rows)
+        ])
+        bump('popular', using=using)
+        return True
+
+    write_with_retry(save, using=using)
+    return {days: len(rows) for days, rows in rankings.items()}
+
@@ -0,0 +1,46 @@
+"""
+公開予約の投稿を、公開日時ちょうどに公開状態（`Post.is_live`）にします。
+
+公開予約の投稿を保存すると、その公開日時に実行する `posts.publish_due_posts` タスクを
+積みます（同じ時刻の予約は 1 つのタスクにまとまります）。タスクは公開日時を過ぎた投稿を
+1 件ずつ保存し直すので、通常の保存と同じシグナルでコンテンツバージョン・件数・検索
+インデックス・関連記事が更新され、キャッシュやフィードにもその時点で反映されます。
+
+タスクを取りこぼした場合に備えて、同じ処理を定期実行（`TASK_QUEUE_PERIODIC`）でも行います。
+"""
+import logging
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from core.tasks import enqueue
+
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+
+def schedule(published_at, using=DEFAULT_DB_ALIAS):
+    """`published_at` に公開予約の投稿を公開状態にするタスクを積みます。"""
+    enqueue(
+        'posts.publish_due_posts', using,
+        run_at=published_at,
+        idempotency_key=f'publish-due:{using}:{published_at.timestamp()}',
+        using=using,
+    )
+
+
+def publish_due_posts(now=None, using=DEFAULT_DB_ALIAS) -> int:
+    """公開日時を過ぎた予約投稿を公開状態にします。公開した投稿の数を返します。"""
+    now = now or timezone.now()
+    published = 0
+    for post in Post.objects.using(using).due(now).order_by('published_at', 'pk'):
+        with transaction.atomic(using=using):
+            post.save(using=using, update_fields=['is_live', 'updated_at'])
+        logger.info('Published scheduled post %s (%s)', post.pk, post.published_at.isoformat())
+        published += 1
+    # 次の予約のタスクがなければ積み直す（冪等キーで重複はしない）
+    next_publish = Post.objects.using(using).next_publish_at()
+    if next_publish is not None:
+        schedule(next_publish, using=using)
+    return published
@@ -0,0 +1,433 @@
+"""
+タグ・カテゴリ・本文から求める関連記事。
+
+公開済みの投稿ごとに、タグ（IDF で重み付け）・カテゴリ・タイトルと本文の先頭の
+文字 bigram の TF-IDF をそれぞれ正規化した疎ベクトルを作り、重みを付けて横に並べます。
+内積がそのまま関連度（タグのコサイン類似度・同じカテゴリか・本文のコサイン類似度の
+加重和）になるので、類似度の計算は行列積だけで済みます。
+
+上位 `RELATED_COUNT` 件を `RelatedPost` に保存し、詳細ページでは k 行を読むだけにします。
+投稿が変わったときは `schedule_refresh()` でタスクを積み、変わった投稿と、関連記事が
+入れ替わりうる投稿の分だけを計算し直します。特徴ベクトルは共有のキャッシュに保存しておき、
+そのときも変わった投稿の行だけを作り直します。IDF のずれや、同時に動いた再計算どうしで
+失われた更新は、定期実行の `rebuild()` で直します。
+"""
+import threading
+from datetime import timedelta
+
+import numpy as np
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count
+from django.db.models.functions import Substr
+from django.utils import timezone
+from scipy import sparse
+
+from core.cache import bump
+from core.models import Task
+from core.tasks import enqueue
+
+from .models import Post, RelatedPost
+
+RELATED_COUNT = 5
+TAG_WEIGHT = 0.6
+CATEGORY_WEIGHT = 0.1
+TEXT_WEIGHT = 0.3
+# 本文は先頭のこの文字数だけを使う
+TEXT_CHARS = 2000
+TEXT_DIMENSIONS = 2 ** 18
+# 投稿ごとに残す、TF-IDF の大きい bigram の数（行列積の計算量を抑える）
+TEXT_TERMS = 64
+# この割合を超える投稿に現れる bigram は区別に役立たないので使わない
+MAX_DOCUMENT_FREQUENCY = 0.3
+# 類似度を一度に計算する行数
+CHUNK_SIZE = 256
+# 変更があってから計算し直すまでの待ち時間（秒）。この間の変更は 1 つのタスクにまとめる
+REFRESH_DELAY = 60
+REFRESH_TASK = 'posts.refresh_related_posts'
+VECTORS_KEY_PREFIX = 'related-vectors'
+# 保存した特徴ベクトルは定期実行の rebuild() で作り直すので、それより十分長くしておく
+VECTORS_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def _l2_normalize(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ matrix
+
+
+def _idf(document_frequency, total):
+    return np.log((1 + total) / (1 + document_frequency)) + 1
+
+
+def _bigram_counts(texts):
+    """文字 bigram をハッシュした列の出現回数を、1 行 1 投稿の疎行列で返します。"""
+    codes = [np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32) for text in texts]
+    lengths = np.array([len(code) for code in codes])
+    if not lengths.sum():
+        return sparse.csr_matrix((len(texts), TEXT_DIMENSIONS), dtype=np.float32)
+    flat = np.concatenate(codes).astype(np.int64)
+    rows = np.repeat(np.arange(len(texts)), lengths)
+    # 投稿の境目をまたぐ組は除く
+    same = rows[1:] == rows[:-1]
+    columns = (flat[:-1] * 1_000_003 + flat[1:]) % TEXT_DIMENSIONS
+    counts = sparse.csr_matrix(
+        (np.ones(int(same.sum()), dtype=np.float32), (rows[:-1][same], columns[same])),
+        shape=(len(texts), TEXT_DIMENSIONS),
+    )
+    counts.sum_duplicates()
+    return counts
+
+
+def _keep_top_terms(matrix, limit):
+    matrix = matrix.tocsr()
+    for row in range(matrix.shape[0]):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        if end - start > limit:
+            values = matrix.data[start:end]
+            values[np.argsort(values)[:-limit]] = 0
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def _text(title, excerpt, body):
+    return ''.join(f'{title} {title} {excerpt} {body}'.lower().split())
+
+
+def _published_rows(using, post_ids=None):
+    posts = Post.objects.using(using).published().order_by('pk')
+    if post_ids is not None:
+        posts = posts.filter(pk__in=sorted(post_ids))
+    return list(
+        posts.annotate(body_head=Substr('body', 1, TEXT_CHARS))
+        .values_list('pk', 'category_id', 'title', 'excerpt', 'body_head')
+    )
+
+
+def _tag_links(rows, using, post_ids=None) -> list:
+    """(行, タグ ID) の組を返します。"""
+    links = Post.tags.through.objects.using(using)
+    if post_ids is not None:
+        links = links.filter(post_id__in=sorted(post_ids))
+    return [(rows[post_id], tag_id) for post_id, tag_id in links.values_list('post_id', 'tag_id') if post_id in rows]
+
+
+def _width(columns) -> int:
+    return int(columns.max()) + 1 if len(columns) else 0
+
+
+def _tag_block(row_count, links, idf):
+    """タグの列（列番号はタグ ID）。`idf` はタグ ID で引ける配列です。"""
+    rows = np.array([row for row, _ in links], dtype=np.int64)
+    columns = np.array([tag_id for _, tag_id in links], dtype=np.int64)
+    tags = sparse.csr_matrix(
+        (idf[columns].astype(np.float32), (rows, columns)), shape=(row_count, _width(columns))
+    )
+    return _l2_normalize(tags)
+
+
+def _category_block(posts):
+    """カテゴリの列（列番号はカテゴリ ID）。同じカテゴリなら 1 です。"""
+    category_ids = np.array([post[1] or 0 for post in posts], dtype=np.int64)
+    categorized = np.flatnonzero(category_ids)
+    return sparse.csr_matrix(
+        (np.ones(len(categorized), dtype=np.float32), (categorized, category_ids[categorized])),
+        shape=(len(posts), _width(category_ids)),
+    )
+
+
+def _text_counts(posts):
+    return sparse.vstack([
+        _bigram_counts([_text(*post[2:]) for post in posts[start:start + CHUNK_SIZE * 8]])
+        for start in range(0, len(posts), CHUNK_SIZE * 8)
+    ] or [sparse.csr_matrix((0, TEXT_DIMENSIONS), dtype=np.float32)]).tocsr()
+
+
+def _text_block(counts, idf):
+    # 出現回数は対数で抑え、各投稿の上位の bigram だけを残す
+    counts.data = 1 + np.log(counts.data)
+    return _l2_normalize(_keep_top_terms(counts @ sparse.diags(idf), TEXT_TERMS))
+
+
+def _stack(blocks):
+    """列数をそろえて縦に並べます。"""
+    width = max(block.shape[1] for block in blocks)
+    widened = []
+    for block in blocks:
+        block = block.tocsr()
+        block.resize((block.shape[0], width))
+        widened.append(block)
+    return sparse.vstack(widened).tocsr()
+
+
+def _vectors_key(using) -> str:
+    return f'{VECTORS_KEY_PREFIX}:{using}'
+
+
+class PostVectors:
+    """
+    公開済み投稿の特徴ベクトル。`ids[i]` の投稿が `matrix` の i 行目です。
+
+    タグ・カテゴリ・本文の列を別々に持ち、`update()` では変わった投稿の行だけを作り直します。
+    本文の IDF は `build()` のときの値を使い続けます。
+    """
+
+    def __init__(self, ids, tags, categories, text, text_idf):
+        self.ids = ids
+        self.tags = tags
+        self.categories = categories
+        self.text = text
+        self.text_idf = text_idf
+        self.matrix = sparse.hstack([
+            np.sqrt(TAG_WEIGHT) * tags,
+            np.sqrt(CATEGORY_WEIGHT) * categories,
+            np.sqrt(TEXT_WEIGHT) * text,
+        ]).tocsr().astype(np.float32)
+        # 行列積の右側は行方向に圧縮した形で持っておく
+        self.transposed = self.matrix.T.tocsr()
+        self.rows = {post_id: row for row, post_id in enumerate(ids.tolist())}
+
+    def __getstate__(self):
+        return (self.ids, self.tags, self.categories, self.text, self.text_idf)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    @classmethod
+    def build(cls, using=DEFAULT_DB_ALIAS):
+        posts = _published_rows(using)
+        ids = np.array([post[0] for post in posts], dtype=np.int64)
+        total = len(ids)
+        rows = {post_id: row for row, post_id in enumerate(ids.tolist())}
+
+        # タグ: 珍しいタグほど重くする
+        links = _tag_links(rows, using)
+        tag_columns = np.array([tag_id for _, tag_id in links], dtype=np.int64)
+        tags = _tag_block(total, links, _idf(np.bincount(tag_columns, minlength=_width(tag_columns)), total))
+
+        # 本文: よく出る bigram は使わない
+        counts = _text_counts(posts)
+        document_frequency = np.bincount(counts.indices, minlength=TEXT_DIMENSIONS)
+        text_idf = _idf(document_frequency, total).astype(np.float32)
+        text_idf[document_frequency > max(MAX_DOCUMENT_FREQUENCY * total, 1)] = 0
+        return cls(ids, tags, _category_block(posts), _text_block(counts, text_idf), text_idf)
+
+    def update(self, post_ids, using=DEFAULT_DB_ALIAS):
+        """`post_ids` の行だけを作り直した（公開されていなければ除いた）ベクトルを返します。"""
+        post_ids = set(post_ids)
+        posts = _published_rows(using, post_ids)
+        keep = np.array([post_id not in post_ids for post_id in self.ids.tolist()], dtype=bool)
+        ids = np.array([post[0] for post in posts], dtype=np.int64)
+        total = int(keep.sum()) + len(ids)
+        rows = {post_id: row for row, post_id in enumerate(ids.tolist())}
+
+        # タグの IDF は、変わった投稿に付いているタグの分だけを今の件数から求める
+        links = _tag_links(rows, using, post_ids)
+        tag_ids = sorted({tag_id for _, tag_id in links})
+        counts = (
+            Post.tags.through.objects.using(using)
+            .filter(tag_id__in=tag_ids, post__in=Post.objects.using(using).published())
+            .values('tag_id').annotate(posts=Count('pk')).values_list('tag_id', 'posts')
+        )
+        document_frequency = np.zeros(max(tag_ids, default=-1) + 1, dtype=np.int64)
+        for tag_id, count in counts:
+            document_frequency[tag_id] = count
+        tags = _tag_block(len(ids), links, _idf(document_frequency, total))
+
+        text = _text_block(_text_counts(posts), self.text_idf)
+        return type(self)(
+            np.concatenate([self.ids[keep], ids]),
+            _stack([self.tags[keep], tags]),
+            _stack([self.categories[keep], _category_block(posts)]),
+            _stack([self.text[keep], text]),
+            self.text_idf,
+        )
+
+    @classmethod
+    def load(cls, post_ids=(), using=DEFAULT_DB_ALIAS):
+        """
+        キャッシュに保存したベクトルを、`post_ids` の行だけ作り直して返します。
+
+        保存したものがない場合や、公開済みの投稿の件数と合わない（取りこぼした変更がある）
+        場合は、すべての投稿から作り直します。
+        """
+        post_ids = set(post_ids)
+        vectors = cache.get(_vectors_key(using))
+        if vectors is not None:
+            vectors = vectors.update(post_ids, using=using)
+            if len(vectors.ids) != Post.objects.using(using).published().count():
+                vectors = None
+        if vectors is None:
+            vectors = cls.build(using=using)
+        vectors.save(using=using)
+        return vectors
+
+    def save(self, using=DEFAULT_DB_ALIAS):
+        cache.set(_vectors_key(using), self, VECTORS_TIMEOUT)
+
+    def top_related(self, post_ids, count=RELATED_COUNT):
+        """{投稿 ID: [(関連記事の ID, 関連度), ...]} を返します。公開されていない投稿は含みません。"""
+        rows = np.array([self.rows[post_id] for post_id in post_ids if post_id in self.rows], dtype=np.int64)
+        related = {}
+        for start in range(0, len(rows), CHUNK_SIZE):
+            chunk = rows[start:start + CHUNK_SIZE]
+            scores = (self.matrix[chunk] @ self.transposed).toarray()
+            scores[np.arange(len(chunk)), chunk] = 0
+            for row, row_scores in zip(chunk.tolist(), scores):
+                related[int(self.ids[row])] = self._top(row_scores, count)
+        return related
+
+    def _top(self, scores, count):
+        if len(scores) > count:
+            candidates = np.argpartition(-scores, count)[:count]
+        else:
+            candidates = np.arange(len(scores))
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(int(self.ids[column]), float(scores[column])) for column in candidates if scores[column] > 0]
+
+    def similarities(self, post_ids):
+        """投稿と、すべての公開済み投稿との関連度を、1 行 1 投稿の密な配列で返します。"""
+        rows = np.array([self.rows[post_id] for post_id in post_ids if post_id in self.rows], dtype=np.int64)
+        return (self.matrix[rows] @ self.transposed).toarray()
+
+
+def _current_lists(post_ids, using) -> dict:
+    """{投稿 ID: [関連記事の ID, ...]} を返します。`post_ids` が None ならすべての投稿の分です。"""
+    links = RelatedPost.objects.using(using).order_by('post', 'rank').values_list('post_id', 'related_id')
+    if post_ids is None:
+        batches = [links]
+    else:
+        post_ids = sorted(post_ids)
+        batches = [links.filter(post_id__in=post_ids[start:start + 500]) for start in range(0, len(post_ids), 500)]
+    lists = {}
+    for batch in batches:
+        for post_id, related_id in batch.iterator(chunk_size=2000):
+            lists.setdefault(post_id, []).append(related_id)
+    return lists
+
+
+def _save(related, stale_ids, current, using) -> int:
+    """
+    関連記事の一覧を書き込みます。
+
+    `stale_ids` は一覧を消す投稿（公開されていないもの）、`current` は今の一覧です。
+    並びが変わった投稿だけを書き換え、その詳細ページのキャッシュを無効にします。
+    書き換えた投稿の数を返します。
+    """
+    changed = [
+        post_id for post_id, items in related.items()
+        if current.get(post_id, []) != [related_id for related_id, _ in items]
+    ]
+    changed += [post_id for post_id in stale_ids if post_id in current]
+    if not changed:
+        return 0
+    manager = RelatedPost.objects.using(using)
+    with transaction.atomic(using=using):
+        for start in range(0, len(changed), 500):
+            manager.filter(post_id__in=changed[start:start + 500]).delete()
+        manager.bulk_create(
+            [
+                RelatedPost(post_id=post_id, related_id=related_id, rank=rank, score=round(score, 6))
+                for post_id in changed if post_id in related
+                for rank, (related_id, score) in enumerate(related[post_id])
+            ],
+            batch_size=1000,
+        )
+        slugs = []
+        for start in range(0, len(changed), 500):
+            slugs += Post.objects.using(using).filter(pk__in=changed[start:start + 500]).values_list('slug', flat=True)
+        bump(*(f'post:{slug}' for slug in slugs), using=using)
+    return len(changed)
+
+
+def rebuild(using=DEFAULT_DB_ALIAS) -> int:
+    """すべての公開済み投稿の関連記事を計算し直します。書き換えた投稿の数を返します。"""
+    vectors = PostVectors.build(using=using)
+    vectors.save(using=using)
+    related = vectors.top_related(vectors.ids.tolist())
+    current = _current_lists(None, using)
+    stale_ids = [post_id for post_id in current if post_id not in vectors.rows]
+    return _save(related, stale_ids, current, using)
+
+
+def refresh(post_ids, using=DEFAULT_DB_ALIAS) -> int:
+    """
+    変わった投稿の関連記事を計算し直します。
+
+    変わった投稿を関連記事に含む投稿と、変わった投稿との関連度が現在の k 件目を上回る
+    投稿も、並びが変わりうるので一緒に計算し直します。書き換えた投稿の数を返します。
+    """
+    post_ids = set(post_ids)
+    if not post_ids:
+        return 0
+    vectors = PostVectors.load(post_ids, using=using)
+    live = [post_id for post_id in post_ids if post_id in vectors.rows]
+    affected = set(
+        RelatedPost.objects.using(using).filter(related_id__in=post_ids).values_list('post_id', flat=True)
+    )
+    if live:
+        thresholds = np.zeros(len(vectors.ids), dtype=np.float32)
+        kth = RelatedPost.objects.using(using).filter(rank=RELATED_COUNT - 1).values_list('post_id', 'score')
+        for post_id, score in kth.iterator(chunk_size=2000):
+            if post_id in vectors.rows:
+                thresholds[vectors.rows[post_id]] = score
+        scores = vectors.similarities(live)
+        candidates = np.flatnonzero((scores > thresholds).any(axis=0))
+        affected.update(vectors.ids[candidates].tolist())
+    affected = (affected | set(live)) - (post_ids - set(live))
+    related = vectors.top_related(sorted(affected))
+    stale_ids = [post_id for post_id in post_ids if post_id not in vectors.rows]
+    return _save(related, stale_ids, _current_lists({*related, *stale_ids}, using), using)
+
+
+# スレッドごと・データベースごとの、今のトランザクションで積んだ再計算のタスク
+_pending = threading.local()
+
+
+def _forget_pending(using):
+    _pending.tasks.pop(using, None)
+
+
+def _merge_into(task_pk, post_ids, using) -> bool:
+    """まだ実行されていないタスクに投稿を加えます。加えられたら True を返します。"""
+    queued = Task.objects.using(using).filter(
+        pk=task_pk, name=REFRESH_TASK, status=Task.Status.QUEUED, args__1=using
+    )
+    args = queued.values_list('args', flat=True).first()
+    if args is None:
+        return False
+    return bool(queued.update(args=[sorted(post_ids | set(args[0])), using]))
+
+
+def schedule_refresh(post_ids, using=DEFAULT_DB_ALIAS):
+    """
+    投稿の関連記事の再計算を予約します。
+
+    まだ実行時刻になっていない再計算のタスクがあれば、それに投稿を加えます。
+    同じトランザクションの中で続けて呼ばれた場合は、最初に使ったタスクをコミットまで覚えておきます。
+    タスクは呼び出し元のトランザクションと一緒にコミットされます。
+    """
+    post_ids = {post_id for post_id in post_ids if post_id is not None}
+    if not post_ids:
+        return
+    if not hasattr(_pending, 'tasks'):
+        _pending.tasks = {}
+    task_pk = _pending.tasks.get(using)
+    # ロールバックで消えたタスクを覚えていた場合は、加えられずに次へ進む
+    if task_pk is not None and _merge_into(task_pk, post_ids, using):
+        return
+    task_pk = (
+        Task.objects.using(using)
+        .filter(name=REFRESH_TASK, status=Task.Status.QUEUED, run_at__gt=timezone.now(), args__1=using)
+        .order_by('run_at', 'pk').values_list('pk', flat=True).first()
+    )
+    if task_pk is None or not _merge_into(task_pk, post_ids, using):
+        task_obj = enqueue(
+            REFRESH_TASK, sorted(post_ids), using,
+            delay=timedelta(seconds=REFRESH_DELAY), using=using,
+        )
+        if task_obj is None:
+            return
+        task_pk = task_obj.pk
+    _pending.tasks[using] = task_pk
+    transaction.on_commit(lambda: _forget_pending(using), using=using)
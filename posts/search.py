@@ -0,0 +1,250 @@
+"""
+SQLite FTS5 を使った投稿の全文検索。
+
+`posts_post_fts` は Post の影テーブルで、rowid に投稿 ID、列にタイトル・抜粋・本文・
+タグ/カテゴリ名を持ちます。日本語は単語の区切りがないため trigram トークナイザを使い、
+3 文字未満の語だけは FTS テーブル上の LIKE で補います。
+"""
+from dataclasses import dataclass
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from core.pagination import InvalidCursor, decode_cursor, encode_cursor
+
+FTS_TABLE = 'posts_post_fts'
+COLUMNS = ('title', 'excerpt', 'body', 'taxonomy')
+# bm25 の列ごとの重み（title, excerpt, body, taxonomy）
+COLUMN_WEIGHTS = (10.0, 4.0, 1.0, 6.0)
+MIN_TRIGRAM_LENGTH = 3
+SNIPPET_TOKENS = 24
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+
+@dataclass
+class SearchResult:
+    post: object
+    score: float
+    snippet: str
+
+
+@dataclass
+class SearchPage:
+    results: list
+    next_cursor: str | None
+
+
+def is_available(using=DEFAULT_DB_ALIAS) -> bool:
+    return connections[using].vendor == 'sqlite'
+
+
+def parse_query(query: str):
+    """検索語を FTS5 の MATCH 式と、trigram で引けない短い語のリストに分けます。"""
+    terms = [term for term in (query or '').split() if term]
+    phrases = []
+    short_terms = []
+    for term in terms:
+        if len(term) >= MIN_TRIGRAM_LENGTH:
+            phrases.append('"{}"'.format(term.replace('"', '""')))
+        else:
+            short_terms.append(term)
+    return ' AND '.join(phrases), short_terms
+
+
+def _like_pattern(term: str) -> str:
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def _short_term_clause(short_terms, alias='', columns=COLUMNS):
+    prefix = f'{alias}.' if alias else ''
+    clauses = []
+    params = []
+    for term in short_terms:
+        pattern = _like_pattern(term)
+        clauses.append(
+            '({})'.format(' OR '.join(f"{prefix}{column} LIKE %s ESCAPE '\\'" for column in columns))
+        )
+        params.extend([pattern] * len(columns))
+    return clauses, params
+
+
+def match_rowids(query: str, *, table=FTS_TABLE, columns=COLUMNS):
+    """
+    FTS テーブル `table` の `columns` で検索語に一致する行の rowid を返すサブクエリ（RawSQL）。
+
+    検索語が空の場合は None を返します。
+    """
+    match, short_terms = parse_query(query)
+    if not (match or short_terms):
+        return None
+    where = []
+    params = []
+    if match:
+        where.append(f'{table} MATCH %s')
+        params.append('{%s} : (%s)' % (' '.join(columns), match))
+    clauses, short_params = _short_term_clause(short_terms, columns=columns)
+    where.extend(clauses)
+    params.extend(short_params)
+    return RawSQL(f'SELECT rowid FROM {table} WHERE {" AND ".join(where)}', params)
+
+
+def _taxonomy_text(post) -> str:
+    names = [tag.name for tag in post.tags.all()]
+    if post.category_id:
+        names.insert(0, post.category.name)
+    return ' '.join(names)
+
+
+def index_posts(posts, using=DEFAULT_DB_ALIAS):
+    """投稿を索引に登録（または更新）します。tags と category は事前取得しておくと効率的です。"""
+    if not is_available(using):
+        return
+    rows = [
+        (post.pk, post.title, post.excerpt, post.body, _taxonomy_text(post))
+        for post in posts
+    ]
+    if not rows:
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+            [(row[0],) for row in rows],
+        )
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, title, excerpt, body, taxonomy) '
+            'VALUES (%s, %s, %s, %s, %s)',
+            rows,
+        )
+
+
+def index_post_ids(post_ids, using=DEFAULT_DB_ALIAS):
+    from .models import Post
+
+    post_ids = list(post_ids)
+    if not post_ids or not is_available(using):
+        return
+    posts = (
+        Post.objects.using(using)
+        .filter(pk__in=post_ids)
+        .select_related('category')
+        .prefetch_related('tags')
+    )
+    index_posts(posts, using=using)
+
+
+def remove_post_ids(post_ids, using=DEFAULT_DB_ALIAS):
+    post_ids = list(post_ids)
+    if not post_ids or not is_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+            [(pk,) for pk in post_ids],
+        )
+
+
+def rebuild(using=DEFAULT_DB_ALIAS, batch_size=500) -> int:
+    """索引を空にして全投稿から作り直します。登録した件数を返します。"""
+    from .models import Post
+
+    if not is_available(using):
+        return 0
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+    ids = list(Post.objects.using(using).order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(ids), batch_size):
+        index_post_ids(ids[start:start + batch_size], using=using)
+    return len(ids)
+
+
+def _decode_position(token: str):
+    try:
+        score, pk = decode_cursor(token)
+        return float(score), int(pk)
+    except (InvalidCursor, ValueError, TypeError):
+        return None
+
+
+def _highlight(snippet: str) -> str:
+    html = escape(snippet or '')
+    return mark_safe(html.replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>'))
+
+
+def search(query: str, *, limit=10, cursor=None, using=DEFAULT_DB_ALIAS) -> SearchPage:
+    """公開済みの投稿を関連度順に検索し、スニペット付きで 1 ページ分返します。"""
+    from .models import Post
+
+    match, short_terms = parse_query(query)
+    if not (match or short_terms) or not is_available(using):
+        return SearchPage(results=[], next_cursor=None)
+
+    connection = connections[using]
+    post_table = Post._meta.db_table
+
+    where = ['p.is_live = %s']
+    where_params = [True]
+    if match:
+        weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+        score_sql = f'bm25({FTS_TABLE}, {weights})'
+        snippet_sql = (
+            f"snippet({FTS_TABLE}, -1, '{_MARK_START}', '{_MARK_END}', '…', {SNIPPET_TOKENS})"
+        )
+        select_params = []
+        where.insert(0, f'{FTS_TABLE} MATCH %s')
+        where_params.insert(0, match)
+    else:
+        # MATCH がないと bm25/snippet は使えないため、本文の該当箇所を切り出す
+        score_sql = '0.0'
+        snippet_sql = 'substr(f.body, max(instr(f.body, %s) - 40, 1), 120)'
+        select_params = [short_terms[0]]
+    clauses, params = _short_term_clause(short_terms, alias='f')
+    where.extend(clauses)
+    where_params.extend(params)
+
+    position = _decode_position(cursor) if cursor else None
+    if position is not None:
+        where.append('(score > %s OR (score = %s AND p.id > %s))')
+        where_params.extend([position[0], position[0], position[1]])
+
+    sql = (
+        f'SELECT p.id, {score_sql} AS score, {snippet_sql} AS snippet '
+        f'FROM {FTS_TABLE} f JOIN {post_table} p ON p.id = f.rowid '
+        f'WHERE {" AND ".join(where)} '
+        'ORDER BY score, p.id LIMIT %s'
+    )
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, [*select_params, *where_params, limit + 1])
+        rows = db_cursor.fetchall()
+
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    posts = (
+        Post.objects.using(using)
+        .defer('body')
+        .select_related('author', 'category')
+        .prefetch_related('tags')
+        .in_bulk([row[0] for row in rows])
+    )
+    results = []
+    for pk, score, snippet in rows:
+        if pk not in posts:
+            continue
+        if not match:
+            for term in short_terms:
+                snippet = (snippet or '').replace(term, f'{_MARK_START}{term}{_MARK_END}')
+        results.append(SearchResult(post=posts[pk], score=score, snippet=_highlight(snippet)))
+    next_cursor = encode_cursor([rows[-1][1], rows[-1][0]]) if has_next else None
+    return SearchPage(results=results, next_cursor=next_cursor)
+
+
+def filter_queryset(queryset, query: str):
+    """Post のクエリセットを索引で絞り込みます（管理画面の検索用）。"""
+    matched = match_rowids(query)
+    if matched is None:
+        return queryset
+    return queryset.filter(Q(pk__in=matched) | Q(slug=query.strip()))
@@ -0,0 +1,219 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from core.cache import bump
+
+from . import counters, publishing, related, search, tasks
+from .models import Category, Post, RelatedPost, Tag
+
+
+@receiver(pre_save, sender=Post)
+def remember_original_state(sender, instance, using, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    original = (
+        Post.objects.using(using)
+        .filter(pk=instance.pk)
+        .values_list('slug', 'category_id', 'image', 'published_at')
+        .first()
+    )
+    if original:
+        (
+            instance._original_slug,
+            instance._original_category_id,
+            instance._original_image,
+            instance._original_published_at,
+        ) = original
+
+
+@receiver(post_save, sender=Post)
+def bump_saved_post(sender, instance, using, **kwargs):
+    namespaces = ['posts', f'post:{instance.slug}']
+    original_slug = getattr(instance, '_original_slug', None)
+    if original_slug and original_slug != instance.slug:
+        namespaces.append(f'post:{original_slug}')
+    bump(*namespaces, using=using)
+
+
+@receiver(post_delete, sender=Post)
+def bump_deleted_post(sender, instance, using, **kwargs):
+    bump('posts', f'post:{instance.slug}', using=using)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def bump_post_tags_changed(sender, instance, action, reverse, using, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # タグ側からの変更は対象の投稿を特定しないまま、詳細ページごと無効化する
+        bump('posts', 'taxonomy', using=using)
+    else:
+        # 投稿の updated_at は変わらないので、一覧のカードは 'post-tags' で描画し直す
+        bump('posts', 'post-tags', f'post:{instance.slug}', using=using)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Tag)
+def bump_taxonomy(sender, instance, using, **kwargs):
+    bump('taxonomy', using=using)
+
+
+@receiver(post_save, sender=Post)
+def index_saved_post(sender, instance, using, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_post_ids([instance.pk], using=using)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_deleted_post(sender, instance, using, **kwargs):
+    search.remove_post_ids([instance.pk], using=using)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def index_post_tags_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # tag.posts.clear() では pk_set が渡されないため、対象の投稿を先に控えておく
+        instance._cleared_post_ids = list(instance.posts.using(using).values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        post_ids = [instance.pk]
+    elif action == 'post_clear':
+        post_ids = getattr(instance, '_cleared_post_ids', ())
+    else:
+        post_ids = pk_set
+    search.index_post_ids(post_ids, using=using)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Tag)
+def index_renamed_taxonomy(sender, instance, created, using, raw=False, **kwargs):
+    if raw or created:
+        return
+    search.index_post_ids(instance.posts.using(using).values_list('pk', flat=True), using=using)
+
+
+@receiver(pre_delete, sender=Category)
+@receiver(pre_delete, sender=Tag)
+def remember_taxonomy_posts(sender, instance, using, **kwargs):
+    # 削除時の through 行の削除や SET_NULL では Post のシグナルが発火しないため、先に控えておく
+    instance._affected_post_ids = list(instance.posts.using(using).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Tag)
+def index_deleted_taxonomy(sender, instance, using, **kwargs):
+    search.index_post_ids(getattr(instance, '_affected_post_ids', ()), using=using)
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, using, raw=False, **kwargs):
+    if raw:
+        return
+    counters.refresh_category_counts(
+        [instance.category_id, getattr(instance, '_original_category_id', None)], using=using
+    )
+    counters.refresh_archive_counts(
+        [instance.published_at, getattr(instance, '_original_published_at', None)], using=using
+    )
+    if not created:
+        counters.refresh_tag_counts(instance.tags.using(using).values_list('pk', flat=True), using=using)
+
+
+@receiver(pre_delete, sender=Post)
+def remember_post_tags(sender, instance, using, **kwargs):
+    instance._deleted_tag_ids = list(instance.tags.using(using).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, using, **kwargs):
+    counters.refresh_category_counts([instance.category_id], using=using)
+    counters.refresh_tag_counts(getattr(instance, '_deleted_tag_ids', ()), using=using)
+    counters.refresh_archive_counts([instance.published_at], using=using)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def count_post_tags_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action == 'pre_clear' and not reverse:
+        instance._cleared_tag_ids = list(instance.tags.using(using).values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        tag_ids = [instance.pk]
+    elif action == 'post_clear':
+        tag_ids = getattr(instance, '_cleared_tag_ids', ())
+    else:
+        tag_ids = pk_set
+    counters.refresh_tag_counts(tag_ids, using=using)
+
+
+@receiver(post_save, sender=Post)
+def process_uploaded_image(sender, instance, created, using, raw=False, **kwargs):
+    if raw:
+        return
+    image_name = instance.image.name or ''
+    if image_name == (getattr(instance, '_original_image', None) or ''):
+        return
+    # 画像の変換は重いので、リクエストの外でワーカーに任せる
+    tasks.process_post_image.enqueue(instance.pk, using, using=using)
+
+
+@receiver(post_delete, sender=Post)
+def delete_image_renditions(sender, instance, using, **kwargs):
+    renditions = instance.image_renditions
+    if renditions:
+        tasks.delete_image_renditions.enqueue(renditions, using=using)
+
+
+@receiver(post_save, sender=Post)
+def refresh_saved_post_related(sender, instance, using, raw=False, **kwargs):
+    if raw:
+        return
+    # 公開されておらず、関連記事も計算されていない投稿（下書きの保存など）では積まない
+    if not instance.is_live and not RelatedPost.objects.using(using).filter(post=instance).exists():
+        return
+    related.schedule_refresh([instance.pk], using=using)
+
+
+@receiver(pre_delete, sender=Post)
+def remember_related_posts(sender, instance, using, **kwargs):
+    # 関連記事の行は CASCADE で消えるので、この投稿を関連記事に含む投稿を先に控えておく
+    instance._related_post_ids = list(
+        RelatedPost.objects.using(using).filter(related=instance).values_list('post_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Post)
+def refresh_deleted_post_related(sender, instance, using, **kwargs):
+    related.schedule_refresh(getattr(instance, '_related_post_ids', ()), using=using)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def refresh_post_tags_related(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        post_ids = [instance.pk]
+    elif action == 'post_clear':
+        post_ids = getattr(instance, '_cleared_post_ids', ())
+    else:
+        post_ids = pk_set
+    related.schedule_refresh(post_ids, using=using)
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Tag)
+def refresh_deleted_taxonomy_related(sender, instance, using, **kwargs):
+    related.schedule_refresh(getattr(instance, '_affected_post_ids', ()), using=using)
+
+
+@receiver(post_save, sender=Post)
+def schedule_publishing(sender, instance, using, raw=False, **kwargs):
+    if raw or instance.is_live or instance.status != Post.Status.PUBLISHED or instance.published_at is None:
+        return
+    publishing.schedule(instance.published_at, using=using)
@@ -0,0 +1,40 @@
+from django.contrib.sitemaps import Sitemap
+
+from .models import Category, Post, Tag
+
+# 1 ファイルあたりの URL 数。超えるとサイトマップインデックスが複数ファイルに分割する
+SITEMAP_LIMIT = 5000
+
+
+class PostSitemap(Sitemap):
+    limit = SITEMAP_LIMIT
+    changefreq = 'weekly'
+
+    def items(self):
+        return Post.objects.published().only('slug', 'updated_at').order_by('-published_at', '-id')
+
+    def lastmod(self, obj):
+        return obj.updated_at
+
+
+class CategorySitemap(Sitemap):
+    limit = SITEMAP_LIMIT
+    changefreq = 'daily'
+
+    def items(self):
+        return Category.objects.filter(post_count__gt=0).only('slug', 'updated_at').order_by('pk')
+
+    def lastmod(self, obj):
+        return obj.updated_at
+
+
+class TagSitemap(CategorySitemap):
+    def items(self):
+        return Tag.objects.filter(post_count__gt=0).only('slug', 'updated_at').order_by('pk')
+
+
+sitemaps = {
+    'posts': PostSitemap,
+    'categories': CategorySitemap,
+    'tags': TagSitemap,
+}
@@ -0,0 +1,45 @@
+from django.db import DEFAULT_DB_ALIAS
+
+from core.tasks import task
+
+from . import images, popularity, publishing, related, trending
+
+
+@task(max_attempts=3, backoff=60)
+def process_post_image(post_id, using=DEFAULT_DB_ALIAS):
+    images.process_post_image(post_id, using=using)
+
+
+@task()
+def delete_image_renditions(renditions):
+    images.delete_renditions(renditions)
+
+
+@task(max_attempts=1)
+def refresh_trending(using=DEFAULT_DB_ALIAS):
+    trending.refresh_trending(using=using)
+
+
+@task(max_attempts=3, backoff=60)
+def refresh_related_posts(post_ids, using=DEFAULT_DB_ALIAS):
+    related.refresh(post_ids, using=using)
+
+
+@task(max_attempts=1)
+def rebuild_related_posts(using=DEFAULT_DB_ALIAS):
+    related.rebuild(using=using)
+
+
+@task(max_attempts=1)
+def flush_post_views(using=DEFAULT_DB_ALIAS):
+    popularity.drain(using=using)
+
+
+@task(max_attempts=1)
+def refresh_popular_posts(using=DEFAULT_DB_ALIAS):
+    popularity.refresh_rankings(using=using)
+
+
+@task(max_attempts=3, backoff=10)
+def publish_due_posts(using=DEFAULT_DB_ALIAS):
+    publishing.publish_due_posts(using=using)
@@ -0,0 +1,137 @@
+"""
+タグ・カテゴリの一括解決。
+
+名前のリストから既存の行をまとめて引き当て、足りないものは `core.slugs` でスラッグを
+割り当てて `bulk_create` で作成します。投稿フォームのほか、一括取り込みや管理画面のアクションからも
+使えるようにしています。
+"""
+from dataclasses import dataclass, field
+
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import Q
+
+from core.cache import bump
+from core.slugs import allocate_slugs, slug_base
+
+from .models import Category, Tag
+
+MAX_RETRIES = 3
+
+
+@dataclass
+class TaxonomyResult:
+    category: Category | None = None
+    category_created: bool = False
+    tags: list = field(default_factory=list)
+    created_tags: list = field(default_factory=list)
+
+
+def parse_tag_names(value: str) -> list:
+    """カンマ区切りのタグ名を、大文字小文字を区別せずに重複を除いたリストにします。"""
+    names = {}
+    for name in (value or '').split(','):
+        name = name.strip()
+        if name and name.lower() not in names:
+            names[name.lower()] = name
+    return list(names.values())
+
+
+def _find_by_names(model, names, using):
+    name_filter = Q()
+    for name in names:
+        name_filter |= Q(name__iexact=name)
+    return {obj.name.lower(): obj for obj in model.objects.using(using).filter(name_filter)}
+
+
+def _resolve(model, names, using):
+    """名前に対応する行を返し、存在しないものは作成します。（行のリスト, 作成した名前）を返します。"""
+    if not names:
+        return [], []
+    for attempt in range(MAX_RETRIES):
+        found = _find_by_names(model, names, using)
+        missing = [name for name in names if name.lower() not in found]
+        if not missing:
+            return [found[name.lower()] for name in names], []
+        max_length = model._meta.get_field('slug').max_length
+        bases = [slug_base(name, max_length, fallback=model._meta.model_name) for name in missing]
+        objs = [
+            model(name=name, slug=slug)
+            for name, slug in zip(missing, allocate_slugs(model, bases, using=using))
+        ]
+        try:
+            with transaction.atomic(using=using):
+                created = model.objects.using(using).bulk_create(objs)
+        except IntegrityError:
+            # 同時に同じ名前やスラッグが作られた場合は引き直す
+            if attempt == MAX_RETRIES - 1:
+                raise
+            continue
+        # bulk_create は保存シグナルを送らないので、カテゴリバーなどのバージョンはここで進める
+        bump('taxonomy', using=using)
+        for obj in created:
+            found[obj.name.lower()] = obj
+        return [found[name.lower()] for name in names], missing
+
+
+def resolve_tags(names, using=DEFAULT_DB_ALIAS):
+    return _resolve(Tag, list(names), using)
+
+
+def resolve_category(name, using=DEFAULT_DB_ALIAS):
+    """カテゴリ名に対応するカテゴリを返します。（カテゴリ, 作成したか）を返します。"""
+    name = (name or '').strip()
+    if not name:
+        return None, False
+    categories, created = _resolve(Category, [name], using)
+    return categories[0], bool(created)
+
+
+def save_post_with_taxonomy(form, *, author=None, using=DEFAULT_DB_ALIAS) -> TaxonomyResult:
+    """
+    PostForm を保存し、新しいカテゴリ・タグを解決して投稿に付けます。
+
+    すべて 1 つのトランザクションで行うので、途中で失敗しても中途半端な行は残りません。
+    """
+    result = TaxonomyResult()
+    with transaction.atomic(using=using):
+        post = form.save(commit=False)
+        if author is not None:
+            post.author = author
+        result.category, result.category_created = resolve_category(
+            form.cleaned_data.get('new_category'), using=using
+        )
+        if result.category is not None:
+            post.category = result.category
+        post.save(using=using)
+        form.save_m2m()
+        result.tags, result.created_tags = resolve_tags(
+            parse_tag_names(form.cleaned_data.get('new_tags')), using=using
+        )
+        if result.tags:
+            post.tags.add(*result.tags)
+    return result
+
+
+def assign_taxonomy(posts, *, tag_names=(), category_name='', using=DEFAULT_DB_ALIAS) -> TaxonomyResult:
+    """
+    複数の投稿にタグとカテゴリをまとめて付けます（一括取り込みや管理画面のアクション用）。
+
+    タグごとに `tag.posts.add(*posts)` を 1 回だけ呼ぶので、検索インデックスや件数の
+    更新は通常の m2m 変更と同じシグナルで行われます。
+    """
+    posts = list(posts)
+    result = TaxonomyResult()
+    if not posts:
+        return result
+    with transaction.atomic(using=using):
+        result.category, result.category_created = resolve_category(category_name, using=using)
+        if result.category is not None:
+            for post in posts:
+                if post.category_id != result.category.pk:
+                    post.category = result.category
+                    post.save(using=using, update_fields=['category', 'updated_at'])
+        result.tags, result.created_tags = resolve_tags(tag_names, using=using)
+        for tag in result.tags:
+            tag.posts.add(*posts)
+    return result
+
@@ -0,0 +1,92 @@
+from django import template
+from django.db.models import prefetch_related_objects
+from django.template.base import token_kwargs
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from core.cache import get_fragments
+
+register = template.Library()
+
+# カードが参照するコンテンツバージョン。'post-tags' は投稿のタグの付け外しで進む（posts.signals）
+CARD_NAMESPACES = ('taxonomy', 'post-tags')
+
+
+def _card_parts(post):
+    # 投稿の updated_at を更新せずに変わる表示内容（コメント数・派生画像・著者名）もキーに含める
+    return (
+        post.pk,
+        post.updated_at.isoformat(),
+        post.comment_count,
+        post.image.name or '',
+        len(post.image_renditions or ()),
+        post.author.username if post.author_id else '',
+    )
+
+
+@register.simple_tag
+def post_cards(posts):
+    """
+    投稿一覧のカードを出力します。
+
+    カードは投稿の更新日時と、タグ・カテゴリとタグの付け外しのバージョンをキーに断片キャッシュし、
+    1 ページ分を 1 回の `get_many` で取り出します。キャッシュにないカードの分だけ
+    タグをまとめて読み込んで描画します。
+    """
+    posts = {post.pk: post for post in posts}
+
+    def render(post_ids):
+        missing = [posts[pk] for pk in post_ids]
+        prefetch_related_objects(missing, 'tags')
+        return {
+            post.pk: render_to_string('posts/includes/post_card.html', {'post': post})
+            for post in missing
+        }
+
+    cards = get_fragments(
+        'post-card', {pk: _card_parts(post) for pk, post in posts.items()}, CARD_NAMESPACES, render
+    )
+    return mark_safe(''.join(cards[pk] for pk in posts))
+
+
+class FragmentCacheNode(template.Node):
+    def __init__(self, nodelist, name, namespaces, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.namespaces = namespaces
+        self.vary_on = vary_on
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        namespaces = [namespace.resolve(context) for namespace in self.namespaces]
+        vary_on = tuple(f'{key}={value.resolve(context)}' for key, value in sorted(self.vary_on.items()))
+        fragments = get_fragments(
+            name, {name: vary_on}, namespaces, lambda ids: {name: self.nodelist.render(context)}
+        )
+        return fragments[name]
+
+
+@register.tag
+def fragment_cache(parser, token):
+    """
+    ブロックの描画結果を、名前空間のバージョンをキーに断片キャッシュします。
+
+        {% fragment_cache 'sidebar' 'posts' 'taxonomy' %}...{% endfragment_cache %}
+        {% fragment_cache 'category-bar' 'taxonomy' category=active_category.slug %}...{% endfragment_cache %}
+
+    最初の引数が断片の名前、続く引数がバージョンを参照する名前空間、キーワード引数が
+    キーに含める値です。
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f'{bits[0]} には断片の名前が必要です。')
+    nodelist = parser.parse(('endfragment_cache',))
+    parser.delete_first_token()
+    positional = []
+    remaining = bits[1:]
+    while remaining and '=' not in remaining[0]:
+        positional.append(parser.compile_filter(remaining.pop(0)))
+    vary_on = token_kwargs(remaining, parser)
+    if remaining:
+        raise template.TemplateSyntaxError(f'{bits[0]} の引数が不正です: {" ".join(remaining)}')
+    return FragmentCacheNode(nodelist, positional[0], positional[1:], vary_on)
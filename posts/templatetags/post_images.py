@@ -0,0 +1,31 @@
+from django import template
+
+from posts.images import srcset
+
+register = template.Library()
+
+
+@register.inclusion_tag('posts/includes/post_image.html')
+def post_image(post, sizes='100vw', loading='lazy', fetchpriority=''):
+    """
+    投稿画像を `<picture>` として出力します。
+
+    派生画像がまだない場合は元画像をそのまま使い、寸法が分かっていれば width/height を付けます。
+    """
+    renditions = post.image_renditions or []
+    fallback = [r for r in renditions if r['format'] == 'jpeg']
+    if fallback:
+        src = post.image.storage.url(fallback[-1]['name'])
+    else:
+        src = post.image.url
+    return {
+        'post': post,
+        'src': src,
+        'webp_srcset': srcset(renditions, 'webp'),
+        'jpeg_srcset': srcset(renditions, 'jpeg'),
+        'sizes': sizes,
+        'width': post.image_width,
+        'height': post.image_height,
+        'loading': loading,
+        'fetchpriority': fetchpriority,
+    }
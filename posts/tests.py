@@ -1,3 +1,1302 @@
-from django.test import TestCase
+import io
+import re
+import shutil
+import tempfile
+from datetime import timedelta
+from xml.etree import ElementTree
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.template import Context, Template
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.signals import template_rendered
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, include, path, reverse
+from django.utils import timezone
+from PIL import Image
+
+from blog import urls as site_urls
+from comments.models import Comment
+from core import tasks
+from core.cache import (
+    CSRF_PLACEHOLDER,
+    flush_fragment_stats,
+    fragment_stats,
+    get_versions,
+    reset_fragment_stats,
+)
+from core.models import Task
+from core.testing import LOCMEM_CACHES, QueryBudgetMixin
+
+from . import (
+    async_views,
+    counters,
+    export,
+    images,
+    popularity,
+    publishing,
+    related,
+    search,
+    taxonomy,
+    text,
+    trending,
+)
+from . import urls as post_urls
+from .forms import PostForm
+from .models import RESERVED_SLUGS, Category, Post, PostArchiveMonth, PostDailyViews, PostViewBatch, RelatedPost, Tag
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = get_user_model().objects.create_user('author', 'author@example.com', 'password')
+        cls.post = Post.objects.create(
+            title='Hello', body='本文', author=author, status=Post.Status.PUBLISHED
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.rendered = []
+        template_rendered.connect(self._on_render)
+        self.addCleanup(template_rendered.disconnect, self._on_render)
+
+    def _on_render(self, sender, template, context, **kwargs):
+        self.rendered.append(template.name)
+
+    def assert_not_modified(self, url, headers, queries=1):
+        self.rendered.clear()
+        # 検証に使うクエリは 1 本以下で、テンプレートは描画しない
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.rendered, [])
+        return response
+
+    def test_detail_returns_304_without_rendering(self):
+        url = self.post.get_absolute_url()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('posts/post_detail.html', self.rendered)
+
+        not_modified = self.assert_not_modified(url, {'If-None-Match': response['ETag']})
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assert_not_modified(url, {'If-Modified-Since': response['Last-Modified']})
+
+    def test_list_returns_304_without_rendering(self):
+        url = reverse('posts:post_list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # 一覧の最終更新日時はコンテンツバージョンだけで決まる
+        self.assert_not_modified(url, {'If-None-Match': response['ETag']}, queries=0)
+
+    def test_new_comment_changes_validator(self):
+        url = self.post.get_absolute_url()
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(post=self.post, name='読者', email='reader@example.com', body='こんにちは')
+
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'こんにちは')
+
+    def test_list_validator_follows_every_input(self):
+        url = reverse('posts:post_list')
+        scheduled = Post.objects.create(
+            title='予約', body='本文', status=Post.Status.PUBLISHED,
+            published_at=timezone.now() + timedelta(hours=1),
+        )
+
+        def publish_scheduled():
+            Post.objects.filter(pk=scheduled.pk).update(published_at=timezone.now() - timedelta(seconds=1))
+            publishing.publish_due_posts()
+
+        def rank_popular():
+            PostDailyViews.objects.create(post=self.post, day=timezone.localdate(), views=3)
+            popularity.refresh_rankings()
+
+        changes = {
+            'comment': lambda: Comment.objects.create(
+                post=self.post, name='読者', email='reader@example.com', body='こんにちは'
+            ),
+            'popular': rank_popular,
+            'scheduled publish': publish_scheduled,
+            'new category': lambda: taxonomy.resolve_category('写真'),
+            'tag rename': lambda: Tag.objects.create(name='旅', slug='trip'),
+        }
+        for name, change in changes.items():
+            with self.subTest(name):
+                etag = self.client.get(url)['ETag']
+                self.assert_not_modified(url, {'If-None-Match': etag}, queries=0)
+                with self.captureOnCommitCallbacks(execute=True):
+                    change()
+                response = self.client.get(url, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+    def test_feed_validator_follows_scheduled_publish(self):
+        url = reverse('posts:feed')
+        scheduled = Post.objects.create(
+            title='予約した投稿', body='本文', status=Post.Status.PUBLISHED,
+            published_at=timezone.now() + timedelta(hours=1),
+        )
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        Post.objects.filter(pk=scheduled.pk).update(published_at=timezone.now() - timedelta(seconds=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            publishing.publish_due_posts()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertContains(response, '予約した投稿')
+
+    def test_unpublished_post_is_not_validated(self):
+        draft = Post.objects.create(title='Draft', body='本文', status=Post.Status.DRAFT)
+        response = self.client.get(draft.get_absolute_url(), headers={'If-None-Match': '*'})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('author', 'author@example.com', 'password')
+        cls.post = Post.objects.create(title='キャッシュ', body='本文', author=cls.user, status=Post.Status.PUBLISHED)
+
+    def setUp(self):
+        cache.clear()
+        self.rendered = []
+        template_rendered.connect(self._on_render)
+        self.addCleanup(template_rendered.disconnect, self._on_render)
+
+    def _on_render(self, sender, template, context, **kwargs):
+        self.rendered.append(template.name)
+
+    def get(self, client, url):
+        self.rendered.clear()
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        url = self.post.get_absolute_url()
+        self.get(self.client, url)
+        self.assertTrue(self.rendered)
+        response = self.get(self.client_class(), url)
+        self.assertEqual(self.rendered, [])
+        self.assertContains(response, 'キャッシュ')
+
+    def test_write_invalidates_cached_page(self):
+        url = self.post.get_absolute_url()
+        self.get(self.client, url)
+        self.post.title = '書き換えたタイトル'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.save()
+        response = self.get(self.client_class(), url)
+        self.assertTrue(self.rendered)
+        self.assertContains(response, '書き換えたタイトル')
+
+    def test_csrf_token_is_filled_in_per_visitor(self):
+        url = self.post.get_absolute_url()
+        self.get(self.client, url)
+        visitor = self.client_class(enforce_csrf_checks=True)
+        response = self.get(visitor, url)
+        self.assertEqual(self.rendered, [])
+        content = response.content.decode()
+        self.assertNotIn(CSRF_PLACEHOLDER, content)
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', content).group(1)
+        data = {'name': '読者', 'email': 'reader@example.com', 'body': 'こんにちは', 'csrfmiddlewaretoken': token}
+        response = visitor.post(reverse('comments:comment_create', kwargs={'post_slug': self.post.slug}), data)
+        self.assertEqual(response.status_code, 302)
+
+    def test_authenticated_users_bypass_cache(self):
+        url = self.post.get_absolute_url()
+        self.client.force_login(self.user)
+        for _ in range(2):
+            self.get(self.client, url)
+            self.assertTrue(self.rendered)
+        # ログイン中の描画はキャッシュに入らない
+        self.get(self.client_class(), url)
+        self.assertTrue(self.rendered)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='旅行', slug='travel')
+        cls.tag = Tag.objects.create(name='京都', slug='kyoto')
+        cls.post = Post.objects.create(
+            title='Feed', body='本文です。', category=cls.category, status=Post.Status.PUBLISHED
+        )
+        cls.post.tags.add(cls.tag)
+        cls.other = Post.objects.create(title='別の投稿', body='本文', status=Post.Status.PUBLISHED)
+        for title, kwargs in (
+            ('下書きの投稿', {}),
+            ('予約した投稿', {'status': Post.Status.PUBLISHED, 'published_at': timezone.now() + timedelta(days=1)}),
+        ):
+            post = Post.objects.create(title=title, body='本文', category=cls.category, **kwargs)
+            post.tags.add(cls.tag)
+
+    def setUp(self):
+        cache.clear()
+
+    def titles(self, url, item='item', title='title', namespace=''):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        root = ElementTree.fromstring(response.content)
+        return [node.findtext(f'{namespace}{title}') for node in root.iter(f'{namespace}{item}')]
+
+    def test_feeds_list_published_posts_only(self):
+        atom = '{http://www.w3.org/2005/Atom}'
+        for url, expected in (
+            (reverse('posts:feed'), ['別の投稿', 'Feed']),
+            (reverse('posts:category_feed', kwargs={'slug': 'travel'}), ['Feed']),
+            (reverse('posts:tag_feed', kwargs={'slug': 'kyoto'}), ['Feed']),
+        ):
+            with self.subTest(url):
+                self.assertEqual(self.titles(url), expected)
+                self.assertEqual(self.titles(f'{url}atom/', item='entry', namespace=atom), expected)
+        self.assertEqual(self.client.get(reverse('posts:tag_feed', kwargs={'slug': 'missing'})).status_code, 404)
+
+    def test_post_titled_feed_is_reachable(self):
+        self.assertEqual(self.post.slug, 'feed-2')
+        self.assertContains(self.client.get(self.post.get_absolute_url()), '本文です。')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SitemapTests(TestCase):
+    namespace = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='旅行', slug='travel')
+        Category.objects.create(name='空のカテゴリ', slug='empty')
+        cls.tag = Tag.objects.create(name='京都', slug='kyoto')
+        cls.post = Post.objects.create(title='公開中', body='本文', category=cls.category, status=Post.Status.PUBLISHED)
+        cls.post.tags.add(cls.tag)
+        cls.draft = Post.objects.create(title='下書き', body='本文')
+        cls.scheduled = Post.objects.create(
+            title='予約', body='本文', status=Post.Status.PUBLISHED, published_at=timezone.now() + timedelta(days=1)
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def entries(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        root = ElementTree.fromstring(response.content)
+        return {
+            node.findtext(f'{self.namespace}loc'): node.findtext(f'{self.namespace}lastmod')
+            for node in root
+        }
+
+    def test_index_lists_sections(self):
+        sections = self.entries(reverse('sitemap'))
+        self.assertEqual(
+            sorted(sections),
+            sorted(
+                f'http://testserver{reverse("sitemap_section", kwargs={"section": section})}'
+                for section in ('posts', 'categories', 'tags')
+            ),
+        )
+
+    def test_sections_list_published_urls_with_lastmod(self):
+        posts = self.entries(reverse('sitemap_section', kwargs={'section': 'posts'}))
+        self.assertEqual(list(posts), [f'http://testserver{self.post.get_absolute_url()}'])
+        self.assertEqual(list(posts.values()), [timezone.localdate(self.post.updated_at).isoformat()])
+        categories = self.entries(reverse('sitemap_section', kwargs={'section': 'categories'}))
+        self.assertEqual(list(categories), [f'http://testserver{self.category.get_absolute_url()}'])
+        tags = self.entries(reverse('sitemap_section', kwargs={'section': 'tags'}))
+        self.assertEqual(list(tags), [f'http://testserver{self.tag.get_absolute_url()}'])
+
+        # 公開されると、キャッシュ済みのサイトマップにも載る
+        self.scheduled.published_at = timezone.now() - timedelta(seconds=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.scheduled.save()
+        posts = self.entries(reverse('sitemap_section', kwargs={'section': 'posts'}))
+        self.assertIn(f'http://testserver{self.scheduled.get_absolute_url()}', posts)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.kyoto = Post.objects.create(
+            title='京都の紅葉狩り', body='嵐山の紅葉を見に行きました。', status=Post.Status.PUBLISHED
+        )
+        cls.curry = Post.objects.create(
+            title='カレーの作り方', body='玉ねぎを炒めてから煮込みます。', status=Post.Status.PUBLISHED
+        )
+        cls.draft = Post.objects.create(title='京都の下書き', body='紅葉の下書き')
+        cls.kyoto.tags.add(Tag.objects.create(name='旅行記', slug='travel'))
+
+    def titles(self, page):
+        return [result.post.title for result in page.results]
+
+    def test_trigram_match_on_title_body_and_taxonomy(self):
+        page = search.search('紅葉を')
+        self.assertEqual(self.titles(page), ['京都の紅葉狩り'])
+        self.assertIn('<mark>', page.results[0].snippet)
+        self.assertEqual(self.titles(search.search('旅行記')), ['京都の紅葉狩り'])
+        self.assertEqual(self.titles(search.search('玉ねぎ 煮込み')), ['カレーの作り方'])
+        self.assertEqual(self.titles(search.search('玉ねぎ 紅葉狩')), [])
+
+    def test_short_terms_fall_back_to_like(self):
+        self.assertEqual(self.titles(search.search('京都')), ['京都の紅葉狩り'])
+        page = search.search('嵐山')
+        self.assertEqual(self.titles(page), ['京都の紅葉狩り'])
+        self.assertIn('<mark>嵐山</mark>', page.results[0].snippet)
+        # 短い語と長い語を組み合わせると、両方に一致するものだけを返す
+        self.assertEqual(self.titles(search.search('京都 玉ねぎ')), [])
+        self.assertEqual(self.titles(search.search('%')), [])
+
+    def test_index_follows_edits(self):
+        self.curry.title = '京都のカレー'
+        self.curry.save()
+        self.assertEqual(set(self.titles(search.search('京都'))), {'京都の紅葉狩り', '京都のカレー'})
+        self.kyoto.delete()
+        self.assertEqual(self.titles(search.search('紅葉狩')), [])
+
+    def test_cursor_pages_through_results(self):
+        for number in range(4):
+            Post.objects.create(title=f'紅葉の写真 {number}', body='本文', status=Post.Status.PUBLISHED)
+        # bm25 の順位で並ぶ MATCH と、id 順で並ぶ短い語の LIKE の両方で、重複も抜けもなくページを送る
+        for query, expected in (('紅葉の', 4), ('紅葉', 5)):
+            with self.subTest(query):
+                seen = []
+                cursor = None
+                while True:
+                    page = search.search(query, limit=2, cursor=cursor)
+                    seen += self.titles(page)
+                    cursor = page.next_cursor
+                    if cursor is None:
+                        break
+                self.assertEqual(len(seen), expected)
+                self.assertEqual(len(set(seen)), expected)
+                self.assertNotIn('京都の下書き', seen)
+
+    def test_route_names_are_not_used_as_slugs(self):
+        post = Post.objects.create(title='Search', body='本文', status=Post.Status.PUBLISHED)
+        self.assertEqual(post.slug, 'search-2')
+        self.assertContains(self.client.get(post.get_absolute_url()), 'Search')
+        form = PostForm(data={'title': '検索', 'slug': 'search', 'body': '本文', 'status': Post.Status.DRAFT})
+        self.assertIn('slug', form.errors)
+
+        # 投稿の URL と同じ階層の固定のパスは、すべて予約されている
+        prefixes = set()
+        for pattern in site_urls.urlpatterns:
+            included = isinstance(pattern, URLResolver) and not str(pattern.pattern)
+            for child in pattern.url_patterns if included else [pattern]:
+                first = str(child.pattern).split('/')[0]
+                if first and '<' not in first and '.' not in first:
+                    prefixes.add(first)
+        self.assertLessEqual({'admin', 'search', 'feed'}, prefixes)
+        self.assertLessEqual(prefixes, RESERVED_SLUGS)
+
+    def test_search_view(self):
+        response = self.client.get(reverse('posts:search'), {'q': '紅葉を'})
+        self.assertContains(response, '京都の紅葉狩り')
+        response = self.client.get(reverse('posts:search'), {'q': '紅葉', 'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    budget_namespaces = ('posts',)
+    query_budgets = {
+        'posts:post_list': 8,
+        'posts:search': 3,
+        'posts:feed': 3,
+        'posts:atom_feed': 3,
+        'posts:category': 8,
+        'posts:category_feed': 3,
+        'posts:category_atom_feed': 3,
+        'posts:tag': 8,
+        'posts:tag_feed': 3,
+        'posts:tag_atom_feed': 3,
+        'posts:archive_year': 9,
+        'posts:archive_month': 9,
+        'posts:post_detail': 5,
+        'posts:manage_post_list': 4,
+        'posts:post_create': 4,
+        'posts:post_update': 7,
+        'posts:post_delete': 4,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = get_user_model().objects.create_user('author', 'author@example.com', 'password')
+        cls.category = Category.objects.create(name='日記', slug='diary')
+        Category.objects.create(name='技術', slug='tech')
+        tags = [Tag.objects.create(name=f'タグ{number}', slug=f'tag-{number}') for number in range(5)]
+        cls.tag = tags[0]
+        # 件数が増えてもクエリ数が変わらないことを確かめるため、一覧の 1 ページ分より多く作る
+        for number in range(12):
+            post = Post.objects.create(
+                title=f'投稿 {number}',
+                body='本文 ' * 50,
+                author=cls.author,
+                category=cls.category,
+                status=Post.Status.PUBLISHED,
+            )
+            post.tags.add(*tags[:3])
+            for index in range(3):
+                Comment.objects.create(post=post, name='読者', email='reader@example.com', body=f'コメント {index}')
+        cls.post = post
+        cls.archive = PostArchiveMonth.objects.get()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_public_views(self):
+        urls = {
+            'posts:post_list': reverse('posts:post_list'),
+            'posts:search': reverse('posts:search') + '?q=投稿',
+            'posts:feed': reverse('posts:feed'),
+            'posts:atom_feed': reverse('posts:atom_feed'),
+            'posts:category': reverse('posts:category', kwargs={'slug': self.category.slug}),
+            'posts:category_feed': reverse('posts:category_feed', kwargs={'slug': self.category.slug}),
+            'posts:category_atom_feed': reverse('posts:category_atom_feed', kwargs={'slug': self.category.slug}),
+            'posts:tag': reverse('posts:tag', kwargs={'slug': self.tag.slug}),
+            'posts:tag_feed': reverse('posts:tag_feed', kwargs={'slug': self.tag.slug}),
+            'posts:tag_atom_feed': reverse('posts:tag_atom_feed', kwargs={'slug': self.tag.slug}),
+            'posts:archive_year': reverse('posts:archive_year', kwargs={'year': self.post.published_at.year}),
+            'posts:archive_month': self.archive.get_absolute_url(),
+            'posts:post_detail': self.post.get_absolute_url(),
+        }
+        for url_name, url in urls.items():
+            with self.subTest(url_name):
+                response = self.assertQueryBudget(url_name, lambda: self.client.get(url))
+                self.assertEqual(response.status_code, 200)
+
+    def test_author_views(self):
+        self.client.force_login(self.author)
+        urls = {
+            'posts:manage_post_list': reverse('posts:manage_post_list'),
+            'posts:post_create': reverse('posts:post_create'),
+            'posts:post_update': reverse('posts:post_update', kwargs={'slug': self.post.slug}),
+            'posts:post_delete': reverse('posts:post_delete', kwargs={'slug': self.post.slug}),
+        }
+        for url_name, url in urls.items():
+            with self.subTest(url_name):
+                response = self.assertQueryBudget(url_name, lambda: self.client.get(url))
+                self.assertEqual(response.status_code, 200)
+
+
+@override_settings(PAGE_CACHE_ENABLED=False, CACHES=LOCMEM_CACHES)
+class FragmentCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(name='旅行', slug='travel')
+        Category.objects.create(name='日記', slug='diary')
+        cls.posts = []
+        for number in range(3):
+            post = Post.objects.create(title=f'投稿 {number}', body='本文', status=Post.Status.PUBLISHED)
+            post.tags.add(cls.tag)
+            cls.posts.append(post)
+
+    def setUp(self):
+        cache.clear()
+        reset_fragment_stats()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_cached_cards_and_sidebar_skip_queries(self):
+        url = reverse('posts:post_list')
+        first, cold = self.count_queries(url)
+        second, warm = self.count_queries(url)
+        # タグ・カテゴリ・トレンド・人気記事・月別アーカイブを読まない
+        self.assertEqual(cold - warm, 5)
+        self.assertEqual(first.content, second.content)
+
+        flush_fragment_stats()
+        stats = fragment_stats()
+        cards = Post.objects.published().count()
+        self.assertEqual(stats['post-card'], {'hits': cards, 'misses': cards})
+        self.assertEqual(stats['sidebar'], {'hits': 1, 'misses': 1})
+
+    def test_category_created_from_post_form_appears_in_category_bar(self):
+        url = reverse('posts:post_list')
+        self.client.get(url)
+        author = get_user_model().objects.create_user('writer', 'writer@example.com', 'password')
+        self.client.force_login(author)
+        data = {'title': '新しい投稿', 'body': '本文', 'status': Post.Status.PUBLISHED, 'new_category': '写真'}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('posts:post_create'), data)
+        self.assertEqual(response.status_code, 302)
+        self.client.logout()
+        self.assertContains(self.client.get(url), '写真', count=2)
+
+    def test_cards_follow_post_and_taxonomy_changes(self):
+        url = reverse('posts:post_list')
+        self.client.get(url)
+        post = self.posts[0]
+        post.title = '京都の旅'
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+        self.assertContains(self.client.get(url), '京都の旅')
+
+        self.tag.name = '観光'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.save()
+        response = self.client.get(url)
+        self.assertContains(response, '#観光', count=len(self.posts))
+        self.assertNotContains(response, '#旅行')
+
+    def test_cards_follow_tags_added_without_saving_the_post(self):
+        url = reverse('posts:post_list')
+        self.client.get(url)
+        tag = Tag.objects.create(name='紅葉', slug='autumn')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.posts[0].tags.add(tag)
+        self.assertContains(self.client_class().get(url), '#紅葉', count=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.posts[0].tags.remove(tag)
+        self.assertNotContains(self.client_class().get(url), '#紅葉')
+
+
+class PostTextTests(TestCase):
+    def test_reading_stats(self):
+        self.assertEqual(text.reading_stats('あ' * 1500), (1500, 3))
+        # 英文も文字数で数える（空白を含む）
+        self.assertEqual(text.reading_stats('word ' * 300), (1500, 3))
+        self.assertEqual(text.reading_stats('短い本文'), (4, 0))
+        self.assertEqual(text.reading_stats(None), (0, 0))
+
+    def test_summary_prefers_the_excerpt(self):
+        self.assertEqual(text.make_summary('  抜粋です。 ', '本文'), '抜粋です。')
+        self.assertEqual(text.make_summary('   ', '本文の\n\n先頭'), '本文の 先頭')
+        summary = text.make_summary('', 'あ' * 500)
+        self.assertEqual(len(summary), text.SUMMARY_LENGTH)
+        self.assertTrue(summary.endswith('…'))
+        self.assertEqual(text.make_summary('', 'a' * text.SUMMARY_LENGTH), 'a' * text.SUMMARY_LENGTH)
+
+    def test_stats_follow_the_saved_fields(self):
+        post = Post.objects.create(title='統計', body='あ' * 1000)
+        self.assertEqual((post.char_count, post.reading_minutes, post.summary[:3]), (1000, 2, 'あああ'))
+        post.body = 'い' * 1500
+        post.save(update_fields=['body'])
+        post.refresh_from_db()
+        self.assertEqual((post.char_count, post.reading_minutes, post.summary[:3]), (1500, 3, 'いいい'))
+        post.excerpt = '抜粋'
+        post.save(update_fields=['excerpt'])
+        self.assertEqual(Post.objects.values_list('summary', flat=True).get(pk=post.pk), '抜粋')
+        # 本文・抜粋を含まない保存では計算し直さない
+        post.body = 'う'
+        post.save(update_fields=['title'])
+        post.refresh_from_db()
+        self.assertEqual((post.char_count, post.body[:1]), (1500, 'い'))
+
+    def test_backfill_command(self):
+        posts = [Post.objects.create(title=f'投稿 {n}', body='本文 ' * 400) for n in range(3)]
+        Post.objects.update(char_count=0, reading_minutes=0, summary='')
+        before = get_versions('posts')
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('backfill_post_stats', '--batch-size', '2', stdout=out)
+        self.assertIn('3 件', out.getvalue())
+        for post in posts:
+            post.refresh_from_db()
+            self.assertEqual((post.char_count, post.reading_minutes), (1200, 2))
+            self.assertEqual(post.summary, text.make_summary('', post.body))
+        self.assertNotEqual(get_versions('posts'), before)
+
+
+@override_settings(TASK_QUEUE_EAGER=True)
+class PostImageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def upload(self, name, size, mode='RGB'):
+        buffer = io.BytesIO()
+        Image.new(mode, size, 'white' if mode == 'RGB' else (255, 0, 0, 128)).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def create(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(title='写真', body='本文', status=Post.Status.PUBLISHED, image=image)
+        post.refresh_from_db()
+        return post
+
+    def test_renditions_cover_each_width_and_format(self):
+        post = self.create(self.upload('photo.png', (1000, 500)))
+        self.assertEqual((post.image_width, post.image_height), (1000, 500))
+        self.assertEqual(
+            [(r['format'], r['width'], r['height']) for r in post.image_renditions],
+            [(fmt, width, width // 2) for width in (320, 640, 960, 1000) for fmt in ('webp', 'jpeg')],
+        )
+        for rendition in post.image_renditions:
+            with default_storage.open(rendition['name']) as file, Image.open(file) as image:
+                self.assertEqual(image.format, images.FORMATS[rendition['format']]['format'])
+                self.assertEqual(image.size, (rendition['width'], rendition['height']))
+
+    def test_small_images_are_not_upscaled(self):
+        post = self.create(self.upload('icon.png', (200, 100), mode='RGBA'))
+        self.assertEqual({r['width'] for r in post.image_renditions}, {200})
+        self.assertEqual(len(post.image_renditions), len(images.FORMATS))
+
+    def test_replaced_and_deleted_images_clean_up_renditions(self):
+        post = self.create(self.upload('before.png', (700, 700)))
+        before = [r['name'] for r in post.image_renditions]
+        with self.captureOnCommitCallbacks(execute=True):
+            post.image = self.upload('after.png', (400, 300))
+            post.save()
+        post.refresh_from_db()
+        self.assertEqual({r['width'] for r in post.image_renditions}, {320, 400})
+        self.assertFalse([name for name in before if default_storage.exists(name)])
+        after = [r['name'] for r in post.image_renditions]
+        self.assertTrue(all(default_storage.exists(name) for name in after))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        self.assertFalse([name for name in after if default_storage.exists(name)])
+
+    def render(self, post):
+        return Template('{% load post_images %}{% post_image post sizes="50vw" %}').render(Context({'post': post}))
+
+    def test_tag_lists_renditions(self):
+        post = self.create(self.upload('photo.png', (1000, 500)))
+        html = self.render(post)
+        self.assertIn('width="1000" height="500"', html)
+        self.assertIn('sizes="50vw"', html)
+        webp = re.search(r'<source type="image/webp" srcset="([^"]+)"', html).group(1)
+        self.assertEqual([item.split()[1] for item in webp.split(', ')], ['320w', '640w', '960w', '1000w'])
+        self.assertIn(f'src="{default_storage.url(post.image_renditions[-1]["name"])}"', html)
+
+    def test_tag_falls_back_to_the_original_image(self):
+        with self.settings(TASK_QUEUE_EAGER=False):
+            post = self.create(self.upload('photo.png', (1000, 500)))
+        self.assertEqual(post.image_renditions, [])
+        html = self.render(post)
+        self.assertIn(f'src="{post.image.url}"', html)
+        self.assertNotIn('srcset', html)
+        self.assertNotIn('width=', html)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RelatedPostsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.travel, cls.food, cls.camera = (
+            Tag.objects.create(name=name, slug=slug)
+            for name, slug in (('旅行', 'travel'), ('料理', 'food'), ('カメラ', 'camera'))
+        )
+        cls.kyoto = cls.create_post('京都の旅', '清水寺と嵐山を歩いた。', cls.travel, cls.camera)
+        cls.osaka = cls.create_post('大阪の旅', '通天閣と道頓堀を歩いた。', cls.travel, cls.camera)
+        cls.nara = cls.create_post('奈良の旅', '東大寺と鹿を見に行った。', cls.travel)
+        cls.curry = cls.create_post('カレーの作り方', '玉ねぎをじっくり炒める。', cls.food)
+
+    def setUp(self):
+        # setUpTestData で積んだタスクに、このテストの変更が加わらないようにする
+        Task.objects.filter(name='posts.refresh_related_posts').delete()
+        cache.clear()
+
+    @classmethod
+    def create_post(cls, title, body, *tags):
+        post = Post.objects.create(title=title, body=body, status=Post.Status.PUBLISHED)
+        post.tags.add(*tags)
+        return post
+
+    def related_titles(self, post):
+        return list(Post.objects.related_to(post.slug).values_list('title', flat=True))
+
+    def test_rebuild_ranks_by_shared_tags(self):
+        related.rebuild()
+        self.assertEqual(self.related_titles(self.kyoto)[:2], ['大阪の旅', '奈良の旅'])
+        self.assertNotIn('カレーの作り方', self.related_titles(self.kyoto))
+        self.assertContains(self.client.get(self.kyoto.get_absolute_url()), '関連記事')
+
+    @override_settings(TASK_QUEUE_EAGER=True)
+    def test_changes_refresh_affected_posts(self):
+        related.rebuild()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.curry.tags.add(self.travel, self.camera)
+        self.assertEqual(self.related_titles(self.curry)[:2], ['京都の旅', '大阪の旅'])
+        # 変わった投稿を上位に含むことになる投稿も計算し直す
+        self.assertIn('カレーの作り方', self.related_titles(self.nara))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.osaka.status = Post.Status.DRAFT
+            self.osaka.save()
+        self.assertEqual(self.related_titles(self.osaka), [])
+        self.assertNotIn('大阪の旅', self.related_titles(self.kyoto))
+        self.assertFalse(RelatedPost.objects.filter(post=self.osaka).exists())
+
+    @override_settings(TASK_QUEUE_EAGER=True)
+    def test_refresh_rebuilds_only_changed_rows(self):
+        related.rebuild()
+        with CaptureQueriesContext(connection) as queries:
+            related.refresh([self.curry.pk])
+        # 本文を読むのは変わった投稿の分だけ
+        reads = [query['sql'] for query in queries if 'SUBSTR' in query['sql']]
+        self.assertEqual(len(reads), 1)
+        self.assertIn(f'IN ({self.curry.pk})', reads[0])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.curry.tags.add(self.travel, self.camera)
+        self.assertEqual(self.related_titles(self.curry)[:2], ['京都の旅', '大阪の旅'])
+        # 保存したベクトルと公開済みの件数が合わなければ作り直す
+        Post.objects.filter(pk=self.nara.pk).update(status=Post.Status.DRAFT, is_live=False)
+        related.refresh([self.kyoto.pk])
+        self.assertNotIn('奈良の旅', self.related_titles(self.kyoto))
+
+    def test_pending_changes_share_one_task(self):
+        queued = Task.objects.filter(name='posts.refresh_related_posts')
+        self.kyoto.save()
+        self.curry.tags.add(self.travel)
+        with transaction.atomic():
+            self.osaka.save()
+            self.osaka.tags.add(self.food)
+        self.assertEqual(queued.count(), 1)
+        self.assertEqual(
+            queued.get().args, [sorted([self.kyoto.pk, self.osaka.pk, self.curry.pk]), 'default']
+        )
+        # 実行を待つタスクがなければ、新しく積む
+        queued.update(status=Task.Status.RUNNING)
+        self.nara.save()
+        self.assertEqual(queued.filter(status=Task.Status.QUEUED).get().args, [[self.nara.pk], 'default'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PopularityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.popular = Post.objects.create(title='よく読まれる投稿', body='本文', status=Post.Status.PUBLISHED)
+        cls.quiet = Post.objects.create(title='静かな投稿', body='本文', status=Post.Status.PUBLISHED)
+
+    def setUp(self):
+        # 他のテストで数えた閲覧数を捨てる
+        popularity.flush()
+        PostViewBatch.objects.all().delete()
+        cache.clear()
+
+    def test_views_are_buffered_and_ranked(self):
+        url = self.popular.get_absolute_url()
+        # 2 回目以降はページキャッシュや 304 で返るが、閲覧としては数える
+        etag = self.client.get(url)['ETag']
+        self.client.get(url)
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        self.client.get(self.quiet.get_absolute_url())
+        self.assertFalse(PostDailyViews.objects.exists())
+
+        # Web のプロセスが書き出したバッチは DB に残り、ワーカーのプロセスがそこから取り出す
+        popularity.flush()
+        self.assertTrue(PostViewBatch.objects.exists())
+        cache.clear()
+        self.assertEqual(popularity.drain(), 4)
+        self.assertFalse(PostViewBatch.objects.exists())
+        self.client.get(url)
+        self.assertEqual(popularity.drain(), 1)
+        self.assertEqual(PostDailyViews.objects.get(post=self.popular, day=timezone.localdate()).views, 4)
+
+        list_url = reverse('posts:post_list')
+        etag = self.client.get(list_url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            popularity.refresh_rankings()
+        self.assertEqual(list(Post.objects.popular(7)), [self.popular, self.quiet])
+        # ランキングが変わると一覧の ETag もページキャッシュも変わる
+        response = self.client.get(list_url, headers={'If-None-Match': etag})
+        self.assertContains(response, '人気の記事')
+
+    def test_old_views_leave_short_rankings(self):
+        today = timezone.localdate()
+        PostDailyViews.objects.create(post=self.quiet, day=today - timedelta(days=3), views=10)
+        PostDailyViews.objects.create(post=self.popular, day=today, views=2)
+        popularity.refresh_rankings(today)
+        self.assertEqual(list(Post.objects.popular(1)), [self.popular])
+        self.assertEqual(list(Post.objects.popular(7)), [self.quiet, self.popular])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TrendingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.kyoto, cls.osaka = (
+            Tag.objects.create(name=name, slug=slug) for name, slug in (('京都', 'kyoto'), ('大阪', 'osaka'))
+        )
+        cls.post = Post.objects.create(title='京都の旅', body='本文', status=Post.Status.PUBLISHED)
+        cls.post.tags.add(cls.kyoto)
+
+    def setUp(self):
+        cache.clear()
+
+    def refresh(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            trending.refresh_trending()
+        return get_versions('taxonomy', 'trending')
+
+    def test_only_ranking_changes_bump_trending(self):
+        first = self.refresh()
+        list_etag = self.client.get(reverse('posts:post_list'))['ETag']
+        detail_etag = self.client.get(self.post.get_absolute_url())['ETag']
+        # 順位が変わらない定期実行では、どのバージョンも進めない
+        self.assertEqual(self.refresh(), first)
+
+        other = Post.objects.create(title='大阪の旅', body='本文', status=Post.Status.PUBLISHED)
+        other.tags.add(self.osaka)
+        Comment.objects.create(post=other, name='読者', email='reader@example.com', body='こんにちは')
+        before = get_versions('taxonomy', 'trending')
+        after = self.refresh()
+        self.assertEqual(after['taxonomy'], before['taxonomy'])
+        self.assertNotEqual(after['trending'], before['trending'])
+        self.assertEqual(list(trending.trending_tags()), [self.osaka, self.kyoto])
+
+        response = self.client.get(reverse('posts:post_list'), headers={'If-None-Match': list_etag})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.post.get_absolute_url(), headers={'If-None-Match': detail_etag})
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ScheduledPublishingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_scheduled_post_goes_live_at_publish_time(self):
+        url = reverse('posts:post_list')
+        publish_at = timezone.now() + timedelta(hours=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(
+                title='予約した投稿', body='本文', status=Post.Status.PUBLISHED, published_at=publish_at
+            )
+        self.assertFalse(post.is_live)
+        task = Task.objects.get(name='posts.publish_due_posts')
+        self.assertEqual(task.run_at, publish_at)
+        self.assertNotContains(self.client.get(url), '予約した投稿')
+
+        # 公開日時を過ぎたところでタスクが実行される
+        Post.objects.filter(pk=post.pk).update(published_at=timezone.now() - timedelta(seconds=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(publishing.publish_due_posts(), 1)
+        post.refresh_from_db()
+        self.assertTrue(post.is_live)
+        # キャッシュ済みの一覧もバージョンが進んで描画し直される
+        self.assertContains(self.client.get(url), '予約した投稿')
+        self.assertEqual(publishing.publish_due_posts(), 0)
+
+    @override_settings(TASK_QUEUE_EAGER=True)
+    def test_scheduled_post_waits_for_worker_in_eager_mode(self):
+        publish_at = timezone.now() + timedelta(hours=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(
+                title='予約した投稿', body='本文', status=Post.Status.PUBLISHED, published_at=publish_at
+            )
+        post.refresh_from_db()
+        self.assertFalse(post.is_live)
+        # 公開日時まで実行を待つタスクは、eager でもその場では実行しない
+        task = Task.objects.get(name='posts.publish_due_posts', status=Task.Status.QUEUED)
+        self.assertEqual(task.run_at, publish_at)
+        self.assertIsNone(tasks.claim('worker-1'))
+
+        Post.objects.filter(pk=post.pk).update(published_at=timezone.now() - timedelta(seconds=1))
+        Task.objects.filter(pk=task.pk).update(run_at=timezone.now())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(tasks.run(tasks.claim('worker-1')))
+        post.refresh_from_db()
+        self.assertTrue(post.is_live)
+
+    def test_moving_publish_time_to_future_hides_post(self):
+        post = Post.objects.create(title='公開中', body='本文', status=Post.Status.PUBLISHED)
+        self.assertTrue(post.is_live)
+        post.published_at = timezone.now() + timedelta(days=1)
+        post.save(update_fields=['published_at'])
+        self.assertFalse(Post.objects.published().filter(pk=post.pk).exists())
+        self.assertEqual(Post.objects.next_publish_at(), post.published_at)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.march = timezone.make_aware(timezone.datetime(2024, 3, 10, 12))
+        cls.april = timezone.make_aware(timezone.datetime(2024, 4, 2, 12))
+        cls.posts = [
+            Post.objects.create(
+                title=f'三月の投稿 {number}', body='本文', status=Post.Status.PUBLISHED, published_at=cls.march
+            )
+            for number in range(2)
+        ]
+        Post.objects.create(title='四月の投稿', body='本文', status=Post.Status.PUBLISHED, published_at=cls.april)
+        Post.objects.create(title='三月の下書き', body='本文', published_at=cls.march)
+
+    def setUp(self):
+        cache.clear()
+
+    def counts(self):
+        return list(PostArchiveMonth.objects.values_list('year', 'month', 'post_count'))
+
+    def test_counts_follow_publish_unpublish_and_delete(self):
+        self.assertEqual(self.counts(), [(2024, 4, 1), (2024, 3, 2)])
+        post = self.posts[0]
+        post.status = Post.Status.DRAFT
+        post.save()
+        self.assertEqual(self.counts(), [(2024, 4, 1), (2024, 3, 1)])
+        post.status = Post.Status.PUBLISHED
+        post.published_at = self.april
+        post.save()
+        self.assertEqual(self.counts(), [(2024, 4, 2), (2024, 3, 1)])
+        self.posts[1].delete()
+        self.assertEqual(self.counts(), [(2024, 4, 2)])
+
+        PostArchiveMonth.objects.all().delete()
+        counters.rebuild_counts()
+        self.assertEqual(self.counts(), [(2024, 4, 2)])
+
+    def test_archive_pages(self):
+        response = self.client.get(reverse('posts:archive_month', kwargs={'year': 2024, 'month': 3}))
+        self.assertContains(response, '三月の投稿 0')
+        self.assertNotContains(response, '四月の投稿')
+        self.assertNotContains(response, '三月の下書き')
+        self.assertContains(response, reverse('posts:archive_month', kwargs={'year': 2024, 'month': 4}))
+
+        response = self.client.get(reverse('posts:archive_year', kwargs={'year': 2024}))
+        self.assertContains(response, '三月の投稿 0')
+        self.assertContains(response, '四月の投稿')
+
+        for kwargs in ({'year': 2023}, {'year': 2024, 'month': 5}, {'year': 2024, 'month': 13}):
+            with self.subTest(**kwargs):
+                name = 'posts:archive_month' if 'month' in kwargs else 'posts:archive_year'
+                self.assertEqual(self.client.get(reverse(name, kwargs=kwargs)).status_code, 404)
+
+
+class TaxonomyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = get_user_model().objects.create_user('author', 'author@example.com', 'password')
+
+    def save(self, **data):
+        form = PostForm(data={'title': '投稿', 'body': '本文', 'status': Post.Status.PUBLISHED, **data})
+        self.assertTrue(form.is_valid(), form.errors)
+        return taxonomy.save_post_with_taxonomy(form, author=self.author)
+
+    def test_creates_category_and_tags(self):
+        result = self.save(new_category='写真', new_tags='Python, django, python')
+        self.assertTrue(result.category_created)
+        self.assertEqual(result.created_tags, ['Python', 'django'])
+        post = Post.objects.get()
+        self.assertEqual((post.author, post.category.name), (self.author, '写真'))
+        self.assertEqual(sorted(post.tags.values_list('name', 'post_count')), [('Python', 1), ('django', 1)])
+        self.assertEqual(post.category.post_count, 1)
+
+    def test_reuses_existing_tags_case_insensitively(self):
+        django_tag = Tag.objects.create(name='Django', slug='django')
+        result = self.save(new_tags='DJANGO, 新しいタグ')
+        self.assertEqual(result.tags[0], django_tag)
+        self.assertEqual(result.created_tags, ['新しいタグ'])
+        self.assertEqual(Tag.objects.filter(name__iexact='django').count(), 1)
+        # スラッグにできない名前にも、重複しないスラッグを割り当てる
+        self.assertTrue(Tag.objects.get(name='新しいタグ').slug)
+
+    def race(self, model, name, slug):
+        """空きスラッグを調べた直後に、別の接続が同じ名前とスラッグの行を作ったことにする。"""
+        table = model._meta.db_table
+        raced = []
+
+        def create_competitor(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if not raced and sql.startswith(f'SELECT COUNT("{table}"."id") FILTER'):
+                raced.append(model.objects.create(name=name, slug=slug))
+            return result
+
+        return connection.execute_wrapper(create_competitor), raced
+
+    def test_concurrently_created_rows_are_reused(self):
+        for model, data, name, slug in (
+            (Tag, {'new_tags': 'Django'}, 'Django', 'django'),
+            (Category, {'new_category': 'Python'}, 'Python', 'python'),
+        ):
+            with self.subTest(model.__name__):
+                wrapper, raced = self.race(model, name, slug)
+                with wrapper:
+                    result = self.save(**data)
+                self.assertEqual(len(raced), 1)
+                self.assertEqual(model.objects.filter(name=name).count(), 1)
+                created = result.created_tags if model is Tag else result.category_created
+                self.assertFalse(created)
+                self.assertEqual(result.tags if model is Tag else [result.category], raced)
+
+
+class CounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.travel = Category.objects.create(name='旅行', slug='travel')
+        cls.food = Category.objects.create(name='料理', slug='food')
+        cls.kyoto, cls.osaka = (
+            Tag.objects.create(name=name, slug=slug) for name, slug in (('京都', 'kyoto'), ('大阪', 'osaka'))
+        )
+
+    def counts(self):
+        return {
+            'categories': dict(Category.objects.values_list('slug', 'post_count')),
+            'tags': dict(Tag.objects.values_list('slug', 'post_count')),
+        }
+
+    def assert_counts(self, categories, tags):
+        self.assertEqual(self.counts(), {'categories': categories, 'tags': tags})
+        # 数え直しても同じ値になる
+        counters.rebuild_counts()
+        self.assertEqual(self.counts(), {'categories': categories, 'tags': tags})
+
+    def test_post_counts_follow_saves_tags_moves_and_deletes(self):
+        post = Post.objects.create(title='旅行記', body='本文', category=self.travel, status=Post.Status.PUBLISHED)
+        post.tags.add(self.kyoto, self.osaka)
+        draft = Post.objects.create(title='下書き', body='本文', category=self.travel)
+        draft.tags.add(self.kyoto)
+        self.assert_counts({'travel': 1, 'food': 0}, {'kyoto': 1, 'osaka': 1})
+
+        post.tags.remove(self.osaka)
+        self.assert_counts({'travel': 1, 'food': 0}, {'kyoto': 1, 'osaka': 0})
+        self.osaka.posts.add(post)
+        self.assert_counts({'travel': 1, 'food': 0}, {'kyoto': 1, 'osaka': 1})
+
+        post.category = self.food
+        post.save()
+        self.assert_counts({'travel': 0, 'food': 1}, {'kyoto': 1, 'osaka': 1})
+
+        post.status = Post.Status.DRAFT
+        post.save()
+        self.assert_counts({'travel': 0, 'food': 0}, {'kyoto': 0, 'osaka': 0})
+
+        draft.status = Post.Status.PUBLISHED
+        draft.save()
+        self.assert_counts({'travel': 1, 'food': 0}, {'kyoto': 1, 'osaka': 0})
+        draft.tags.clear()
+        self.assert_counts({'travel': 1, 'food': 0}, {'kyoto': 0, 'osaka': 0})
+        draft.delete()
+        self.assert_counts({'travel': 0, 'food': 0}, {'kyoto': 0, 'osaka': 0})
+
+    def test_comment_count_follows_public_comments(self):
+        post = Post.objects.create(title='旅行記', body='本文', status=Post.Status.PUBLISHED)
+
+        def comment_count():
+            post.refresh_from_db()
+            return post.comment_count
+
+        comments = [
+            Comment.objects.create(post=post, name='読者', email='reader@example.com', body=f'コメント {number}')
+            for number in range(2)
+        ]
+        self.assertEqual(comment_count(), 2)
+        comments[0].is_public = False
+        comments[0].save()
+        self.assertEqual(comment_count(), 1)
+        comments[1].delete()
+        self.assertEqual(comment_count(), 0)
+        comments[0].is_public = True
+        comments[0].save()
+        self.assertEqual(comment_count(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.march = timezone.make_aware(timezone.datetime(2024, 3, 10, 12))
+        cls.first = Post.objects.create(
+            title='三月の投稿', body='本文', status=Post.Status.PUBLISHED, published_at=cls.march
+        )
+        cls.second = Post.objects.create(title='最近の投稿', body='本文', status=Post.Status.PUBLISHED)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_archive_pages_are_exported(self):
+        pages = export.collect_pages()
+        year = timezone.localdate().year
+        for url in (
+            reverse('posts:archive_year', kwargs={'year': 2024}),
+            reverse('posts:archive_month', kwargs={'year': 2024, 'month': 3}),
+            reverse('posts:archive_year', kwargs={'year': year}),
+        ):
+            with self.subTest(url):
+                self.assertIn(url, pages)
+        content = export.render_page(reverse('posts:archive_month', kwargs={'year': 2024, 'month': 3}))
+        self.assertIn('三月の投稿', content.decode())
+
+    def test_fingerprints_follow_sidebar_and_related_posts(self):
+        list_url = reverse('posts:post_list')
+        detail_url = self.first.get_absolute_url()
+        before = export.collect_pages()
+
+        RelatedPost.objects.create(post=self.first, related=self.second, rank=1, score=1.0)
+        after = export.collect_pages()
+        self.assertNotEqual(after[detail_url], before[detail_url])
+        self.assertEqual(after[list_url], before[list_url])
+
+        PostDailyViews.objects.create(post=self.second, day=timezone.localdate(), views=3)
+        popularity.refresh_rankings()
+        ranked = export.collect_pages()
+        self.assertNotEqual(ranked[list_url], after[list_url])
+
+        # 別の月の投稿が増えると、どの一覧でもサイドバーの月別アーカイブが変わる
+        Post.objects.create(
+            title='二月の投稿', body='本文', status=Post.Status.PUBLISHED,
+            published_at=self.march - timedelta(days=30),
+        )
+        march_url = reverse('posts:archive_month', kwargs={'year': 2024, 'month': 3})
+        self.assertNotEqual(export.collect_pages()[march_url], ranked[march_url])
+
+
+@override_settings(ADMIN_COUNT_LIMIT=10)
+class PostAdminTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.tags = [Tag.objects.create(name=f'タグ{number:02}', slug=f'tag-{number}') for number in range(20)]
+        for number in range(12):
+            post = Post.objects.create(title=f'投稿 {number}', body='本文', status=Post.Status.PUBLISHED)
+            post.tags.add(*cls.tags[:number % 3 + 1])
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.url = reverse('admin:posts_post_changelist')
+
+    def test_tag_filter_lists_top_tags_only(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, 'タグ00')
+        self.assertNotContains(response, 'タグ19')
+        self.assertEqual(response.context['cl'].result_count, 10)
+        self.assertTrue(response.context['cl'].count_is_bounded)
+
+        # 選択中のタグは上位になくても表示し、一覧から辿れる
+        rare = self.tags[19]
+        Post.objects.get(title='投稿 0').tags.add(rare)
+        response = self.client.get(reverse('admin:posts_tag_changelist'))
+        self.assertContains(response, f'{self.url}?tags__id__exact={rare.pk}')
+        response = self.client.get(self.url, {'tags__id__exact': rare.pk})
+        self.assertContains(response, 'タグ19')
+        self.assertEqual([post.title for post in response.context['cl'].result_list], ['投稿 0'])
+
+    def test_sorted_changelist_uses_bounded_pages(self):
+        for params in ({'o': '1'}, {'o': '1', 'all': ''}):
+            with self.subTest(**params):
+                cl = self.client.get(self.url, params).context['cl']
+                self.assertIsNone(cl.keyset_page)
+                self.assertEqual(cl.result_count, 10)
+                self.assertFalse(cl.can_show_all)
+                self.assertEqual(len(cl.result_list), 12)
+
+
+class SeedBenchTests(TestCase):
+    def test_seed_and_benchmark(self):
+        call_command(
+            'seed_bench', posts=60, tags=20, categories=3, comments=300, authors=2, images=0,
+            batch_size=25, stdout=io.StringIO(),
+        )
+        published = Post.objects.published()
+        self.assertGreater(published.count(), 40)
+        self.assertEqual(Comment.objects.count(), 300)
+        post = published.filter(comment_count__gt=0).first()
+        self.assertEqual(post.comment_count, post.comments.public().count())
+        self.assertTrue(post.summary)
+
+        out = io.StringIO()
+        call_command('benchmark', requests=2, warmup=0, samples=2, no_save=True, stdout=out)
+        self.assertIn('posts:post_detail', out.getvalue())
+        self.assertIn('posts:post_update', out.getvalue())
+
+
+ASYNC_VIEWS = {
+    'post_list': async_views.AsyncPostListView,
+    'post_detail': async_views.AsyncPostDetailView,
+    'category': async_views.AsyncCategoryPostListView,
+    'tag': async_views.AsyncTagPostListView,
+    'archive_year': async_views.AsyncYearArchivePostListView,
+    'archive_month': async_views.AsyncMonthArchivePostListView,
+}
+
+
+class AsyncURLConf:
+    """公開ページを非同期版のビューに差し替えた URLconf（ASYNC_PUBLIC_VIEWS=True と同じ構成）。"""
+
+    urlpatterns = [
+        pattern for pattern in site_urls.urlpatterns
+        if not (isinstance(pattern, URLResolver) and pattern.namespace == 'posts')
+    ] + [
+        path('', include(([
+            path(str(pattern.pattern), ASYNC_VIEWS[pattern.name].as_view(), name=pattern.name)
+            if pattern.name in ASYNC_VIEWS else pattern
+            for pattern in post_urls.urlpatterns
+        ], 'posts'))),
+    ]
+
+
+@override_settings(ROOT_URLCONF=AsyncURLConf, CACHES=LOCMEM_CACHES)
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = get_user_model().objects.create_user('author', 'author@example.com', 'password')
+        cls.category = Category.objects.create(name='日記', slug='diary')
+        cls.tag = Tag.objects.create(name='旅行', slug='travel')
+        cls.post = Post.objects.create(
+            title='京都の旅', body='本文', author=author, category=cls.category, status=Post.Status.PUBLISHED
+        )
+        cls.post.tags.add(cls.tag)
+        Comment.objects.create(post=cls.post, name='読者', email='reader@example.com', body='いいですね')
+
+    def setUp(self):
+        cache.clear()
+        self.async_client = AsyncClient()
+
+    async def test_views_are_async(self):
+        for name in ('post_list', 'post_detail', 'category', 'tag'):
+            with self.subTest(name):
+                self.assertTrue(ASYNC_VIEWS[name].view_is_async)
+
+    async def test_list_pages(self):
+        for url in (
+            reverse('posts:post_list'),
+            reverse('posts:category', kwargs={'slug': 'diary'}),
+            reverse('posts:tag', kwargs={'slug': 'travel'}),
+        ):
+            with self.subTest(url):
+                response = await self.async_client.get(url)
+                self.assertContains(response, '京都の旅')
+                self.assertContains(response, '日記')
+
+    async def test_unknown_taxonomy_is_404(self):
+        response = await self.async_client.get(reverse('posts:category', kwargs={'slug': 'missing'}))
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(reverse('posts:tag', kwargs={'slug': 'missing'}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_archive_pages(self):
+        published_at = timezone.localtime(self.post.published_at)
+        for kwargs in ({'year': published_at.year}, {'year': published_at.year, 'month': published_at.month}):
+            name = 'posts:archive_month' if 'month' in kwargs else 'posts:archive_year'
+            with self.subTest(name):
+                response = await self.async_client.get(reverse(name, kwargs=kwargs))
+                self.assertContains(response, '京都の旅')
+                response = await self.async_client.get(reverse(name, kwargs={**kwargs, 'year': 1999}))
+                self.assertEqual(response.status_code, 404)
+
+    async def test_detail_page(self):
+        response = await self.async_client.get(self.post.get_absolute_url())
+        self.assertContains(response, '京都の旅')
+        self.assertContains(response, 'いいですね')
+        self.assertContains(response, '#旅行')
+        response = await self.async_client.get(reverse('posts:post_detail', kwargs={'slug': 'missing'}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_conditional_get_and_page_cache(self):
+        url = self.post.get_absolute_url()
+        first = await self.async_client.get(url)
+        not_modified = await self.async_client.get(url, headers={'If-None-Match': first['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+
+        # 2 回目はページキャッシュから返すので、CSRF トークンを除いて同じ内容になる
+        second = await self.async_client.get(url)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotIn(b'__page_cache_csrf_token__', second.content)
@@ -0,0 +1,38 @@
+"""本文から一覧表示用の統計値と要約を作るヘルパー。"""
+from django.utils.text import Truncator
+
+# 読了時間の目安（1 分あたりの文字数）
+CHARS_PER_MINUTE = 500
+SUMMARY_LENGTH = 120
+
+
+def reading_stats(body: str):
+    """本文の文字数と読了分数を返します。"""
+    char_count = len(body or '')
+    return char_count, round(char_count / CHARS_PER_MINUTE)
+
+
+def make_summary(excerpt: str, body: str) -> str:
+    """抜粋があればそのまま、なければ本文の先頭を切り詰めて要約にします。"""
+    if excerpt and excerpt.strip():
+        return excerpt.strip()
+    return Truncator(' '.join((body or '').split())).chars(SUMMARY_LENGTH)
+
+
+def backfill_text_stats(queryset, batch_size=500) -> int:
+    """クエリセットの投稿について統計値と要約を計算し直し、更新した件数を返します。"""
+    fields = ['char_count', 'reading_minutes', 'summary']
+    updated = 0
+    batch = []
+    for post in queryset.only('pk', 'excerpt', 'body').iterator(chunk_size=batch_size):
+        post.char_count, post.reading_minutes = reading_stats(post.body)
+        post.summary = make_summary(post.excerpt, post.body)
+        batch.append(post)
+        if len(batch) >= batch_size:
+            queryset.bulk_update(batch, fields)
+            updated += len(batch)
+            batch = []
+    if batch:
+        queryset.bulk_update(batch, fields)
+        updated += len(batch)
+    return updated
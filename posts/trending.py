@@ -0,0 +1,105 @@
+"""
+時間減衰付きのトレンドスコア。
+
+直近 `WINDOW_DAYS` 日の投稿とコメントを、半減期 `HALF_LIFE_DAYS` の指数減衰で重み付けして
+タグごとに合算し、`Tag.trending_score` に保存します。集計は定期実行（`refresh_trending`
+コマンド）で行い、リクエスト時には上位数件を読むだけにします。上位のタグの顔ぶれや順位が
+変わったときだけ、サイドバーが使う 'trending' のコンテンツバージョンを進めます。
+"""
+import math
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from comments.models import Comment
+from core.cache import bump
+
+from .models import Post, Tag
+
+WINDOW_DAYS = 30
+HALF_LIFE_DAYS = 3.0
+POST_WEIGHT = 1.0
+COMMENT_WEIGHT = 0.3
+# サイドバーに表示するトレンドタグの件数と並び順
+TRENDING_LIMIT = 4
+TRENDING_ORDERING = ('-trending_score', '-post_count', 'name')
+
+
+def _decay(age: timedelta) -> float:
+    days = max(age.total_seconds(), 0) / 86400
+    return math.exp(-math.log(2) * days / HALF_LIFE_DAYS)
+
+
+def compute_scores(now=None, using=DEFAULT_DB_ALIAS) -> dict:
+    now = now or timezone.now()
+    since = now - timedelta(days=WINDOW_DAYS)
+    scores = defaultdict(float)
+
+    post_tags = (
+        Post.tags.through.objects.using(using)
+        .filter(post__in=Post.objects.published().filter(published_at__gte=since))
+        .values_list('post_id', 'tag_id', 'post__published_at')
+    )
+    tags_by_post = defaultdict(list)
+    for post_id, tag_id, published_at in post_tags:
+        tags_by_post[post_id].append(tag_id)
+        scores[tag_id] += POST_WEIGHT * _decay(now - published_at)
+
+    # コメントは投稿・日ごとに集計してから減衰をかける
+    daily_comments = (
+        Comment.objects.using(using)
+        .public()
+        .filter(created_at__gte=since, post__in=Post.objects.published())
+        .annotate(day=TruncDate('created_at'))
+        .order_by()
+        .values_list('post_id', 'day')
+        .annotate(count=Count('pk'))
+    )
+    rows = list(daily_comments)
+    missing = {post_id for post_id, _, _ in rows if post_id not in tags_by_post}
+    if missing:
+        extra = (
+            Post.tags.through.objects.using(using)
+            .filter(post_id__in=missing)
+            .values_list('post_id', 'tag_id')
+        )
+        for post_id, tag_id in extra:
+            tags_by_post[post_id].append(tag_id)
+    for post_id, day, count in rows:
+        midday = timezone.make_aware(datetime.combine(day, time(12)))
+        weight = COMMENT_WEIGHT * count * _decay(now - midday)
+        for tag_id in tags_by_post.get(post_id, ()):
+            scores[tag_id] += weight
+    return scores
+
+
+def _top_tag_ids(using) -> list:
+    return list(
+        Tag.objects.using(using).order_by(*TRENDING_ORDERING).values_list('pk', flat=True)[:TRENDING_LIMIT]
+    )
+
+
+def refresh_trending(now=None, using=DEFAULT_DB_ALIAS) -> int:
+    """トレンドスコアを計算し直して保存します。スコアを持つタグの数を返します。"""
+    scores = compute_scores(now=now, using=using)
+    with transaction.atomic(using=using):
+        before = _top_tag_ids(using)
+        Tag.objects.using(using).exclude(pk__in=scores).exclude(trending_score=0).update(
+            trending_score=0
+        )
+        tags = list(Tag.objects.using(using).filter(pk__in=scores).only('pk', 'trending_score'))
+        for tag in tags:
+            tag.trending_score = round(scores[tag.pk], 6)
+        Tag.objects.using(using).bulk_update(tags, ['trending_score'], batch_size=500)
+        if _top_tag_ids(using) != before:
+            bump('trending', using=using)
+    return len(tags)
+
+
+def trending_tags(limit=TRENDING_LIMIT):
+    """サイドバー用のトレンドタグ。スコアがない場合は投稿数の多い順になります。"""
+    return Tag.objects.only('name', 'slug', 'post_count').order_by(*TRENDING_ORDERING)[:limit]
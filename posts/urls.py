@@ -1,25 +1,56 @@
+from django.conf import settings
 from django.urls import path
 
+from . import async_views
+from .feeds import (
+    CategoryAtomFeed,
+    CategoryFeed,
+    LatestPostsAtomFeed,
+    LatestPostsFeed,
+    TagAtomFeed,
+    TagFeed,
+    syndication_cache,
+)
 from .views import (
     CategoryPostListView,
+    MonthArchivePostListView,
     MyPostListView,
     PostCreateView,
     PostDeleteView,
     PostDetailView,
     PostListView,
+    PostSearchView,
     PostUpdateView,
     TagPostListView,
+    YearArchivePostListView,
 )
 
+
+def public_view(view_class):
+    """公開ページのビュー。ASGI で動かすときは非同期版（blog/asgi.py）を使う。"""
+    if settings.ASYNC_PUBLIC_VIEWS:
+        view_class = getattr(async_views, f'Async{view_class.__name__}')
+    return view_class.as_view()
+
+
 app_name = 'posts'
 
 urlpatterns = [
-    path('', PostListView.as_view(), name='post_list'),
+    path('', public_view(PostListView), name='post_list'),
+    path('search/', PostSearchView.as_view(), name='search'),
+    path('feed/', syndication_cache(LatestPostsFeed()), name='feed'),
+    path('feed/atom/', syndication_cache(LatestPostsAtomFeed()), name='atom_feed'),
     path('manage/', MyPostListView.as_view(), name='manage_post_list'),
     path('manage/new/', PostCreateView.as_view(), name='post_create'),
     path('manage/<slug:slug>/edit/', PostUpdateView.as_view(), name='post_update'),
     path('manage/<slug:slug>/delete/', PostDeleteView.as_view(), name='post_delete'),
-    path('category/<slug:slug>/', CategoryPostListView.as_view(), name='category'),
-    path('tag/<slug:slug>/', TagPostListView.as_view(), name='tag'),
-    path('<slug:slug>/', PostDetailView.as_view(), name='post_detail'),
+    path('category/<slug:slug>/', public_view(CategoryPostListView), name='category'),
+    path('category/<slug:slug>/feed/', syndication_cache(CategoryFeed()), name='category_feed'),
+    path('category/<slug:slug>/feed/atom/', syndication_cache(CategoryAtomFeed()), name='category_atom_feed'),
+    path('tag/<slug:slug>/', public_view(TagPostListView), name='tag'),
+    path('tag/<slug:slug>/feed/', syndication_cache(TagFeed()), name='tag_feed'),
+    path('tag/<slug:slug>/feed/atom/', syndication_cache(TagAtomFeed()), name='tag_atom_feed'),
+    path('archive/<int:year>/', public_view(YearArchivePostListView), name='archive_year'),
+    path('archive/<int:year>/<int:month>/', public_view(MonthArchivePostListView), name='archive_month'),
+    path('<slug:slug>/', public_view(PostDetailView), name='post_detail'),
 ]
@@ -1,39 +1,102 @@
+from asgiref.sync import sync_to_async
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.db import router
+from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
-from django.utils.text import slugify
-from django.views.generic import DetailView, ListView
+from django.views.generic import DetailView, ListView, TemplateView
 from django.views.generic.edit import CreateView, DeleteView, UpdateView
 
+from comments import spool
 from comments.forms import CommentForm
+from comments.views import comment_page
+from core.cache import CachedPageMixin, ConditionalGetMixin
+from core.db import write_with_retry
+from core.pagination import InvalidCursor, KeysetPaginationMixin
 
+from . import counters, popularity, search, taxonomy, trending
 from .forms import PostForm
-from .models import Category, Post, Tag
+from .models import Category, Post, PostArchiveMonth, Tag
 
 
-class PostListView(ListView):
+# サイドバーの人気記事（直近 POPULAR_DAYS 日の閲覧数の上位）
+POPULAR_DAYS = 7
+POPULAR_LIMIT = 5
+
+
+class CountViewMixin:
+    """
+    詳細ページの閲覧を数えます（posts.popularity）。
+
+    ページキャッシュや 304 で応答した場合も数えるので、ほかのミックスインより前に置きます。
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.view_is_async:
+            return self._adispatch_counted(request, *args, **kwargs)
+        response = super().dispatch(request, *args, **kwargs)
+        if self.is_counted(request, response):
+            popularity.record_view(self.kwargs[self.slug_url_kwarg])
+        return response
+
+    async def _adispatch_counted(self, request, *args, **kwargs):
+        response = await super().dispatch(request, *args, **kwargs)
+        if self.is_counted(request, response) and popularity.count_view(self.kwargs[self.slug_url_kwarg]):
+            await sync_to_async(popularity.flush)()
+        return response
+
+    def is_counted(self, request, response):
+        return (
+            request.method == 'GET'
+            and response.status_code in (200, 304)
+            and not getattr(request, 'static_export', False)
+        )
+
+
+def popular_posts():
+    return Post.objects.popular(POPULAR_DAYS).only('title', 'slug', 'published_at')[:POPULAR_LIMIT]
+
+
+class PostListView(ConditionalGetMixin, CachedPageMixin, KeysetPaginationMixin, ListView):
     model = Post
+    # 公開ページの読み込みはリードレプリカに振り分ける（core.routers）
+    use_replica = True
     template_name = 'posts/post_list.html'
     context_object_name = 'posts'
     paginate_by = 10
 
     def get_queryset(self):
+        # 一覧では本文を使わないので DB から読み出さない。タグはカードの断片キャッシュにない投稿の分だけ
+        # post_cards タグが読み込む
         return (
             Post.objects.published()
+            .defer('body')
             .select_related('author', 'category')
-            .prefetch_related('tags')
         )
 
+    def get_page_cache_namespaces(self):
+        # 'popular' はサイドバーの人気記事、'trending' はトレンドタグ（posts.popularity と
+        # posts.trending が、表示する顔ぶれや順位が変わったときだけ進める）
+        return ['posts', 'taxonomy', 'popular', 'trending']
+
+    def get_content_timestamp(self):
+        # 公開予約の投稿も公開時に posts.publishing がバージョンを進めるので、
+        # 最終更新日時は get_last_modified() だけで決まる（クエリを発行しない）
+        return 0
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['categories'] = Category.objects.all()
-        context['tags'] = Tag.objects.all()
+        context['trending_tags'] = trending.trending_tags()
+        context['popular_posts'] = popular_posts()
+        context['archive_months'] = PostArchiveMonth.objects.all()
         return context
 
 
-class PostDetailView(DetailView):
+class PostDetailView(CountViewMixin, ConditionalGetMixin, CachedPageMixin, DetailView):
     model = Post
+    use_replica = True
     template_name = 'posts/post_detail.html'
     context_object_name = 'post'
     slug_field = 'slug'
@@ -46,12 +109,62 @@ class PostDetailView(DetailView):
             .prefetch_related('tags')
         )
 
+    def get_page_cache_namespaces(self):
+        return [f'post:{self.kwargs["slug"]}', 'taxonomy']
+
+    def get_content_timestamp(self):
+        row = (
+            Post.objects.published()
+            .filter(slug=self.kwargs['slug'])
+            .values_list('published_at', 'updated_at')
+            .first()
+        )
+        if row is None:
+            return None
+        return max(row).timestamp()
+
+    def conditional_get_enabled(self, request):
+        return not spool.pending_ids(request) and super().conditional_get_enabled(request)
+
+    def page_cache_enabled(self, request):
+        # 取り込み待ちのコメントがある投稿者には、共有のキャッシュを返さない
+        return not spool.pending_ids(request) and super().page_cache_enabled(request)
+
+    def get(self, request, *args, **kwargs):
+        return self.clear_pending_cookie(super().get(request, *args, **kwargs))
+
+    def clear_pending_cookie(self, response):
+        if self.pending_ids and not self.pending_comments_left:
+            response.delete_cookie(spool.PENDING_COOKIE, samesite='Lax')
+        return response
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['comments'] = self.object.comments.public()
-        context['form'] = CommentForm()
+        try:
+            page = comment_page(self.object, self.request.GET.get('comments'))
+        except InvalidCursor:
+            raise Http404('無効なページです。')
+        self.pending_ids = spool.pending_ids(self.request)
+        context.update(self.get_comments_context(page, spool.pending(self.pending_ids)))
+        context['related_posts'] = list(self.get_related_posts())
         return context
 
+    def get_related_posts(self):
+        return Post.objects.related_to(self.kwargs[self.slug_url_kwarg]).only('title', 'slug', 'published_at')
+
+    def get_comments_context(self, page, pending):
+        comments = list(page.object_list)
+        self.pending_comments_left = bool(pending)
+        # 投稿者自身のコメントは、スプールから取り込まれる前でも最後のページに表示する
+        if not page.has_next():
+            imported = {comment.spool_id.hex for comment in comments if comment.spool_id}
+            comments += [
+                dict(record, is_pending=True)
+                for record in pending
+                if record['post_id'] == self.object.pk and record['spool_id'] not in imported
+            ]
+        return {'comments': comments, 'comments_page': page, 'form': CommentForm()}
+
 
 class CategoryPostListView(PostListView):
     def get_queryset(self):
@@ -77,6 +190,69 @@ class TagPostListView(PostListView):
         return context
 
 
+def archive_range(year, month=None):
+    """年（または年月）の published_at の範囲を、filter() の引数の辞書で返します。"""
+    try:
+        if month is None:
+            start, _ = counters.month_range(year, 1)
+            end, _ = counters.month_range(year + 1, 1)
+        else:
+            start, end = counters.month_range(year, month)
+    except (ValueError, OverflowError):
+        raise Http404('無効な日付です。')
+    # 投稿数は集計表から読み、一覧は published_at のインデックスを範囲で引く
+    return {'published_at__gte': start, 'published_at__lt': end}
+
+
+class YearArchivePostListView(PostListView):
+    def get_queryset(self):
+        queryset = super().get_queryset().filter(**archive_range(self.kwargs['year']))
+        self.year_months = list(PostArchiveMonth.objects.filter(year=self.kwargs['year']))
+        if not self.year_months:
+            raise Http404('投稿がありません。')
+        return queryset
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['year_months'] = self.year_months
+        return context
+
+
+class MonthArchivePostListView(PostListView):
+    def get_queryset(self):
+        queryset = super().get_queryset().filter(**archive_range(self.kwargs['year'], self.kwargs['month']))
+        self.archive_month = get_object_or_404(
+            PostArchiveMonth, year=self.kwargs['year'], month=self.kwargs['month']
+        )
+        return queryset
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['archive_month'] = self.archive_month
+        return context
+
+
+class PostSearchView(TemplateView):
+    template_name = 'posts/post_search.html'
+    paginate_by = 10
+    use_replica = True
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        query = self.request.GET.get('q', '').strip()
+        page = search.search(
+            query,
+            limit=self.paginate_by,
+            cursor=self.request.GET.get('cursor'),
+            # 生 SQL はルーターを通らないので、読み込み先をここで決める
+            using=router.db_for_read(Post),
+        )
+        context['query'] = query
+        context['results'] = page.results
+        context['next_cursor'] = page.next_cursor
+        return context
+
+
 class AuthorRequiredMixin(UserPassesTestMixin):
     def test_func(self):
         post = self.get_object()
@@ -94,135 +270,43 @@ class MyPostListView(LoginRequiredMixin, ListView):
     def get_queryset(self):
         return (
             Post.objects.filter(author=self.request.user)
-            .select_related('category')
-            .prefetch_related('tags')
+            .only('title', 'slug', 'status', 'published_at', 'updated_at', 'comment_count')
             .order_by('-updated_at')
         )
 
 
-class PostCreateView(LoginRequiredMixin, CreateView):
+class PostFormMixin:
     model = Post
     form_class = PostForm
     template_name = 'posts/manage/post_form.html'
+    success_message = ''
+
+    def get_post_author(self):
+        return None
 
     def form_valid(self, form):
-        post = form.save(commit=False)
-        post.author = self.request.user
-        
-        # 新しいカテゴリを作成
-        new_category_name = form.cleaned_data.get('new_category', '').strip()
-        if new_category_name:
-            category_slug = slugify(new_category_name)
-            # スラッグが重複する場合は番号を追加
-            base_slug = category_slug
-            counter = 2
-            while Category.objects.filter(slug=category_slug).exists():
-                category_slug = f'{base_slug}-{counter}'
-                counter += 1
-            category = Category.objects.create(
-                name=new_category_name,
-                slug=category_slug
-            )
-            post.category = category
-            messages.success(self.request, f'新しいカテゴリ「{new_category_name}」を作成しました。')
-        
-        post.save()
-        form.save_m2m()
-        
-        # 新しいタグを作成
-        new_tags_str = form.cleaned_data.get('new_tags', '').strip()
-        if new_tags_str:
-            tag_names = [tag.strip() for tag in new_tags_str.split(',') if tag.strip()]
-            created_tags = []
-            for tag_name in tag_names:
-                # 既に存在するタグを大文字小文字を区別せずに検索
-                try:
-                    tag = Tag.objects.get(name__iexact=tag_name)
-                except Tag.DoesNotExist:
-                    # タグが存在しない場合は作成
-                    tag_slug = slugify(tag_name)
-                    # スラッグが重複する場合は番号を追加
-                    base_slug = tag_slug
-                    counter = 2
-                    while Tag.objects.filter(slug=tag_slug).exists():
-                        tag_slug = f'{base_slug}-{counter}'
-                        counter += 1
-                    tag = Tag.objects.create(
-                        name=tag_name,
-                        slug=tag_slug
-                    )
-                    created_tags.append(tag_name)
-                # タグを投稿に追加
-                post.tags.add(tag)
-            
-            if created_tags:
-                messages.success(self.request, f'新しいタグ「{", ".join(created_tags)}」を作成しました。')
-        
-        messages.success(self.request, '投稿を作成しました。')
+        result = write_with_retry(
+            taxonomy.save_post_with_taxonomy, form, author=self.get_post_author()
+        )
+        if result.category_created:
+            messages.success(self.request, f'新しいカテゴリ「{result.category.name}」を作成しました。')
+        if result.created_tags:
+            messages.success(self.request, f'新しいタグ「{", ".join(result.created_tags)}」を作成しました。')
+        messages.success(self.request, self.success_message)
         return redirect('posts:manage_post_list')
 
 
-class PostUpdateView(LoginRequiredMixin, AuthorRequiredMixin, UpdateView):
-    model = Post
-    form_class = PostForm
-    template_name = 'posts/manage/post_form.html'
+class PostCreateView(LoginRequiredMixin, PostFormMixin, CreateView):
+    success_message = '投稿を作成しました。'
+
+    def get_post_author(self):
+        return self.request.user
+
+
+class PostUpdateView(LoginRequiredMixin, AuthorRequiredMixin, PostFormMixin, UpdateView):
     slug_field = 'slug'
     slug_url_kwarg = 'slug'
-
-    def form_valid(self, form):
-        post = form.save(commit=False)
-        
-        # 新しいカテゴリを作成
-        new_category_name = form.cleaned_data.get('new_category', '').strip()
-        if new_category_name:
-            category_slug = slugify(new_category_name)
-            # スラッグが重複する場合は番号を追加
-            base_slug = category_slug
-            counter = 2
-            while Category.objects.filter(slug=category_slug).exists():
-                category_slug = f'{base_slug}-{counter}'
-                counter += 1
-            category = Category.objects.create(
-                name=new_category_name,
-                slug=category_slug
-            )
-            post.category = category
-            messages.success(self.request, f'新しいカテゴリ「{new_category_name}」を作成しました。')
-        
-        post.save()
-        form.save_m2m()
-        
-        # 新しいタグを作成
-        new_tags_str = form.cleaned_data.get('new_tags', '').strip()
-        if new_tags_str:
-            tag_names = [tag.strip() for tag in new_tags_str.split(',') if tag.strip()]
-            created_tags = []
-            for tag_name in tag_names:
-                # 既に存在するタグを大文字小文字を区別せずに検索
-                try:
-                    tag = Tag.objects.get(name__iexact=tag_name)
-                except Tag.DoesNotExist:
-                    # タグが存在しない場合は作成
-                    tag_slug = slugify(tag_name)
-                    # スラッグが重複する場合は番号を追加
-                    base_slug = tag_slug
-                    counter = 2
-                    while Tag.objects.filter(slug=tag_slug).exists():
-                        tag_slug = f'{base_slug}-{counter}'
-                        counter += 1
-                    tag = Tag.objects.create(
-                        name=tag_name,
-                        slug=tag_slug
-                    )
-                    created_tags.append(tag_name)
-                # タグを投稿に追加
-                post.tags.add(tag)
-            
-            if created_tags:
-                messages.success(self.request, f'新しいタグ「{", ".join(created_tags)}」を作成しました。')
-        
-        messages.success(self.request, '投稿を更新しました。')
-        return redirect('posts:manage_post_list')
+    success_message = '投稿を更新しました。'
 
     def get_success_url(self):
         return reverse('posts:manage_post_list')
@@ -0,0 +1,21 @@
+// 「さらに表示」でコメントの続きを断片として読み込み、その場に差し込む
+document.addEventListener('click', async (event) => {
+  const link = event.target.closest('[data-comments-more] a[data-fragment-url]');
+  if (!link) {
+    return;
+  }
+  event.preventDefault();
+  const container = link.closest('[data-comments-more]');
+  link.setAttribute('aria-busy', 'true');
+  try {
+    const response = await fetch(link.dataset.fragmentUrl, { headers: { Accept: 'text/html' } });
+    if (!response.ok) {
+      throw new Error(response.statusText);
+    }
+    container.insertAdjacentHTML('afterend', await response.text());
+    container.remove();
+  } catch (error) {
+    // 読み込めなければ通常のページ遷移に任せる
+    window.location.href = link.href;
+  }
+});